@@ -0,0 +1,124 @@
+"""
+measures throughput and delivery of broadcasts to many chats under telegram flood limits against the telegram
+stand-in: one call per chat in a loop and all at once (previous implementations) against broadcast.Broadcaster
+
+usage (from the code directory):
+    python -m benchmarks.broadcast [--chats 200] [--latency 30]
+"""
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot
+
+from broadcast import Broadcaster
+from telegram_stand_in import TelegramStandIn
+
+TOKEN = "42:stand-in"
+
+
+async def direct(method, /, *args, **kwargs):
+    # the send of previous implementations, calls are neither paced nor repeated
+    return await method(*args, **kwargs)
+
+
+async def sequential(actions: dict) -> int:
+    failed = 0
+    for action in actions.values():
+        try:
+            await action(direct)
+        except Exception:
+            failed += 1
+    return failed
+
+
+async def gathered(actions: dict) -> int:
+    results = await asyncio.gather(*(action(direct) for action in actions.values()), return_exceptions=True)
+    return sum(isinstance(result, Exception) for result in results)
+
+
+async def broadcaster(actions: dict) -> int:
+    return (await Broadcaster().broadcast(actions)).failed
+
+
+STRATEGIES = {
+    "sequential": sequential,
+    "gather": gathered,
+    "broadcaster": broadcaster,
+}
+
+
+class Chats:
+    """
+    messages the bot shows in every chat, as handlers keep them in last_message
+    """
+
+    def __init__(self, bot: Bot, telegram: TelegramStandIn, chat_ids: list[int]):
+        self._bot = bot
+        self._telegram = telegram
+        self.chat_ids = chat_ids
+        self.messages: dict[int, int] = {}
+        self.expected: dict[int, str | None] = {}
+
+    def send(self, chat_id, text):
+        # a new menu, like joining users get
+        async def action(send):
+            self.expected[chat_id] = text
+            self.messages[chat_id] = (await send(self._bot.send_message, chat_id=chat_id, text=text)).message_id
+        return action
+
+    def edit(self, chat_id, text):
+        # a menu refreshed after a track change
+        async def action(send):
+            self.expected[chat_id] = text
+            await send(self._bot.edit_message_text, chat_id=chat_id, message_id=self.messages[chat_id], text=text)
+        return action
+
+    def replace(self, chat_id, text):
+        # the goodbye of end_session: a new message and deletion of the menu
+        async def action(send):
+            old = self.messages[chat_id]
+            await self.send(chat_id, text)(send)
+            await self._bot.delete_message(chat_id=chat_id, message_id=old)
+        return action
+
+    def delivered(self) -> int:
+        return sum(self._telegram.text(chat_id, self.messages.get(chat_id)) == self.expected.get(chat_id)
+                   and chat_id in self.messages for chat_id in self.chat_ids)
+
+
+async def run_strategy(name, strategy, args):
+    telegram = TelegramStandIn(latency=args.latency / 1000)
+    bot = Bot(TOKEN, session=telegram)
+    chats = Chats(bot, telegram, list(range(1, args.chats + 1)))
+    for phase, make_action in (("send", chats.send), ("edit", chats.edit), ("end", chats.replace)):
+        rate_limited = sum(telegram.rate_limited.values())
+        actions = {chat_id: make_action(chat_id, f"{phase} {chat_id}") for chat_id in chats.chat_ids
+                   if phase == "send" or chat_id in chats.messages}
+        start = time.perf_counter()
+        failed = await strategy(actions)
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<12}{phase:<6}{elapsed:>9.2f}{len(actions) / elapsed:>10.1f}"
+              f"{sum(telegram.rate_limited.values()) - rate_limited:>8}{failed:>8}{chats.delivered():>11}")
+        # the next phase starts once per chat limits are restored
+        await asyncio.sleep(TelegramStandIn.PER_CHAT_BURST / TelegramStandIn.PER_CHAT_RATE)
+
+
+async def run(args):
+    print(f"{args.chats} chats, telegram latency {args.latency} ms, limits {TelegramStandIn.GLOBAL_RATE} msg/s "
+          f"per bot and {TelegramStandIn.PER_CHAT_RATE} msg/s per chat")
+    print(f"  {'strategy':<12}{'phase':<6}{'time s':>9}{'chats/s':>10}{'429s':>8}{'failed':>8}{'delivered':>11}")
+    for name, strategy in STRATEGIES.items():
+        await run_strategy(name, strategy, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=30, help="latency of a bot api call, ms")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+compares cpu time of building menu markups for every user of a broadcast (previous implementation)
+against the prebuilt markups of keyboards
+
+usage (from the code directory):
+    python -m benchmarks.keyboards [--users 1000]
+"""
+import argparse
+import random
+import statistics
+import time
+
+import keyboards
+
+
+def rebuilt(is_admin: bool, share_mode: bool):
+    # undecorated builders make a new markup on every call, as handlers did before
+    if is_admin:
+        return keyboards.admin_menu_keyboard.__wrapped__()
+    return keyboards.user_menu_keyboard.__wrapped__(share_mode)
+
+
+def prebuilt(is_admin: bool, share_mode: bool):
+    if is_admin:
+        return keyboards.admin_menu_keyboard()
+    return keyboards.user_menu_keyboard(share_mode)
+
+
+FACTORIES = {
+    "rebuilt": rebuilt,
+    "prebuilt": prebuilt,
+}
+
+
+def broadcast(factory, users: list[bool], share_mode: bool) -> float:
+    start = time.process_time()
+    for is_admin in users:
+        factory(is_admin, share_mode)
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--admins", type=float, default=0.05, help="share of admins among users")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    users = [rnd.random() < args.admins for _ in range(args.users)]
+    print(f"{args.users} users, {sum(users)} admins, mode switched every broadcast")
+    print(f"  {'markups':<10}{'median cpu ms':>15}{'min cpu ms':>12}")
+    for name, factory in FACTORIES.items():
+        samples = [broadcast(factory, users, share_mode=bool(step % 2)) for step in range(args.repeat)]
+        print(f"  {name:<10}{statistics.median(samples) * 1000:>15.2f}{min(samples) * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+compares lyrics extraction from genius song pages: full BeautifulSoup parse (previous implementation)
+against lyrics_find_engine.extract_lyrics
+
+usage (from the code directory):
+    python -m benchmarks.lyrics_extraction [saved_page.html ...]
+
+without arguments the pages saved in tests/pages and a large synthetic page shaped like a genius song page are used
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import random
+import re
+import resource
+import statistics
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from lyrics_find_engine import extract_lyrics
+
+SAVED_PAGES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "pages", "*.html")
+
+
+def legacy_extract_lyrics(page: str) -> str | None:
+    html = BeautifulSoup(page.replace('<br/>', '\n'), "lxml")
+    div = html.find("div", class_=re.compile("^lyrics$|Lyrics__Root"))
+    if div is None:
+        return None
+    return div.get_text()
+
+
+EXTRACTORS = {
+    "beautifulsoup": legacy_extract_lyrics,
+    "lxml_xpath": extract_lyrics,
+}
+
+
+def synthetic_page(seed=0) -> str:
+    rnd = random.Random(seed)
+    words = "love night baby fire heart city rain dance never forever money dream gone light".split()
+    state = '{"song": "' + 'x' * 250 + '"},'
+    head = ('<head>' + ''.join(f'<meta property="og:{i}" content="{i}"/>' for i in range(60)) +
+            f"<script>window.__PRELOADED_STATE__ = JSON.parse('[{state * 3000}]');</script>"
+            '<style>.a{color:red}</style></head>')
+    nav = ''.join(f'<div class="Header__Item-sc-{i}"><a href="/nav/{i}">link {i}</a><span>·</span></div>'
+                  for i in range(800))
+    verses = []
+    for verse in range(8):
+        lines = '<br/>'.join(f'<a href="/annotation/{verse}/{line}"><span>{" ".join(rnd.choices(words, k=7))}</span></a>'
+                             for line in range(10))
+        verses.append(f'<div data-lyrics-container="true" class="Lyrics__Container-sc-1ynbvzw-6">'
+                      f'[Verse {verse}]<br/>{lines}</div>')
+    root = (f'<div class="Lyrics__Root-sc-1ynbvzw-1 kkHBOZ"><div class="LyricsHeader__Title">Lyrics</div>'
+            f'{"".join(verses)}<div class="RightSidebar"><script>loadAd()</script><!-- ad --></div></div>')
+    comments = ''.join(f'<div class="Comment-sc-{i}"><p>comment {i} &amp; reply</p><img src="/{i}.png"/></div>'
+                       for i in range(2000))
+    return f'<!DOCTYPE html><html>{head}<body>{nav}{root}{comments}</body></html>'
+
+
+def measure_time(extractor, page, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extractor(page)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), min(samples)
+
+
+def _rss_status(field) -> int:
+    with open("/proc/self/status", "r") as file:
+        for line in file:
+            if line.startswith(field):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def _reset_peak_rss() -> bool:
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _measure_memory(name, page, queue):
+    # runs in a fresh process so that peak rss of one extractor is not hidden by another one,
+    # tracemalloc sees only python objects, rss peak includes lxml's own allocations
+    extractor = EXTRACTORS[name]
+    if _reset_peak_rss():
+        rss_before = _rss_status("VmRSS")
+    else:
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    tracemalloc.start()
+    extractor(page)
+    python_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss_after = _rss_status("VmHWM") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    queue.put((python_peak, max(0, rss_after - rss_before)))
+
+
+def measure_memory(name, page):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_measure_memory, args=(name, page, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", nargs="*", help="saved genius song pages")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    pages = {}
+    for file_name in args.pages or sorted(glob.glob(SAVED_PAGES)):
+        with open(file_name, "r", encoding="utf-8") as file:
+            pages[file_name] = file.read()
+    if not args.pages:
+        pages["synthetic"] = synthetic_page()
+
+    for page_name, page in pages.items():
+        expected = legacy_extract_lyrics(page)
+        print(f"{page_name}: {len(page) / 1024:.0f} KiB")
+        print(f"  {'extractor':<14}{'median ms':>10}{'min ms':>10}{'py peak KiB':>13}{'rss peak KiB':>14}  same output")
+        for name, extractor in EXTRACTORS.items():
+            median, best = measure_time(extractor, page, args.repeat)
+            python_peak, rss_peak = measure_memory(name, page)
+            print(f"  {name:<14}{median * 1000:>10.2f}{best * 1000:>10.2f}{python_peak / 1024:>13.0f}"
+                  f"{rss_peak / 1024:>14.0f}  {extractor(page) == expected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+drives handlers.router with synthetic users of one session against the telegram and spotify stand-ins,
+reports handler latency percentiles, outbound api calls per action including background broadcasts and memory per joined user
+
+usage (from the code directory):
+    python -m benchmarks.router_load [--users 200] [--rounds 3] [--concurrency 50] [--spotify-latency 20]
+
+nothing leaves the machine: required settings are replaced with local values before the bot modules are imported
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+_DATA_PATH = tempfile.mkdtemp(prefix="router_load_")
+os.environ.update({
+    "BOT_TOKEN": "42:stand-in",
+    "SPOTIFY_USERNAME": "stand-in",
+    "SPOTIFY_CLIENT_ID": "stand-in",
+    "SPOTIFY_CLIENT_SECRET": "stand-in",
+    "SPOTIFY_REDIRECT_URI": "http://localhost/callback",
+    "DATA_PATH": _DATA_PATH,
+    "TOKEN_FILE": os.path.join(_DATA_PATH, "token.json"),
+    "ADMIN_FILE": os.path.join(_DATA_PATH, "admins.json"),
+    "STATE_STORE": "memory",
+    # lyrics are fetched from genius, keep them out of the measurement
+    "LYRICS_PREFETCH_DEPTH": "0",
+})
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+import handlers
+from broadcast import background_updates
+from config_reader import config
+from middlewares import SessionMiddleware
+from sessions import sessions
+from spotify_stand_in import SpotifyStandIn
+from telegram_stand_in import TelegramStandIn
+
+ADMIN_ID = 1
+FIRST_USER_ID = 1000
+
+
+class SyntheticUsers:
+    """
+    builds updates telegram would send for actions of the users
+    """
+
+    def __init__(self, tracks: int, seed=0):
+        self._rnd = random.Random(seed)
+        self._tracks = tracks
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000)
+
+    @staticmethod
+    def _user(user_id) -> User:
+        return User(id=user_id, is_bot=False, first_name=f"user{user_id}", username=f"user{user_id}")
+
+    def message(self, user_id, text) -> Update:
+        message = Message(message_id=next(self._message_ids), date=datetime.now(),
+                          chat=Chat(id=user_id, type="private"), from_user=self._user(user_id), text=text)
+        return Update(update_id=next(self._update_ids), message=message)
+
+    def callback(self, user_id, data) -> Update:
+        # buttons are pressed on the last message the bot shows to the user
+        last = sessions.get(user_id).db.last_message.get(user_id)
+        message = Message(message_id=0 if last is None else last.message_id, date=datetime.now(),
+                          chat=Chat(id=user_id, type="private"), text="")
+        query = CallbackQuery(id=str(next(self._update_ids)), from_user=self._user(user_id), chat_instance="0",
+                              message=message, data=data)
+        return Update(update_id=next(self._update_ids), callback_query=query)
+
+    def join(self, user_id, token) -> Update:
+        return self.message(user_id, f"/start {token}")
+
+    def search(self, user_id, token) -> Update:
+        return self.message(user_id, f"track {self._rnd.randrange(self._tracks)}")
+
+    def add_song(self, user_id, token) -> Update:
+        results = sessions.get(user_id).db.last_request.get(user_id) or {f"{0:022d}": None}
+        uri = self._rnd.choice(list(results))
+        return self.callback(user_id, handlers.AddSongCallbackFactory(uri=uri).pack())
+
+    def menu(self, user_id, token) -> Update:
+        return self.callback(user_id, "menu")
+
+    def view_queue(self, user_id, token) -> Update:
+        return self.callback(user_id, "view_queue")
+
+    def volume(self, user_id, token) -> Update:
+        return self.callback(user_id, self._rnd.choice(["increase_volume", "decrease_volume"]))
+
+    def skip(self, user_id, token) -> Update:
+        return self.callback(user_id, "next_track")
+
+
+ACTIONS = ["search", "add_song", "menu", "view_queue", "volume", "skip"]
+
+
+class Phase:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: list[float] = []
+        self.errors = 0
+        self.telegram_calls = 0
+        self.spotify_calls = 0
+
+    def percentile(self, p: int) -> float:
+        if len(self.latencies) < 2:
+            return self.latencies[0] if self.latencies else 0.0
+        return statistics.quantiles(self.latencies, n=100, method="inclusive")[p - 1]
+
+    def row(self) -> str:
+        actions = max(1, len(self.latencies))
+        return (f"  {self.name:<12}{len(self.latencies):>8}{self.percentile(50) * 1000:>10.1f}"
+                f"{self.percentile(95) * 1000:>10.1f}{self.percentile(99) * 1000:>10.1f}"
+                f"{self.telegram_calls / actions:>12.2f}{self.spotify_calls / actions:>12.2f}{self.errors:>8}")
+
+
+async def run_phase(name, make_update, user_ids, token, dp, bot, telegram, spotify, concurrency) -> Phase:
+    phase = Phase(name)
+    semaphore = asyncio.Semaphore(concurrency)
+    telegram_before, spotify_before = telegram.total_calls, sum(spotify.requests.values())
+
+    async def act(user_id):
+        async with semaphore:
+            update = make_update(user_id, token)
+            start = time.perf_counter()
+            try:
+                await dp.feed_update(bot, update)
+            except Exception:
+                phase.errors += 1
+            phase.latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(act(user_id) for user_id in user_ids))
+    # broadcasts to the other users run after the handlers answered, their calls count in the phase
+    await background_updates.join()
+    phase.telegram_calls = telegram.total_calls - telegram_before
+    # includes polling of the player watcher running meanwhile
+    phase.spotify_calls = sum(spotify.requests.values()) - spotify_before
+    return phase
+
+
+async def start_session():
+    session = await sessions.create(ADMIN_ID, "admin")
+    # the authorization code is exchanged for a token by the spotify stand-in
+    await session.spotify.authorize(f"{config.spotify_redirect_uri.get_secret_value()}?code=router_load")
+    sessions.activate(session)
+    return session
+
+
+async def run(args):
+    spotify = SpotifyStandIn(tracks=args.tracks, latency=args.spotify_latency / 1000,
+                             jitter=args.spotify_latency / 4000)
+    runner = await spotify.serve("localhost", args.port)
+    config.spotify_api_url = f"http://localhost:{args.port}"
+    limits = {} if args.flood_limits else {"global_rate": None, "per_chat_rate": None}
+    telegram = TelegramStandIn(latency=args.telegram_latency / 1000, **limits)
+    bot = Bot(config.bot_token.get_secret_value(), session=telegram)
+    dp = Dispatcher()
+    dp.update.outer_middleware(SessionMiddleware(sessions))
+    dp.include_routers(handlers.router)
+    users = SyntheticUsers(args.tracks)
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+
+    session = await start_session()
+    try:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        phases = [await run_phase("join", users.join, user_ids, session.token, dp, bot, telegram, spotify,
+                                  args.concurrency)]
+        memory = (tracemalloc.get_traced_memory()[0] - before) / args.users
+        tracemalloc.stop()
+        for _ in range(args.rounds):
+            for name in ACTIONS:
+                phases.append(await run_phase(name, getattr(users, name), user_ids, session.token, dp, bot,
+                                              telegram, spotify, args.concurrency))
+    finally:
+        await sessions.end(session)
+        await runner.cleanup()
+
+    merged = {}
+    for phase in phases:
+        total = merged.setdefault(phase.name, Phase(phase.name))
+        total.latencies += phase.latencies
+        total.errors += phase.errors
+        total.telegram_calls += phase.telegram_calls
+        total.spotify_calls += phase.spotify_calls
+
+    print(f"{args.users} users in one session, {args.rounds} rounds, concurrency {args.concurrency}, "
+          f"spotify latency {args.spotify_latency} ms, telegram latency {args.telegram_latency} ms")
+    print(f"  {'action':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'tg calls':>12}{'sp calls':>12}{'errors':>8}")
+    for phase in merged.values():
+        print(phase.row())
+    print(f"  memory per joined user: {memory / 1024:.1f} KiB (join latency includes tracemalloc overhead)")
+    print(f"  telegram calls by method: {dict(telegram.calls.most_common())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=50, help="updates handled at the same time")
+    parser.add_argument("--tracks", type=int, default=500, help="tracks in the spotify stand-in catalog")
+    parser.add_argument("--spotify-latency", type=float, default=20, help="ms")
+    parser.add_argument("--telegram-latency", type=float, default=0, help="ms")
+    parser.add_argument("--flood-limits", action="store_true", help="hold telegram calls to its flood limits")
+    parser.add_argument("--port", type=int, default=8888, help="port of the spotify stand-in")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+compares the users queue kept as a list of (user_id, song_id) tuples (previous implementation)
+against user_queue.UserQueue on the operations the bot does with it
+
+usage (from the code directory):
+    python -m benchmarks.user_queue [--sizes 100 1000 5000]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from user_queue import UserQueue
+
+
+class LegacyUserQueue:
+    """
+    list based queue with the lookups done by handlers before UserQueue
+    """
+
+    def __init__(self, entries=()):
+        self._entries = list(entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def append(self, user_id, song_id):
+        self._entries.append((user_id, song_id))
+
+    def remove(self, user_id, song_id):
+        if (user_id, song_id) in self._entries:
+            self._entries.remove((user_id, song_id))
+            return True
+        return False
+
+    def owners(self, song_ids):
+        ids = [item[1] for item in self._entries]
+        return [None if song_id not in ids else self._entries[ids.index(song_id)][0] for song_id in song_ids]
+
+    def trim_to(self, song_id):
+        ids = [item[1] for item in self._entries]
+        if song_id not in ids:
+            self._entries = []
+            return False
+        self._entries = self._entries[ids.index(song_id):]
+        return True
+
+
+def _owners(queue: UserQueue, song_ids):
+    occurrences = {}
+    result = []
+    for song_id in song_ids:
+        occurrence = occurrences[song_id] = occurrences.get(song_id, -1) + 1
+        result.append(queue.owner(song_id, occurrence))
+    return result
+
+
+IMPLEMENTATIONS = {
+    "list": (LegacyUserQueue, lambda queue, song_ids: queue.owners(song_ids)),
+    "indexed": (UserQueue, _owners),
+}
+
+
+def make_entries(size, seed=0):
+    rnd = random.Random(seed)
+    songs = [f"spotify:track:{i:022d}" for i in range(max(1, size * 9 // 10))]
+    # about a tenth of the queue are songs queued again, by the same or another user
+    return [(rnd.randrange(50), songs[i] if i < len(songs) else rnd.choice(songs)) for i in range(size)]
+
+
+def run(factory, owners, entries, rounds):
+    """
+    one round is what the bot does per played track: render the queue with authors,
+    remove a song, then trim the queue when spotify advances
+    """
+    queue = factory()
+    start = time.perf_counter()
+    for user_id, song_id in entries:
+        queue.append(user_id, song_id)
+    timings = {"append": time.perf_counter() - start, "render": 0.0, "remove": 0.0, "trim": 0.0}
+    order = [song_id for _, song_id in entries]
+    for step in range(rounds):
+        if len(queue) == 0:
+            break
+        head = order[step:]
+        start = time.perf_counter()
+        owners(queue, head[:10])
+        timings["render"] += time.perf_counter() - start
+        user_id, song_id = entries[-1 - step]
+        start = time.perf_counter()
+        queue.remove(user_id, song_id)
+        timings["remove"] += time.perf_counter() - start
+        start = time.perf_counter()
+        queue.trim_to(head[1] if len(head) > 1 else head[0])
+        timings["trim"] += time.perf_counter() - start
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        entries = make_entries(size)
+        print(f"{size} queued entries, {args.rounds} rounds")
+        print(f"  {'queue':<10}{'append ms':>11}{'render ms':>11}{'remove ms':>11}{'trim ms':>10}")
+        for name, (factory, owners) in IMPLEMENTATIONS.items():
+            samples = [run(factory, owners, entries, args.rounds) for _ in range(args.repeat)]
+            medians = {key: statistics.median(sample[key] for sample in samples) * 1000 for key in samples[0]}
+            print(f"  {name:<10}{medians['append']:>11.2f}{medians['render']:>11.2f}"
+                  f"{medians['remove']:>11.2f}{medians['trim']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,59 @@
 import asyncio
 from config_reader import config
 from aiogram import Bot, Dispatcher
-from handlers import router
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from handlers import router, include_update_functions, METRIC_ACTIONS
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from data_base import db
+from sessions import sessions
+from broadcast import background_updates
+from scheduler import delayed_actions
+from middlewares import MetricsMiddleware, SessionMiddleware
+import metrics
 import logging
 
-logging.basicConfig(level=logging.WARNING, filename='../bot_log.log', filemode='w')
+# appended, so that the log before a crash is kept when the bot is restarted
+logging.basicConfig(level=logging.WARNING, filename='../bot_log.log', filemode='a')
+
+
+async def lead_periodic_updates(bot: Bot):
+    """
+    with several workers sharing the store only the one holding the lease runs the periodic updates,
+    it brings up the sessions started by the other workers too
+    """
+    if await sessions.lead(config.leader_lease_seconds) and config.restore_sessions:
+        for session in await sessions.restore():
+            if not session.db.has_update_functions:
+                await include_update_functions(bot, session)
+
+
+async def run_polling(bot: Bot, dp: Dispatcher):
+    await bot.delete_webhook(drop_pending_updates=True)
+    await dp.start_polling(bot)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """
+    serves updates posted by telegram, several workers may run behind a load balancer sharing the state store
+    """
+    if not config.webhook_url:
+        raise ValueError("webhook_url is required in webhook mode")
+    secret = None if config.webhook_secret is None else config.webhook_secret.get_secret_value()
+    app = web.Application()
+    # requests without the secret token header are rejected with 401
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=config.webhook_path)
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.webhook_host, config.webhook_port)
+    await site.start()
+    # pending updates are kept, every worker sets the same webhook when it starts
+    await bot.set_webhook(config.webhook_url.rstrip('/') + config.webhook_path, secret_token=secret,
+                          allowed_updates=dp.resolve_used_update_types())
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 
 async def main():
@@ -14,11 +61,30 @@ async def main():
     bot = Bot(token=token)
     dp = Dispatcher()
     scheduler = AsyncIOScheduler()
-    db.add_scheduler(scheduler)
+    sessions.add_scheduler(scheduler)
+    delayed_actions.add_scheduler(scheduler)
     scheduler.start()
+    await lead_periodic_updates(bot)
+    # the lease is renewed well before it expires
+    scheduler.add_job(metrics.timed_job(lead_periodic_updates), "interval", seconds=config.leader_lease_seconds / 3,
+                      args=[bot], id="lead_periodic_updates")
+    dp.update.outer_middleware(MetricsMiddleware(METRIC_ACTIONS))
+    dp.update.outer_middleware(SessionMiddleware(sessions))
     dp.include_routers(router)
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    metrics_runner = await metrics.serve(config.metrics_host, config.metrics_port) if config.metrics_port else None
+    try:
+        if config.delivery_mode == "webhook":
+            await run_webhook(bot, dp)
+        elif config.delivery_mode == "polling":
+            await run_polling(bot, dp)
+        else:
+            raise ValueError(f"unknown delivery mode '{config.delivery_mode}'")
+    finally:
+        await background_updates.join()
+        # writes out state changes still waiting in the sessions and in the store
+        await sessions.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
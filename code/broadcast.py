@@ -0,0 +1,141 @@
+import asyncio
+import functools
+import logging
+import time
+from typing import Awaitable, Callable, Hashable
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from token_bucket import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastReport:
+
+    def __init__(self, total: int):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.errors: dict[int, Exception] = {}
+        self.latency = 0.0
+
+    def __repr__(self):
+        return (f"<BroadcastReport sent={self.sent}/{self.total} failed={self.failed} "
+                f"retries={self.retries} latency={self.latency:.3f}s>")
+
+
+class Broadcaster:
+    """
+    fans out per-chat bot api calls concurrently while keeping inside telegram flood limits
+    """
+
+    __CONCURRENCY = 25
+    __GLOBAL_RATE = 30
+    __PER_CHAT_RATE = 1
+    __PER_CHAT_BURST = 3
+    __MAX_RETRIES = 3
+
+    def __init__(self, concurrency=__CONCURRENCY, global_rate=__GLOBAL_RATE, per_chat_rate=__PER_CHAT_RATE,
+                 per_chat_burst=__PER_CHAT_BURST, max_retries=__MAX_RETRIES):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._per_chat_rate = per_chat_rate
+        self._per_chat_burst = per_chat_burst
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._max_retries = max_retries
+        self.last_report: BroadcastReport | None = None
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                self._chat_buckets = {key: value for key, value in self._chat_buckets.items() if not value.full}
+            bucket = TokenBucket(self._per_chat_rate, self._per_chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _send(self, chat_id, report: BroadcastReport, method: Callable[..., Awaitable], /, *args, **kwargs):
+        # only the call telegram refused is repeated, calls made before it by the action aren't
+        for attempt in range(self._max_retries + 1):
+            await self._chat_bucket(chat_id).acquire()
+            await self._global_bucket.acquire()
+            try:
+                return await method(*args, **kwargs)
+            except TelegramRetryAfter as error:
+                if attempt == self._max_retries:
+                    raise
+                report.retries += 1
+                await asyncio.sleep(error.retry_after)
+
+    async def _run(self, chat_id, action: Callable[[Callable], Awaitable], report: BroadcastReport):
+        async with self._semaphore:
+            try:
+                await action(functools.partial(self._send, chat_id, report))
+            except Exception as error:
+                report.failed += 1
+                report.errors[chat_id] = error
+            else:
+                report.sent += 1
+
+    async def broadcast(self, actions: dict[int, Callable[[Callable], Awaitable]]) -> BroadcastReport:
+        """
+        :param actions: chat id -> coroutine function of this chat taking send; messages are sent and edited by
+            await send(bot.send_message, ...), which keeps the call inside the flood limits and repeats it
+            when telegram asks to retry later, other calls are made directly
+        :return: report with amount of successful and failed chats and latency of the whole broadcast
+        """
+        report = BroadcastReport(len(actions))
+        start = time.perf_counter()
+        await asyncio.gather(*[self._run(chat_id, action, report) for chat_id, action in actions.items()])
+        report.latency = time.perf_counter() - start
+        self.last_report = report
+        if report.total > 0:
+            logger.info("broadcast finished: %r", report)
+        return report
+
+
+class Coalescer:
+    """
+    runs requested coroutine functions in the background one at a time per key, a request made while
+    another one of the key runs replaces the request still waiting, so a burst of them ends in one more run
+    """
+
+    def __init__(self):
+        # key -> function, its arguments and chats it leaves out
+        self._pending: dict[Hashable, tuple[Callable[..., Awaitable], tuple, frozenset]] = {}
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+
+    def schedule(self, key: Hashable, function: Callable[..., Awaitable], *args, skip=frozenset()):
+        """
+        :param skip: chats left out, passed after args; merged requests leave out only chats all of them leave out
+        """
+        skip = frozenset(skip)
+        if key in self._pending:
+            skip &= self._pending[key][2]
+        self._pending[key] = (function, args, skip)
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.get_running_loop().create_task(self._drain(key))
+
+    async def _drain(self, key):
+        try:
+            while key in self._pending:
+                function, args, skip = self._pending.pop(key)
+                try:
+                    await function(*args, *skip)
+                except Exception:
+                    logger.exception("background update %r failed", key)
+        finally:
+            self._tasks.pop(key, None)
+
+    async def join(self):
+        """
+        waits for the requests made so far, used by tests and at shutdown
+        """
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+
+broadcaster = Broadcaster()
+background_updates = Coalescer()
@@ -0,0 +1,112 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class CacheStats:
+    __slots__ = ("hits", "misses", "coalesced", "invalidations")
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses + self.coalesced
+        return (self.hits + self.coalesced) / total if total else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hit_rate, 3),
+        }
+
+
+class TTLCache:
+    """
+    async cache with time-based expiry and single-flight loading:
+    concurrent callers asking for the same missing key share one in-flight request
+    """
+
+    def __init__(self, ttl: float, max_size: int = None):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._data: OrderedDict = OrderedDict()
+        self._in_flight: dict[object, asyncio.Task] = {}
+        self.stats = CacheStats()
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def __len__(self):
+        return len(self._data)
+
+    def peek(self, key=None):
+        """
+        :return: cached value regardless of its age or None
+        """
+        item = self._data.get(key)
+        return None if item is None else item[1]
+
+    async def get(self, key, loader, *args, **kwargs):
+        """
+        :param key: cache key
+        :param loader: coroutine function called with args and kwargs on a miss
+        :return: cached or freshly loaded value
+        """
+        item = self._data.get(key)
+        if item is not None and item[0] > time.monotonic():
+            self._data.move_to_end(key)
+            self.stats.hits += 1
+            return item[1]
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self.stats.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader, *args, **kwargs))
+            self._in_flight[key] = task
+        else:
+            self.stats.coalesced += 1
+        # shield the shared request so that a cancelled caller does not cancel it for the others
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader, *args, **kwargs):
+        # the task is unregistered by invalidate(), in that case its result is stale and is not stored
+        try:
+            value = await loader(*args, **kwargs)
+        except BaseException:
+            if self._in_flight.get(key) is asyncio.current_task():
+                self._in_flight.pop(key)
+            raise
+        if self._in_flight.get(key) is asyncio.current_task():
+            self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        """
+        stores a fresh value, requests already in flight for the key are still shared but don't overwrite it
+        """
+        self._in_flight.pop(key, None)
+        self._data[key] = (time.monotonic() + self._ttl, value)
+        self._data.move_to_end(key)
+        if self._max_size is not None:
+            while len(self._data) > self._max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key=None, everything=False):
+        """
+        drops cached value, results of requests which are already in flight won't be stored
+        """
+        self.stats.invalidations += 1
+        if everything:
+            self._data.clear()
+            self._in_flight.clear()
+        else:
+            self._data.pop(key, None)
+            self._in_flight.pop(key, None)
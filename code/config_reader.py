@@ -12,6 +12,39 @@ class Settings(BaseSettings):
     data_path: SecretStr
     token_file: SecretStr
     admin_file: SecretStr
+    player_cache_ttl: float = 5
+    # spotify connection pool and retries of a single request, the budget is in seconds of waiting
+    spotify_pool_size: int = 20
+    spotify_keepalive: float = 60
+    spotify_request_timeout: float = 10
+    spotify_max_attempts: int = 4
+    spotify_retry_budget: float = 8
+    # base url of a spotify api stand-in, e.g. http://localhost:8888, the real api is used if empty
+    spotify_api_url: str = ""
+    lyrics_prefetch_depth: int = 3
+    search_cache_ttl: float = 600
+    search_cache_size: int = 1024
+    # memory, file, sqlite or redis; url is a snapshot or sqlite file name or redis://[:password@]host:port/db
+    state_store: str = "memory"
+    state_store_url: str = ""
+    # the file store writes changes behind, a crash loses at most this many seconds of them
+    state_flush_interval: float = 1
+    # changes of a session made within this many seconds are saved to the store at once
+    state_save_delay: float = 0.5
+    restore_sessions: bool = True
+    # workers sharing the store elect one of them to run the periodic updates for this many seconds
+    leader_lease_seconds: float = 30
+    # polling or webhook; in webhook mode telegram posts updates to webhook_url + webhook_path,
+    # the server listens on webhook_host:webhook_port and checks webhook_secret sent by telegram
+    delivery_mode: str = "polling"
+    webhook_url: str = ""
+    webhook_path: str = "/webhook"
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    webhook_secret: SecretStr | None = None
+    # prometheus metrics are served on http://metrics_host:metrics_port/metrics, not served if the port is 0
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9464
 
     class Config:
         env_file = "../.env"
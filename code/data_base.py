@@ -1,9 +1,21 @@
+import asyncio
+import logging
 import os
 import json
+import time
+from typing import Callable
 from config_reader import config
-from utils import generate_token
+from utils import generate_token, atomic_write
+from metrics import timed_job
+from aiogram import Bot
 from aiogram.types import Message
+from last_message import LastMessage
+from state_store import StateConflict, StateStore
+from user_queue import UserQueue
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.jobstores.base import JobLookupError
+
+logger = logging.getLogger(__name__)
 
 
 class DataBase:
@@ -12,8 +24,9 @@ class DataBase:
     __SHARE_MODE = 1
     __AMOUNT_TO_ADD_TO_QUEUE = 5
     __FULL_UPDATE_TIMEOUT_SECONDS = 20
+    __SYNC_INTERVAL_SECONDS = 0.5
 
-    def __init__(self):
+    def __init__(self, owner_id=None, owner_name=None, store: StateStore | None = None):
         self._DATA_PATH = config.data_path.get_secret_value()
         if not os.path.exists(self._DATA_PATH):
             os.system(f"mkdir {self._DATA_PATH}")
@@ -22,13 +35,145 @@ class DataBase:
             raise ValueError("путь к файлу с администраторами должен проходить через 'data_path'")
         self._token = None
         self._mode = self.__SHARE_MODE
+        # admins from the file administrate every session they join, a session starts with its owner as the only user
         self._admins = self._load_admins()
-        self._users = self._admins.copy()
+        if owner_id is None:
+            self._users = self._admins.copy()
+        else:
+            self._admins[owner_id] = owner_name
+            self._users = {owner_id: owner_name}
         self._last_request = {}
-        self._last_message_from_bot = {}
+        self._last_message_from_bot: dict[int, LastMessage] = {}
         self._scheduler: AsyncIOScheduler = None
-        self._users_queue = []
+        self._users_queue = UserQueue()
         self._scheduler_jobs = {}
+        self._owner_id = owner_id
+        # state of an active session is written to the store shortly after it changes, so that other workers
+        # can share it; changes not saved yet are applied again on top of a newer state saved by another worker
+        self._store = store
+        self._state_version = None
+        self._changes: list[Callable[[], object]] = []
+        self._save_task: asyncio.Task | None = None
+        self._store_lock = asyncio.Lock()
+        self._synced_at = 0.0
+
+    def _save(self, change: Callable[[], object]):
+        """
+        :param change: function making the change, already made to this state
+        """
+        if self._store is None or self._token is None:
+            return
+        self._changes.append(change)
+        if self._save_task is not None and not self._save_task.done():
+            return
+        try:
+            self._save_task = asyncio.get_running_loop().create_task(self._save_later())
+        except RuntimeError:
+            # no event loop, e.g. in scripts, nothing to be blocked
+            self._save_now()
+
+    async def _save_later(self):
+        # changes made meanwhile are saved at once, e.g. last messages of all users updated by a broadcast
+        while self._changes:
+            await asyncio.sleep(config.state_save_delay)
+            try:
+                await self.save()
+            except Exception:
+                logger.exception(f"can't save state of session {self._token}")
+
+    async def save(self):
+        """
+        writes changes made since the last save to the store
+        """
+        async with self._store_lock:
+            while self._changes and self._store is not None:
+                saved = len(self._changes)
+                try:
+                    self._state_version = await self._store.call(self._store.save, self._token, self.dump_state(),
+                                                                 self._state_version)
+                except StateConflict:
+                    if not self._reapply(await self._store.call(self._store.load, self._token)):
+                        return
+                else:
+                    del self._changes[:saved]
+
+    def _save_now(self):
+        while self._changes:
+            try:
+                self._state_version = self._store.save(self._token, self.dump_state(), self._state_version)
+            except StateConflict:
+                if not self._reapply(self._store.load(self._token)):
+                    return
+            else:
+                self._changes.clear()
+
+    def _reapply(self, item: tuple[dict, int] | None) -> bool:
+        """
+        loads the state saved by another worker and makes changes which are not saved yet again
+        :return: False if the session was ended meanwhile
+        """
+        if item is None:
+            self._changes.clear()
+            return False
+        self.load_state(*item)
+        for change in self._changes:
+            change()
+        return True
+
+    def close(self):
+        """
+        stops saving the state, e.g. when the session has ended
+        """
+        self._store = None
+        self._changes.clear()
+        if self._save_task is not None:
+            self._save_task.cancel()
+
+    def dump_state(self) -> dict:
+        return {
+            "token": self._token,
+            "owner_id": self._owner_id,
+            "mode": self._mode,
+            "amount_to_add_to_queue": self.__AMOUNT_TO_ADD_TO_QUEUE,
+            "admins": list(self._admins.items()),
+            "users": list(self._users.items()),
+            "users_queue": list(self._users_queue),
+            "last_messages": [(user_id, *message.dump()) for user_id, message in self._last_message_from_bot.items()],
+        }
+
+    def load_state(self, state: dict, version: int):
+        self._token = state["token"]
+        self._owner_id = state["owner_id"]
+        self._mode = state["mode"]
+        self.__AMOUNT_TO_ADD_TO_QUEUE = state["amount_to_add_to_queue"]
+        self._admins = dict(state["admins"])
+        self._users = dict(state["users"])
+        self._users_queue = UserQueue(state["users_queue"])
+        self._last_message_from_bot = {user_id: LastMessage.load(item) for user_id, *item in state["last_messages"]}
+        self._state_version = version
+
+    async def sync(self) -> bool:
+        """
+        reloads state changed by other workers, checks the store at most every few hundred milliseconds
+        :return: False if the session doesn't exist anymore
+        """
+        if self._store is None or self._token is None:
+            return True
+        if time.monotonic() - self._synced_at < self.__SYNC_INTERVAL_SECONDS:
+            return True
+        async with self._store_lock:
+            version = await self._store.call(self._store.version, self._token)
+            self._synced_at = time.monotonic()
+            if version is None:
+                # the session is not saved yet or it was ended by another worker
+                return self._state_version is None
+            if version != self._state_version:
+                return self._reapply(await self._store.call(self._store.load, self._token))
+        return True
+
+    @property
+    def owner_id(self):
+        return self._owner_id
 
     @property
     def scheduler(self):
@@ -39,20 +184,31 @@ class DataBase:
 
     async def include_update_functions(self, functions: list, args: list[list]):
         for num, func in enumerate(functions, start=0):
-            self._scheduler.add_job(func, "interval", seconds=self.__FULL_UPDATE_TIMEOUT_SECONDS, args=args[num], replace_existing=True)
+            job_id = f"{func.__name__}_{self._token}"
+            self._scheduler_jobs[job_id] = self._scheduler.add_job(timed_job(func), "interval",
+                                                                   seconds=self.__FULL_UPDATE_TIMEOUT_SECONDS,
+                                                                   args=args[num], id=job_id, replace_existing=True)
 
-    def add_scheduler(self, scheduler):
-        self._scheduler = scheduler
+    @property
+    def has_update_functions(self) -> bool:
+        return bool(self._scheduler_jobs)
+
+    def remove_update_functions(self):
+        for job in self._scheduler_jobs.values():
+            try:
+                job.remove()
+            except JobLookupError:
+                pass
+        self._scheduler_jobs.clear()
 
-    def clear(self):
-        scheduler = self._scheduler
-        copy_last_message = self._last_message_from_bot.copy()
-        self.__init__()
-        self._last_message_from_bot = copy_last_message
+    def add_scheduler(self, scheduler):
         self._scheduler = scheduler
 
     def add_user(self, chat_id, user_name=None):
-        self._users[chat_id] = user_name
+        def change():
+            self._users[chat_id] = user_name
+        change()
+        self._save(change)
 
     def __load_dict(self, file_name) -> dict:
         if os.path.exists(f"{self._DATA_PATH}/{file_name}") and os.path.getsize(f"{self._DATA_PATH}/{file_name}") > 0:
@@ -62,9 +218,8 @@ class DataBase:
         return {}
 
     def __update_file(self, data, file_name) -> None:
-        with open(f"{self._DATA_PATH}/{file_name}", "w", encoding="utf-8") as file:
-            if data is not None and len(data) > 0:
-                file.write(json.dumps(data, ensure_ascii=False, indent=4))
+        text = json.dumps(data, ensure_ascii=False, indent=4) if data is not None and len(data) > 0 else ""
+        atomic_write(f"{self._DATA_PATH}/{file_name}", text)
 
     def _load_admins(self) -> dict:
         tmp = self.__load_dict(self._admins_file_name)
@@ -80,17 +235,25 @@ class DataBase:
     @amount_to_add_to_queue.setter
     def amount_to_add_to_queue(self, amount: int):
         if isinstance(amount, int) and amount >= 0:
-            self.__AMOUNT_TO_ADD_TO_QUEUE = amount
+            def change():
+                self.__AMOUNT_TO_ADD_TO_QUEUE = amount
+            change()
+            self._save(change)
         else:
             raise ValueError
 
     def del_user(self, user_id):
-        self._users.pop(user_id)
-        if user_id in db.admins:
-            self.del_admin(user_id)
+        def change():
+            self._users.pop(user_id, None)
+            self._admins.pop(user_id, None)
+        change()
+        self._save(change)
 
     def del_admin(self, user_id):
-        self._admins.pop(user_id)
+        def change():
+            self._admins.pop(user_id, None)
+        change()
+        self._save(change)
 
     @property
     def users(self):
@@ -105,16 +268,27 @@ class DataBase:
         return self.__SHARE_MODE
 
     @property
-    def last_message(self):
+    def last_message(self) -> dict[int, LastMessage]:
         return self._last_message_from_bot
 
-    def update_last_message(self, user_id, message: Message):
-        self._last_message_from_bot[user_id] = message
+    def update_last_message(self, user_id, message: Message | LastMessage, content_hash: int | None = None):
+        if not isinstance(message, LastMessage):
+            message = LastMessage.from_message(message, content_hash)
+
+        def change():
+            self._last_message_from_bot[user_id] = message
+        change()
+        self._save(change)
 
-    async def del_last_message(self, user_id):
+    async def del_last_message(self, user_id, bot: Bot):
         if user_id in self._last_message_from_bot:
-            await self._last_message_from_bot[user_id].delete()
-            self._last_message_from_bot.pop(user_id)
+            message = self._last_message_from_bot[user_id]
+            await bot.delete_message(chat_id=message.chat_id, message_id=message.message_id)
+
+            def change():
+                self._last_message_from_bot.pop(user_id, None)
+            change()
+            self._save(change)
 
     @property
     def admins(self):
@@ -125,7 +299,12 @@ class DataBase:
         return self._token
 
     def set_token(self):
-        self._token = generate_token(20)
+        token = generate_token(20)
+
+        def change():
+            self._token = token
+        change()
+        self._save(change)
 
     @property
     def mode(self):
@@ -134,28 +313,56 @@ class DataBase:
     @mode.setter
     def mode(self, new_mode: int):
         if new_mode in [self.__SHARE_MODE, self.__RESTRICTED_MODE]:
-            self._mode = new_mode
+            def change():
+                self._mode = new_mode
+            change()
+            self._save(change)
         else:
             raise ValueError("wrong mode")
 
     def add_song_to_users_queue(self, user_id, song_id):
-        self._users_queue.append((user_id, song_id))
+        def change():
+            self._users_queue.append(user_id, song_id)
+        change()
+        self._save(change)
 
     def del_song_from_users_queue(self, user_id, song_id):
-        if (user_id, song_id) in self._users_queue:
-            self._users_queue.remove((user_id, song_id))
+        def change():
+            return self._users_queue.remove(user_id, song_id)
+        if change():
+            self._save(change)
+
+    def reconcile_users_queue(self, song_ids) -> list:
+        """
+        forgets songs which were already played according to the spotify queue
+        :return: user who queued every song of the spotify queue or None
+        """
+        def change():
+            return self._users_queue.reconcile(song_ids)
+        owners, dropped = change()
+        if dropped:
+            self._save(change)
+        return owners
 
     @property
-    def user_queue(self):
+    def user_queue(self) -> UserQueue:
         return self._users_queue
 
     @user_queue.setter
     def user_queue(self, item):
-        if isinstance(item, list):
-            self._users_queue = item
+        if isinstance(item, (list, UserQueue)):
+            entries = list(item)
+
+            def change():
+                self._users_queue = UserQueue(entries)
+            change()
+            self._save(change)
 
     def add_admin(self, user_id, user_name):
-        self._admins[user_id] = user_name
+        def change():
+            self._admins[user_id] = user_name
+        change()
+        self._save(change)
 
     def update_last_request(self, user_id, items: dict):
         self._last_request[user_id] = {}
@@ -165,6 +372,3 @@ class DataBase:
     @property
     def last_request(self):
         return self._last_request.copy()
-
-
-db = DataBase()
@@ -1,11 +1,10 @@
-from data_base import db
 from aiogram.types import Message
 
 
 class EmptyDataBaseFilter:
 
     def __call__(self, *args, **kwargs):
-        return not db.is_active()
+        return not kwargs["db"].is_active()
 
 
 class UrlFilter:
@@ -1,25 +1,44 @@
-import asyncio
+import functools
+import logging
+import math
 import os
-import random
+import time
 from aiogram.dispatcher.router import Router
 from aiogram import F, Bot
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
 from aiogram.filters.command import Command
 from aiogram.fsm.context import FSMContext
-from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.types import Message, CallbackQuery, FSInputFile, ErrorEvent, BufferedInputFile
 from aiogram.filters.callback_data import CallbackData
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
 from asyncspotify import BadRequest
 
-from spotify_errors import PremiumRequired, ConnectionError, AuthorizationError, Forbidden
+from spotify_errors import PremiumRequired, ConnectionError, AuthorizationError, Forbidden, RateLimited
 from spotify import AsyncSpotify
-from data_base import db
+from player_watcher import PlayerEvent
+from data_base import DataBase
+from last_message import LastMessage, ViewKind
+from keyboards import settings_keyboard, admin_menu_keyboard, user_menu_keyboard, menu_keyboard
+from views import MenuModel, QueueModel, RenderedView, Role, view_cache
+from sessions import sessions, Session
+from broadcast import background_updates, broadcaster
+from scheduler import delayed_actions
+from profiler import loop_profiler
 from filters import EmptyDataBaseFilter, UrlFilter
-from aiogram.filters import CommandObject
+from aiogram.filters import CommandObject, ExceptionTypeFilter
 from states import SetTokenState, SetSpotifyUrl
 import qrcode
 
+logger = logging.getLogger(__name__)
+
 router = Router()
-spotify: AsyncSpotify
+
+# notices like "session ended" are removed after this delay
+MESSAGE_TTL_SECONDS = 5
+PROFILE_SECONDS = 10
+PROFILE_MAX_SECONDS = 60
+# telegram limit of a document caption
+CAPTION_LENGTH = 1024
 
 
 class AddSongCallbackFactory(CallbackData, prefix="fabAddSong"):
@@ -51,23 +70,30 @@ class GetNextLyrics(CallbackData, prefix="fabLyrics", sep='~'):
     action: str
 
 
-async def synchronize_queues(spotify_queue):
-    top_track = spotify_queue[0].id
-    ids = [item[1] for item in db.user_queue]
-    if top_track not in ids:
-        db.user_queue = []
-    else:
-        top_track_ind = ids.index(top_track)
-        db.user_queue = db.user_queue[top_track_ind:]
+# actions of updates reported in metrics, other commands and callback data are reported as 'other'
+METRIC_ACTIONS = frozenset([
+    '/start', '/profile', 'message',
+    'view_queue', 'view_url', 'view_lyrics', 'view_admins_to_add', 'view_qr', 'back_from_qr', 'refresh', 'menu',
+    'start_playlist', 'view_devices', 'change_mode', 'set_share_mode', 'set_restricted_mode', 'get_settings',
+    'start_session', 'view_token', 'set_token', 'add_track', 'start_pause', 'next_track', 'previous_track',
+    'confirm_end_session', 'end_session', 'increase_volume', 'decrease_volume', 'mute_volume', 'leave_session',
+    'confirm_leave_session',
+    *(factory.__prefix__ for factory in (AddSongCallbackFactory, ViewQueueFactory, ChangeSongsVote,
+                                         ChangeDeviceFactory, AddAdminFactory, GetNextLyrics)),
+])
 
 
-async def handle_connection_error(callback: CallbackQuery | Message, bot=None):
-    user_id = callback.from_user.id
+async def synchronize_queues(db: DataBase, spotify_queue) -> list:
+    return db.reconcile_users_queue([item.id for item in spotify_queue])
+
+
+async def handle_connection_error(callback: CallbackQuery | Message | LastMessage, db: DataBase, bot=None):
+    user_id = callback.chat_id if isinstance(callback, LastMessage) else callback.from_user.id
     text = 'ошибка соединения с Spotify 😞'
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="обновить", callback_data="refresh"))
     builder.row(InlineKeyboardButton(text='покинуть сессию', callback_data='leave_session'))
-    if callback.from_user.id in db.admins:
+    if user_id in db.admins:
         builder.row(InlineKeyboardButton(text='завершить сессию', callback_data="confirm_end_session"))
     if bot is None:
         if isinstance(callback, CallbackQuery):
@@ -87,19 +113,7 @@ async def handle_connection_error(callback: CallbackQuery | Message, bot=None):
             pass
 
 
-def get_volume_emoji(volume: int):
-    volumes = "🔇🔈🔉🔊"
-    if volume == 0:
-        return volumes[0]
-    elif 0 < volume <= 33:
-        return volumes[1]
-    elif 33 < volume <= 66:
-        return volumes[2]
-    elif 66 < volume <= 100:
-        return volumes[3]
-
-
-async def handle_premium_required_error(callback: CallbackQuery | Message):
+async def handle_premium_required_error(callback: CallbackQuery | Message, db: DataBase):
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text='в меню', callback_data="menu"))
     if isinstance(callback, CallbackQuery):
@@ -110,80 +124,46 @@ async def handle_premium_required_error(callback: CallbackQuery | Message):
     db.update_last_message(callback.from_user.id, msg)
 
 
-async def get_menu_text():
-    global spotify
-    emoji_artists = '🥺🤫😐🙄😮😄😆🥹🙂😌😙😎😏🤩😋🥶🥵🤭🤔😈'
+async def get_menu_model(db: DataBase, spotify: AsyncSpotify) -> MenuModel:
     curr_track = await spotify.get_curr_track()
     if curr_track is None:
-        text = f'🔥 людей в сессии: {len(db.users)}'
-    else:
-        volume = spotify.volume
-        volume_str = f"{get_volume_emoji(volume)}: {volume}%\n\n" if spotify.is_playing else ""
-        artists, name = curr_track
-        text = (
-                f"🎧: {name}\n\n{''.join(random.choices(emoji_artists, k=len(artists)))}️: {', '.join(artists)}\n\n" + volume_str +
-                f"🔥 людей в сессии:"
-                f" {len(db.users)}")
-    return text
+        return MenuModel(None, None, None, len(db.users))
+    artists, name = curr_track
+    return MenuModel(tuple(artists), name, spotify.volume if spotify.is_playing else None, len(db.users))
 
 
-def get_settings_keyboard(user_id):
-    builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text="посмотреть токен", callback_data="view_token"))
-    builder.row(InlineKeyboardButton(text='ссылка приглашение', callback_data="view_url"))
-    builder.row(InlineKeyboardButton(text='QR-код', callback_data="view_qr"))
-    builder.row(InlineKeyboardButton(text="сменить устройство", callback_data="view_devices"))
-    if user_id in db.admins:
-        builder.row(InlineKeyboardButton(text='изменить режим', callback_data="change_mode"))
-        # builder.row(InlineKeyboardButton(text='добавить админа', callback_data="view_admins_to_add"))
-    builder.row(InlineKeyboardButton(text='покинуть сессию', callback_data="leave_session"))
-    if user_id in db.admins:
-        builder.row(InlineKeyboardButton(text="завершить сессию", callback_data="confirm_end_session"))
-    builder.row(InlineKeyboardButton(text='назад', callback_data="menu"))
-    return builder.as_markup()
+def get_role(user_id, db: DataBase) -> Role:
+    return Role.ADMIN if user_id in db.admins else Role.USER
+
+
+def render_menu(role: Role, db: DataBase, model: MenuModel) -> RenderedView:
+    def markup():
+        return get_admin_menu_keyboard() if role == Role.ADMIN else get_user_menu_keyboard(db)
+    return view_cache.render(ViewKind.MENU, role, db.mode, model, markup)
+
+
+def render_queue(role: Role, db: DataBase, model: QueueModel) -> RenderedView:
+    return view_cache.render(ViewKind.QUEUE, role, db.mode, model, get_menu_keyboard)
+
+
+def get_settings_keyboard(user_id, db: DataBase):
+    return settings_keyboard(user_id in db.admins)
 
 
 def get_admin_menu_keyboard():
-    builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text="⚙️ настройки ⚙️", callback_data="get_settings"))
-    # builder.row(InlineKeyboardButton(text='🎵 добавить трек 🎵', callback_data='add_track'))
-    builder.row(InlineKeyboardButton(text='💽 очередь 💽', callback_data="view_queue"))
-    builder.row(InlineKeyboardButton(text='📖 текст песни 📖', callback_data="view_lyrics"))
-    builder.row(InlineKeyboardButton(text='🔉', callback_data='decrease_volume'))
-    builder.add(InlineKeyboardButton(text='🔇', callback_data='mute_volume'))
-    builder.add(InlineKeyboardButton(text='🔊', callback_data="increase_volume"))
-    # builder.row(InlineKeyboardButton(text="🔄 обновить 🔄", callback_data='refresh'))
-    builder.row(InlineKeyboardButton(text="⏮", callback_data="previous_track"))
-    builder.add(InlineKeyboardButton(text="⏯", callback_data="start_pause"))
-    builder.add(InlineKeyboardButton(text="⏭", callback_data="next_track"))
-    return builder.as_markup()
+    return admin_menu_keyboard()
 
 
-def get_user_menu_keyboard():
-    builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text="⚙️ настройки ⚙️", callback_data="get_settings"))
-    builder.row(InlineKeyboardButton(text='🎵 добавить трек 🎵', callback_data="add_track"))
-    builder.row(InlineKeyboardButton(text='💽 очередь 💽', callback_data="view_queue"))
-    builder.row(InlineKeyboardButton(text='📖 текст песни 📖', callback_data="view_lyrics"))
-    if db.mode == db.share_mode:
-        builder.row(InlineKeyboardButton(text='🔉', callback_data='decrease_volume'))
-        builder.add(InlineKeyboardButton(text='🔇', callback_data='mute_volume'))
-        builder.add(InlineKeyboardButton(text='🔊', callback_data="increase_volume"))
-    # builder.row(InlineKeyboardButton(text="🔄обновить🔄", callback_data='refresh'))
-    if db.mode == db.share_mode:
-        builder.row(InlineKeyboardButton(text="⏮", callback_data="previous_track"))
-        builder.add(InlineKeyboardButton(text="⏯", callback_data="start_pause"))
-        builder.add(InlineKeyboardButton(text="⏭", callback_data="next_track"))
-    return builder.as_markup()
+def get_user_menu_keyboard(db: DataBase):
+    # markups are prebuilt per mode, so changing the mode just picks the other one
+    return user_menu_keyboard(db.mode == db.share_mode)
 
 
 def get_menu_keyboard():
-    builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text='в меню', callback_data='menu'))
-    return builder.as_markup()
+    return menu_keyboard()
 
 
-async def admin_start(message: Message):
+async def admin_start(message: Message, db: DataBase):
     builder = InlineKeyboardBuilder()
     if db.is_active():
         msg = await message.answer(text=f"сессия запущена 🔥\ntoken: <code>{db.token}</code>",
@@ -194,78 +174,63 @@ async def admin_start(message: Message):
     db.update_last_message(message.from_user.id, msg)
 
 
-async def user_start(message: Message):
+async def user_start(message: Message, db: DataBase):
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="ввести токен", callback_data='set_token'))
     msg = await message.answer("Spotify 🎧", reply_markup=builder.as_markup())
     db.update_last_message(message.from_user.id, msg)
 
 
-async def menu(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    try:
-        await spotify.update()
-        text = await get_menu_text()
-    except ConnectionError:
-        await handle_connection_error(callback)
-        return
-    if user_id in db.admins:
-        keyboard = get_admin_menu_keyboard()
-        msg = await callback.message.edit_text(text=text, reply_markup=keyboard)
-    else:
-        keyboard = get_user_menu_keyboard()
-        msg = await callback.message.edit_text(text=text, reply_markup=keyboard)
-    db.update_last_message(user_id, msg)
+def shows_view(db: DataBase, user_id, message: Message, view: RenderedView) -> bool:
+    last = db.last_message.get(user_id)
+    return last is not None and last.message_id == message.message_id and last.shows(view.content_hash)
 
 
-async def refresh(callback: CallbackQuery):
-    old_text = callback.message.text
+async def menu(callback: CallbackQuery, db: DataBase, spotify: AsyncSpotify):
+    user_id = callback.from_user.id
     try:
         await spotify.update()
-        curr_text = await get_menu_text()
+        view = render_menu(get_role(user_id, db), db, await get_menu_model(db, spotify))
     except ConnectionError:
-        await handle_connection_error(callback)
+        await handle_connection_error(callback, db)
         return
-    if old_text != curr_text:
-        await menu(callback)
-    else:
+    # telegram refuses edits which change nothing
+    if shows_view(db, user_id, callback.message, view):
         return
+    msg = await callback.message.edit_text(text=view.text, reply_markup=view.markup)
+    db.update_last_message(user_id, msg, view.content_hash)
+
 
+async def refresh(callback: CallbackQuery, db: DataBase, spotify: AsyncSpotify):
+    await menu(callback, db, spotify)
 
-async def get_queue_text():
-    global spotify
+
+async def get_queue_model(db: DataBase, spotify: AsyncSpotify) -> QueueModel:
     queue = await spotify.get_curr_user_queue()
-    await synchronize_queues(queue)
-    queue = queue[0:min(len(db.user_queue), 10)]
+    owners = await synchronize_queues(db, queue)
     if len(db.user_queue) == 0:
-        return None
-    else:
-        text = ''
-        ids = [item[1] for item in db.user_queue]
-        for item in queue:
-            author = '' if item.id not in ids else (' - поставил(а) @' + db.users[db.user_queue[ids.index(item.id)][0]])
-            text += (item.name[:item.name.find('(')] if '(' in item.name else item.name) + author + '\n\n'
-        return text
+        return QueueModel(())
+    # tracks up to the last one queued through the bot
+    shown = max((ind + 1 for ind, owner in enumerate(owners) if owner is not None), default=0)
+    users = db.users
+    return QueueModel(tuple((item.name, users.get(owner)) for item, owner in zip(queue[0:min(shown, 10)], owners)))
 
 
 @router.callback_query(F.data == 'view_queue')
-async def view_queue(callback: CallbackQuery):
+async def view_queue(callback: CallbackQuery, db: DataBase, spotify: AsyncSpotify):
     if db.is_active():
-        queue = await get_queue_text()
-        if queue is None or len(queue) == 0:
-            msg = await callback.message.edit_text("в очереди нет треков", reply_markup=get_menu_keyboard())
-        else:
-            builder = InlineKeyboardBuilder()
-            builder.button(text='в меню', callback_data="menu")
-            builder.adjust(1)
-            msg = await callback.message.edit_text("треки в очереди:\n\n" + queue, reply_markup=builder.as_markup())
-        db.update_last_message(callback.from_user.id, msg)
+        user_id = callback.from_user.id
+        view = render_queue(get_role(user_id, db), db, await get_queue_model(db, spotify))
+        if shows_view(db, user_id, callback.message, view):
+            return
+        msg = await callback.message.edit_text(view.text, reply_markup=view.markup)
+        db.update_last_message(user_id, msg, view.content_hash)
     else:
-        await handle_not_active_session(callback)
+        await handle_not_active_session(callback, db)
 
 
 @router.callback_query(F.data == 'view_url')
-async def view_url(callback: CallbackQuery):
+async def view_url(callback: CallbackQuery, db: DataBase):
     if db.is_active():
         url = f"t.me/SpotifyShareControlBot?start={db.token}"
         builder = InlineKeyboardBuilder()
@@ -273,7 +238,7 @@ async def view_url(callback: CallbackQuery):
         msg = await callback.message.edit_text(text=url, reply_markup=builder.as_markup())
         db.update_last_message(message=msg, user_id=callback.from_user.id)
     else:
-        await handle_not_active_session(callback)
+        await handle_not_active_session(callback, db)
 
 
 def get_lyrics_switcher(start, end, step):
@@ -296,68 +261,77 @@ async def get_curr_song_info(lyrics):
 
 
 @router.callback_query(F.data == 'view_lyrics')
-async def view_lyrics(callback: CallbackQuery):
+async def view_lyrics(callback: CallbackQuery, db: DataBase, spotify: AsyncSpotify):
     if db.is_active():
         try:
             lyrics = await spotify.get_lyrics(callback.message.edit_text,
                                               text="ищу текст песни\nподождите чуток\nтекст сейчас появится 😉",
                                               reply_markup=get_menu_keyboard())
         except ValueError:
-            await callback.message.edit_text("не удалось найти текст", reply_markup=get_menu_keyboard())
+            msg = await callback.message.edit_text("не удалось найти текст", reply_markup=get_menu_keyboard())
         else:
             song_info = await get_curr_song_info(lyrics)
-            await callback.message.edit_text(song_info + '\n'.join(lyrics.list_lyrics[0:16]),
-                                             reply_markup=get_lyrics_switcher(0, 16, 16))
+            msg = await callback.message.edit_text(song_info + '\n'.join(lyrics.list_lyrics[0:16]),
+                                                   reply_markup=get_lyrics_switcher(0, 16, 16))
+        db.update_last_message(callback.from_user.id, msg)
     else:
-        await handle_not_active_session(callback)
+        await handle_not_active_session(callback, db)
 
 
 @router.callback_query(GetNextLyrics.filter(F.action == 'increment'))
-async def next_part_lyrics(callback: CallbackQuery, callback_data: GetNextLyrics):
+async def next_part_lyrics(callback: CallbackQuery, callback_data: GetNextLyrics, db: DataBase,
+                           spotify: AsyncSpotify):
     lyrics = await spotify.get_lyrics()
     start_ind = callback_data.start_ind
     end_ind = min(start_ind + callback_data.step, len(lyrics.list_lyrics))
     end_ind_conv = end_ind if end_ind != len(lyrics.list_lyrics) else -1
     curr_song_info = await get_curr_song_info(lyrics)
-    await callback.message.edit_text(text=curr_song_info + '\n'.join(lyrics.list_lyrics[start_ind:end_ind]),
-                                     reply_markup=get_lyrics_switcher(start_ind, end_ind_conv, end_ind - start_ind))
+    msg = await callback.message.edit_text(text=curr_song_info + '\n'.join(lyrics.list_lyrics[start_ind:end_ind]),
+                                           reply_markup=get_lyrics_switcher(start_ind, end_ind_conv,
+                                                                            end_ind - start_ind))
+    db.update_last_message(callback.from_user.id, msg)
 
 
 @router.callback_query(GetNextLyrics.filter(F.action == 'decrement'))
-async def previous_part_lyrics(callback: CallbackQuery, callback_data: GetNextLyrics):
+async def previous_part_lyrics(callback: CallbackQuery, callback_data: GetNextLyrics, db: DataBase,
+                               spotify: AsyncSpotify):
     lyrics = await spotify.get_lyrics()
     start_ind = max(callback_data.start_ind, 0)
     end_ind = callback_data.step + start_ind
     curr_song_info = await get_curr_song_info(lyrics)
-    await callback.message.edit_text(
+    msg = await callback.message.edit_text(
         text=curr_song_info + '\n'.join(lyrics.list_lyrics[start_ind:end_ind]),
         reply_markup=get_lyrics_switcher(start_ind, end_ind, callback_data.step))
+    db.update_last_message(callback.from_user.id, msg)
 
 
 @router.callback_query(F.data == 'view_admins_to_add')
-async def view_admins_to_add(callback: CallbackQuery):
+async def view_admins_to_add(callback: CallbackQuery, db: DataBase):
     if db.is_active():
         builder = InlineKeyboardBuilder()
-        for user_id, username in db.users:
+        for user_id, username in db.users.items():
             if user_id not in db.admins:
                 builder.button(text=username, callback_data=AddAdminFactory(user_id=user_id, user_name=username))
         builder.button(text="назад", callback_data='menu')
-        await callback.message.edit_text(text='выберите пользователя', reply_markup=builder.as_markup())
+        msg = await callback.message.edit_text(text='выберите пользователя', reply_markup=builder.as_markup())
+        db.update_last_message(callback.from_user.id, msg)
     else:
-        await handle_not_active_session(callback)
+        await handle_not_active_session(callback, db)
 
 
 @router.callback_query(AddAdminFactory.filter())
-async def add_admin(callback: CallbackQuery, callback_data: AddAdminFactory, bot):
+async def add_admin(callback: CallbackQuery, callback_data: AddAdminFactory, bot, db: DataBase, spotify: AsyncSpotify):
     db.add_admin(callback_data.user_id, callback_data.user_name)
-    await callback.message.edit_text(text='добавлен новый администратор', reply_markup=get_menu_keyboard())
+    msg = await callback.message.edit_text(text='добавлен новый администратор', reply_markup=get_menu_keyboard())
+    db.update_last_message(callback.from_user.id, msg)
     users = set(db.users.keys())
     users.remove(callback_data.user_id)
-    await update_menu_for_all_users(bot, users)
+    await answer_callback(callback)
+    update_menu_later(bot, db, spotify, *users)
 
 
 @router.callback_query(F.data == 'view_qr')
-async def view_qr(callback: CallbackQuery, bot: Bot):
+async def view_qr(callback: CallbackQuery, bot: Bot, db: DataBase):
     if db.is_active():
         url = f"t.me/SpotifyShareControlBot?start={db.token}"
         img = qrcode.make(url)
@@ -367,56 +341,53 @@ async def view_qr(callback: CallbackQuery, bot: Bot):
         builder.row(InlineKeyboardButton(text="в меню", callback_data="back_from_qr"))
         msg = await bot.send_photo(photo=document, chat_id=callback.from_user.id,
                                    reply_markup=builder.as_markup())
-        await db.del_last_message(callback.from_user.id)
+        await db.del_last_message(callback.from_user.id, bot)
         db.update_last_message(callback.from_user.id, msg)
         os.remove("qr_token")
     else:
-        await handle_not_active_session(callback)
+        await handle_not_active_session(callback, db)
 
 
 @router.callback_query(F.data == 'back_from_qr')
-async def back_from_qr(callback: CallbackQuery, bot: Bot):
-    text = await get_menu_text()
-    if callback.from_user.id in db.admins:
-        markup = get_admin_menu_keyboard()
-    else:
-        markup = get_user_menu_keyboard()
-    msg = await bot.send_message(text=text, chat_id=callback.from_user.id, reply_markup=markup)
-    await db.del_last_message(callback.from_user.id)
-    db.update_last_message(callback.from_user.id, msg)
+async def back_from_qr(callback: CallbackQuery, bot: Bot, db: DataBase, spotify: AsyncSpotify):
+    view = render_menu(get_role(callback.from_user.id, db), db, await get_menu_model(db, spotify))
+    msg = await bot.send_message(text=view.text, chat_id=callback.from_user.id, reply_markup=view.markup)
+    await db.del_last_message(callback.from_user.id, bot)
+    db.update_last_message(callback.from_user.id, msg, view.content_hash)
 
 
 @router.callback_query(F.data == "refresh")
-async def refresh_callback(callback: CallbackQuery):
+async def refresh_callback(callback: CallbackQuery, db: DataBase, spotify: AsyncSpotify):
     if db.is_active():
-        await refresh(callback)
+        await refresh(callback, db, spotify)
     else:
-        await handle_not_active_session(callback)
+        await handle_not_active_session(callback, db)
 
 
 @router.callback_query(F.data == "menu")
-async def menu_callback(callback: CallbackQuery):
-    await menu(callback)
+async def menu_callback(callback: CallbackQuery, db: DataBase, spotify: AsyncSpotify):
+    await menu(callback, db, spotify)
 
 
 @router.callback_query(F.data == 'start_playlist')
-async def start_playlist_callback(callback: CallbackQuery):
+async def start_playlist_callback(callback: CallbackQuery, db: DataBase):
     msg = await callback.message.edit_text("отправь ссылку на альбом/плейлист/артиста",
                                            reply_markup=get_menu_keyboard())
     db.update_last_message(callback.from_user.id, msg)
 
 
 @router.message(UrlFilter())
-async def chose_url_role(message: Message, state: FSMContext, bot: Bot):
+async def chose_url_role(message: Message, state: FSMContext, bot: Bot, session: Session, db: DataBase,
+                         spotify: AsyncSpotify):
     st = await state.get_state()
     if st == SetSpotifyUrl.set_url:
-        await set_spotify_url(message, state, bot)
+        await set_spotify_url(message, state, bot, session)
     else:
-        await start_playlist(message)
+        await start_playlist(message, db, spotify)
 
 
-async def start_playlist(message: Message):
-    await db.del_last_message(message.from_user.id)
+async def start_playlist(message: Message, db: DataBase, spotify: AsyncSpotify):
+    await db.del_last_message(message.from_user.id, message.bot)
     try:
         await spotify.start_playlist(message.text)
     except ValueError:
@@ -425,9 +396,9 @@ async def start_playlist(message: Message):
             reply_markup=get_menu_keyboard())
         db.update_last_message(message.from_user.id, msg)
     except ConnectionError:
-        await handle_connection_error(message)
+        await handle_connection_error(message, db)
     except PremiumRequired:
-        await handle_premium_required_error(message)
+        await handle_premium_required_error(message, db)
     else:
         msg = await message.answer("плейлист успешно запущен", reply_markup=get_menu_keyboard())
         db.update_last_message(message.from_user.id, msg)
@@ -435,7 +406,7 @@ async def start_playlist(message: Message):
 
 
 @router.callback_query(F.data == "view_devices")
-async def view_devices(callback: CallbackQuery):
+async def view_devices(callback: CallbackQuery, db: DataBase, spotify: AsyncSpotify):
     keyboard = InlineKeyboardBuilder()
     devices = await spotify.get_devices()
     for device in devices:
@@ -444,40 +415,52 @@ async def view_devices(callback: CallbackQuery):
         keyboard.button(text=text, callback_data=ChangeDeviceFactory(id=device.id, is_active=device.is_active))
     keyboard.adjust(1)
     keyboard.row(InlineKeyboardButton(text="назад", callback_data="get_settings"))
-    await callback.message.edit_text(text="доступные устройства Spotify", reply_markup=keyboard.as_markup())
+    msg = await callback.message.edit_text(text="доступные устройства Spotify", reply_markup=keyboard.as_markup())
+    db.update_last_message(callback.from_user.id, msg)
 
 
 @router.callback_query(ChangeDeviceFactory.filter())
-async def transfer_playback(callback: CallbackQuery, callback_data: ChangeDeviceFactory):
+async def transfer_playback(callback: CallbackQuery, callback_data: ChangeDeviceFactory, db: DataBase,
+                            spotify: AsyncSpotify):
     device_id = callback_data.id
     is_active = callback_data.is_active
     if is_active:
-        await callback.message.edit_text("данное устройство уже является текущим устройством воспроизведения",
-                                         reply_markup=get_menu_keyboard())
-        return
-    try:
-        await spotify.transfer_player(device_id)
-    except ConnectionError:
-        await callback.message.edit_text("не удалось изменить устройство", reply_markup=get_menu_keyboard())
+        text = "данное устройство уже является текущим устройством воспроизведения"
     else:
-        await callback.message.edit_text("устройство воспроизведения успешно изменено",
-                                         reply_markup=get_menu_keyboard())
+        try:
+            await spotify.transfer_player(device_id)
+        except ConnectionError:
+            text = "не удалось изменить устройство"
+        else:
+            text = "устройство воспроизведения успешно изменено"
+    msg = await callback.message.edit_text(text, reply_markup=get_menu_keyboard())
+    db.update_last_message(callback.from_user.id, msg)
+
+
+@router.errors(ExceptionTypeFilter(RateLimited))
+async def handle_rate_limited(event: ErrorEvent):
+    # a burst of actions hit spotify rate limits, the current screen stays as it is
+    text = f"spotify просит подождать {math.ceil(event.exception.retry_after)} с ⏳"
+    if event.update.callback_query is not None:
+        await event.update.callback_query.answer(text)
+    elif event.update.message is not None:
+        await event.update.message.answer(text)
 
 
 @router.callback_query(F.data != "start_session", EmptyDataBaseFilter())
-async def handle_not_active_session(callback: CallbackQuery):
+async def handle_not_active_session(callback: CallbackQuery, db: DataBase):
     user_id = callback.from_user.id
     if user_id in db.admins:
         await callback.message.edit_text("сессия завершена, для запуска сессии используйте команду '/start'",
                                          reply_markup=None)
     else:
         await callback.message.edit_text("сессия завершена, обратитесь к админам для ее запуска")
-    await asyncio.sleep(5)
-    await callback.message.delete()
+    delayed_actions.delete_message_later(callback.bot, callback.message.chat.id, callback.message.message_id,
+                                         MESSAGE_TTL_SECONDS)
 
 
 @router.callback_query(F.data == 'change_mode')
-async def change_mode(callback: CallbackQuery):
+async def change_mode(callback: CallbackQuery, db: DataBase):
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text='share ♻️', callback_data="set_share_mode"))
     builder.row(InlineKeyboardButton(text='restricted 🔒', callback_data='set_restricted_mode'))
@@ -486,53 +469,79 @@ async def change_mode(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == 'set_share_mode')
-async def set_share_mode(callback: CallbackQuery):
+async def set_share_mode(callback: CallbackQuery, db: DataBase):
     db.mode = db.share_mode
     msg = await callback.message.edit_text(text='установлен режим share ♻️', reply_markup=get_menu_keyboard())
     db.update_last_message(callback.from_user.id, msg)
 
 
 @router.callback_query(F.data == 'set_restricted_mode')
-async def set_share_mode(callback: CallbackQuery):
+async def set_share_mode(callback: CallbackQuery, db: DataBase):
     db.mode = db.restricted_mode
     msg = await callback.message.edit_text(text='установлен режим share restricted 🔒', reply_markup=get_menu_keyboard())
     db.update_last_message(callback.from_user.id, msg)
 
 
 @router.callback_query(F.data == 'get_settings')
-async def get_settings(callback: CallbackQuery):
+async def get_settings(callback: CallbackQuery, db: DataBase):
     if db.is_active():
         msg = await callback.message.edit_text(text='⚙️ настройки ⚙️',
-                                               reply_markup=get_settings_keyboard(callback.from_user.id))
+                                               reply_markup=get_settings_keyboard(callback.from_user.id, db))
         db.update_last_message(callback.from_user.id, msg)
     else:
-        await handle_not_active_session(callback)
+        await handle_not_active_session(callback, db)
 
 
 @router.message(Command("start"))
-async def start_by_command(message: Message, command: CommandObject, bot: Bot):
+async def start_by_command(message: Message, command: CommandObject, bot: Bot, db: DataBase):
     try:
-        await db.del_last_message(message.from_user.id)
+        await db.del_last_message(message.from_user.id, bot)
     except:
         pass
-    await asyncio.sleep(0.2)
     user_id = message.from_user.id
-    await asyncio.sleep(0.3)
     if user_id in db.admins:
-        await admin_start(message)
+        await admin_start(message, db)
     else:
         token = command.args
         if token is None or token == '':
-            await user_start(message)
+            await user_start(message, db)
         else:
             db.update_last_message(user_id, message)
-            await authorize(token, user_id, message.from_user.username, bot)
+            await authorize(token, user_id, message.from_user.username, bot, db)
+    await message.delete()
+
+
+@router.message(Command("profile"))
+async def profile_loop(message: Message, command: CommandObject, db: DataBase):
+    """
+    /profile [seconds] - samples the event loop and sends collapsed stacks for a flamegraph, admins only
+    """
     await message.delete()
+    if message.from_user.id not in db.admins:
+        return
+    if loop_profiler.running:
+        msg = await message.answer("профилирование уже запущено ⏳")
+        delayed_actions.delete_message_later(message.bot, msg.chat.id, msg.message_id, MESSAGE_TTL_SECONDS)
+        return
+    try:
+        seconds = float(command.args) if command.args else PROFILE_SECONDS
+    except ValueError:
+        seconds = math.nan
+    # nan fails both comparisons
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        msg = await message.answer(f"использование: /profile [секунды, от 0 до {PROFILE_MAX_SECONDS}]")
+        delayed_actions.delete_message_later(message.bot, msg.chat.id, msg.message_id, MESSAGE_TTL_SECONDS)
+        return
+    result = await loop_profiler.profile(seconds)
+    document = BufferedInputFile(result.collapsed().encode("utf-8"),
+                                 filename=f"profile_{int(time.time())}.collapsed")
+    await message.answer_document(document, caption=result.summary()[:CAPTION_LENGTH])
 
 
-async def set_spotify_url(message: Message, state: FSMContext, bot: Bot):
+async def set_spotify_url(message: Message, state: FSMContext, bot: Bot, session: Session):
+    db, spotify = session.db, session.spotify
     url = message.text
-    await db.del_last_message(message.from_user.id)
+    await db.del_last_message(message.from_user.id, bot)
     try:
         await spotify.authorize(url)
     except:
@@ -543,8 +552,8 @@ async def set_spotify_url(message: Message, state: FSMContext, bot: Bot):
     else:
         await state.clear()
         await message.delete()
-        db.set_token()
-        await db.include_update_functions([update_queue_for_all_users, update_menu_for_all_users], [[bot], [bot]])
+        sessions.activate(session)
+        await include_update_functions(bot, session)
         msg = await message.answer(text=f"авторизация прошла успешно, сессия запущена 🔥\n"
                                         f"token: <code>{db.token}</code>", reply_markup=get_menu_keyboard(),
                                    parse_mode="HTML")
@@ -552,10 +561,14 @@ async def set_spotify_url(message: Message, state: FSMContext, bot: Bot):
 
 
 @router.callback_query(F.data == 'start_session')
-async def start_session(callback: CallbackQuery, bot: Bot, state: FSMContext):
+async def start_session(callback: CallbackQuery, bot: Bot, state: FSMContext, db: DataBase,
+                        spotify: AsyncSpotify):
+    if db.is_active():
+        await menu(callback, db, spotify)
+        return
+    session = await sessions.create(callback.from_user.id, callback.from_user.username)
+    db, spotify = session.db, session.spotify
     try:
-        global spotify
-        spotify = AsyncSpotify()
         await spotify.authorize()
     except AuthorizationError:
         msg = await callback.message.edit_text(f"Необходима инициализация\n"
@@ -570,10 +583,11 @@ async def start_session(callback: CallbackQuery, bot: Bot, state: FSMContext):
                 '1) запустите приложение spotify и любой трек/альбом на устройстве, управление которым вы хотите '
                 'осуществлять\n\n'
                 '2) заново запустите сессию (/start)')
-        await callback.message.edit_text(text=text, reply_markup=None)
+        msg = await callback.message.edit_text(text=text, reply_markup=None)
+        db.update_last_message(callback.from_user.id, msg)
     else:
-        db.set_token()
-        await db.include_update_functions([update_queue_for_all_users, update_menu_for_all_users], [[bot], [bot]])
+        sessions.activate(session)
+        await include_update_functions(bot, session)
         msg = await callback.message.edit_text(text=f"сессия запущена 🔥\n"
                                                     f"token: <code>{db.token}</code>", reply_markup=get_menu_keyboard(),
                                                parse_mode="HTML")
@@ -581,7 +595,7 @@ async def start_session(callback: CallbackQuery, bot: Bot, state: FSMContext):
 
 
 @router.callback_query(F.data == 'view_token')
-async def view_token(callback: CallbackQuery):
+async def view_token(callback: CallbackQuery, db: DataBase):
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="назад", callback_data="get_settings"))
     msg = await callback.message.edit_text(f"token: <code>{db.token}</code>", reply_markup=builder.as_markup(),
@@ -590,65 +604,69 @@ async def view_token(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == 'set_token')
-async def set_user_token(callback: CallbackQuery, state: FSMContext):
+async def set_user_token(callback: CallbackQuery, state: FSMContext, db: DataBase):
     msg = await callback.message.edit_text("введите токен")
     db.update_last_message(callback.from_user.id, msg)
     await state.set_state(SetTokenState.add_user)
 
 
-async def authorize(token, user_id, user_name, bot: Bot):
-    if db.token == token:
-        await db.del_last_message(user_id)
-        await asyncio.sleep(0.3)
-        db.add_user(user_id, user_name)
-        msg = await bot.send_message(text=await get_menu_text(), chat_id=user_id, reply_markup=get_user_menu_keyboard())
+async def authorize(token, user_id, user_name, bot: Bot, db: DataBase):
+    session = await sessions.load(token)
+    if session is not None:
+        await db.del_last_message(user_id, bot)
+        sessions.join(user_id, user_name, session)
+        db = session.db
+        view = render_menu(Role.USER, db, await get_menu_model(db, session.spotify))
+        msg = await bot.send_message(text=view.text, chat_id=user_id, reply_markup=view.markup)
+        db.update_last_message(user_id, msg, view.content_hash)
     else:
-        await db.del_last_message(user_id)
-        await asyncio.sleep(0.3)
+        await db.del_last_message(user_id, bot)
         msg = await bot.send_message(chat_id=user_id, text='введен неверный токен или сессия не начата')
-    db.update_last_message(user_id, msg)
+        db.update_last_message(user_id, msg)
 
 
 @router.message(F.text.len() > 0, SetTokenState.add_user)
-async def add_user_to_session(message: Message, state: FSMContext):
+async def add_user_to_session(message: Message, state: FSMContext, bot: Bot, db: DataBase):
     token = message.text
     user_name = message.from_user.username
     user_id = message.from_user.id
-    if db.token == token:
-        await db.del_last_message(user_id)
-        await asyncio.sleep(0.3)
-        db.add_user(user_id, user_name)
-        msg = await message.answer(text=await get_menu_text(), reply_markup=get_user_menu_keyboard())
+    session = await sessions.load(token)
+    if session is not None:
+        await db.del_last_message(user_id, bot)
+        sessions.join(user_id, user_name, session)
+        db = session.db
+        view = render_menu(Role.USER, db, await get_menu_model(db, session.spotify))
+        msg = await message.answer(text=view.text, reply_markup=view.markup)
         await message.delete()
         await state.clear()
+        db.update_last_message(user_id, msg, view.content_hash)
     else:
-        await db.del_last_message(user_id)
-        await asyncio.sleep(0.3)
+        await db.del_last_message(user_id, bot)
         msg = await message.answer(text='введен неверный токен или сессия не начата')
         await message.delete()
-    db.update_last_message(user_id, msg)
+        db.update_last_message(user_id, msg)
 
 
 @router.callback_query(F.data == "add_track")
-async def search_track_callback(callback: CallbackQuery):
+async def search_track_callback(callback: CallbackQuery, db: DataBase):
     if db.is_active():
         db.update_last_message(callback.from_user.id,
                                await callback.message.edit_text("введите поисковой запрос 🔎",
                                                                 reply_markup=get_menu_keyboard()))
     else:
-        await handle_not_active_session(callback)
+        await handle_not_active_session(callback, db)
 
 
 @router.message(F.text)
-async def search_track_handler(message: Message):
+async def search_track_handler(message: Message, db: DataBase, spotify: AsyncSpotify):
     if db.is_active():
-        await db.del_last_message(message.from_user.id)
+        await db.del_last_message(message.from_user.id, message.bot)
         user_id = message.from_user.id
         if user_id in db.users:
             try:
                 list_of_results = await spotify.search(message.text)
             except ConnectionError:
-                await handle_connection_error(message)
+                await handle_connection_error(message, db)
                 return
             keyboard = InlineKeyboardBuilder()
             request = {}
@@ -669,8 +687,7 @@ async def search_track_handler(message: Message):
             await message.delete()
         db.update_last_message(user_id, msg)
     else:
-        await db.del_last_message(message.from_user.id)
-        await asyncio.sleep(0.3)
+        await db.del_last_message(message.from_user.id, message.bot)
         msg = await message.answer("сессия завершена, для запуска сессии используйте команду '/start'",
                                    reply_markup=None)
         await message.delete()
@@ -678,88 +695,94 @@ async def search_track_handler(message: Message):
 
 
 @router.callback_query(AddSongCallbackFactory.filter())
-async def make_poll(callback: CallbackQuery, callback_data: AddSongCallbackFactory, bot: Bot):
+async def make_poll(callback: CallbackQuery, callback_data: AddSongCallbackFactory, bot: Bot, db: DataBase, spotify: AsyncSpotify):
     raw_uri = callback_data.uri
     user_id = callback.from_user.id
     try:
         await spotify.add_track_to_queue(raw_uri)
     except PremiumRequired:
-        await handle_premium_required_error(callback)
+        await handle_premium_required_error(callback, db)
     except ConnectionError:
-        await handle_connection_error(callback)
+        await handle_connection_error(callback, db)
     else:
         db.add_song_to_users_queue(user_id, raw_uri)
         msg = await callback.message.edit_text("трек добавлен в очередь 👌", reply_markup=get_menu_keyboard())
-        await update_queue_for_all_users(bot)
         db.update_last_message(user_id, msg)
+        await answer_callback(callback)
+        update_queue_later(bot, db, spotify)
 
 
 @router.callback_query(F.data == 'start_pause')
-async def start_pause_track(callback: CallbackQuery, bot: Bot):
+async def start_pause_track(callback: CallbackQuery, bot: Bot, db: DataBase, spotify: AsyncSpotify):
     if not db.is_active():
-        await handle_not_active_session(callback)
+        await handle_not_active_session(callback, db)
         return
     user_id = callback.from_user.id
     if user_id in db.admins or db.mode == db.share_mode:
         try:
             await spotify.start_pause()
         except PremiumRequired:
-            await handle_premium_required_error(callback)
+            await handle_premium_required_error(callback, db)
             return
         except ConnectionError:
             pass
-        await menu(callback)
-        await update_menu_for_all_users(bot, callback.from_user.id)
+        await menu(callback, db, spotify)
+        await answer_callback(callback)
+        update_menu_later(bot, db, spotify, callback.from_user.id)
 
 
 @router.callback_query(F.data == 'next_track')
-async def next_track(callback: CallbackQuery, bot: Bot):
+async def next_track(callback: CallbackQuery, bot: Bot, db: DataBase, spotify: AsyncSpotify):
     if not db.is_active():
-        await handle_not_active_session(callback)
+        await handle_not_active_session(callback, db)
         return
     user_id = callback.from_user.id
     if user_id in db.admins or db.mode == db.share_mode:
+        track_changed = spotify.watcher.expect(PlayerEvent.TRACK_CHANGED)
         try:
-            old_track = await spotify.get_curr_track()
             await spotify.next_track()
-            while old_track == await spotify.get_curr_track():
-                await asyncio.sleep(0.5)
-                await spotify.force_update()
+            await spotify.watcher.wait(track_changed)
         except PremiumRequired:
-            await handle_premium_required_error(callback)
+            await handle_premium_required_error(callback, db)
             return
         except ConnectionError:
             pass
-        await menu(callback)
-        await update_menu_for_all_users(bot, callback.from_user.id)
-        await update_queue_for_all_users(bot)
+        finally:
+            # a failed command leaves no waiter behind keeping the watcher at its fastest polling
+            spotify.watcher.discard(track_changed)
+        await menu(callback, db, spotify)
+        await answer_callback(callback)
+        update_menu_later(bot, db, spotify, callback.from_user.id)
+        update_queue_later(bot, db, spotify)
 
 
 @router.callback_query(F.data == 'previous_track')
-async def previous_track(callback: CallbackQuery, bot: Bot):
+async def previous_track(callback: CallbackQuery, bot: Bot, db: DataBase, spotify: AsyncSpotify):
     if not db.is_active():
-        await handle_not_active_session(callback)
+        await handle_not_active_session(callback, db)
         return
     user_id = callback.from_user.id
     if user_id in db.admins or db.mode == db.share_mode:
+        track_changed = spotify.watcher.expect(PlayerEvent.TRACK_CHANGED)
         try:
-            old_track = await spotify.get_curr_track()
             await spotify.previous_track()
-            while old_track == await spotify.get_curr_track():
-                await asyncio.sleep(0.5)
-                await spotify.force_update()
+            await spotify.watcher.wait(track_changed)
         except PremiumRequired:
-            await handle_premium_required_error(callback)
+            await handle_premium_required_error(callback, db)
             return
         except ConnectionError:
             pass
-        await menu(callback)
-        await update_menu_for_all_users(bot, callback.from_user.id)
-        await update_queue_for_all_users(bot)
+        finally:
+            # a failed command leaves no waiter behind keeping the watcher at its fastest polling
+            spotify.watcher.discard(track_changed)
+        await menu(callback, db, spotify)
+        await answer_callback(callback)
+        update_menu_later(bot, db, spotify, callback.from_user.id)
+        update_queue_later(bot, db, spotify)
 
 
 @router.callback_query(F.data == 'confirm_end_session')
-async def confirm_end_session(callback: CallbackQuery):
+async def confirm_end_session(callback: CallbackQuery, db: DataBase):
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="✅", callback_data="end_session"))
     builder.add(InlineKeyboardButton(text='❎', callback_data="menu"))
@@ -769,158 +792,193 @@ async def confirm_end_session(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == 'end_session')
-async def end_session(callback: CallbackQuery, bot: Bot):
-    for user in db.users:
-        try:
-            if user not in db.admins:
-                msg = await bot.send_message(chat_id=user, text="сессия завершена, для ее начала обратитесь к админам",
-                                             reply_markup=None)
+async def end_session(callback: CallbackQuery, bot: Bot, session: Session):
+    db = session.db
+    users, admins = db.users, db.admins
+    # spotify is closed and the state is dropped right away, users are notified afterwards
+    await sessions.end(session)
+    lobby = sessions.lobby.db
+
+    def say_goodbye(user_id):
+        async def goodbye(send):
+            if user_id not in admins:
+                text = "сессия завершена, для ее начала обратитесь к админам"
             else:
-                msg = await bot.send_message(chat_id=user,
-                                             text='сессия завершена, для начала новой используйте команду "/start"',
-                                             reply_markup=None)
-            await db.del_last_message(user)
-            await del_message(msg)
-        except:
-            pass
-    await spotify.close()
-    db.clear()
-
+                text = 'сессия завершена, для начала новой используйте команду "/start"'
+            msg = await send(bot.send_message, chat_id=user_id, text=text, reply_markup=None)
+            delayed_actions.delete_message_later(bot, msg.chat.id, msg.message_id, MESSAGE_TTL_SECONDS)
+            try:
+                await lobby.del_last_message(user_id, bot)
+            except TelegramAPIError as error:
+                # the goodbye is delivered, a menu too old to be deleted or a blocked bot doesn't fail it
+                logger.info("can't delete the menu of %s: %r", user_id, error)
+        return goodbye
 
-async def del_message(msg: Message):
-    await asyncio.sleep(5)
-    await msg.delete()
+    report = await broadcaster.broadcast({user_id: say_goodbye(user_id) for user_id in users})
+    logger.info("session %s ended: %r", session.token, report)
 
 
 @router.callback_query(F.data == 'increase_volume')
-async def increase_volume(callback: CallbackQuery, bot: Bot):
+async def increase_volume(callback: CallbackQuery, bot: Bot, db: DataBase, spotify: AsyncSpotify):
     if not db.is_active():
-        await handle_not_active_session(callback)
+        await handle_not_active_session(callback, db)
         return
     try:
         await spotify.increase_volume()
     except PremiumRequired:
-        await handle_premium_required_error(callback)
+        await handle_premium_required_error(callback, db)
         return
     except ConnectionError:
         pass
-    await menu(callback)
-    await update_menu_for_all_users(bot, callback.from_user.id)
+    await menu(callback, db, spotify)
+    await answer_callback(callback)
+    update_menu_later(bot, db, spotify, callback.from_user.id)
 
 
 @router.callback_query(F.data == 'decrease_volume')
-async def decrease_volume(callback: CallbackQuery, bot: Bot):
+async def decrease_volume(callback: CallbackQuery, bot: Bot, db: DataBase, spotify: AsyncSpotify):
     if not db.is_active():
-        await handle_not_active_session(callback)
+        await handle_not_active_session(callback, db)
         return
     try:
         await spotify.decrease_volume()
     except PremiumRequired:
-        await handle_premium_required_error(callback)
+        await handle_premium_required_error(callback, db)
         return
     except ConnectionError:
         pass
-    await menu(callback)
-    await update_menu_for_all_users(bot, callback.from_user.id)
+    await menu(callback, db, spotify)
+    await answer_callback(callback)
+    update_menu_later(bot, db, spotify, callback.from_user.id)
 
 
 @router.callback_query(F.data == 'mute_volume')
-async def mute_volume(callback: CallbackQuery, bot: Bot):
+async def mute_volume(callback: CallbackQuery, bot: Bot, db: DataBase, spotify: AsyncSpotify):
     if not db.is_active():
-        await handle_not_active_session(callback)
+        await handle_not_active_session(callback, db)
         return
     try:
         await spotify.mute_unmute()
     except PremiumRequired:
-        await handle_premium_required_error(callback)
+        await handle_premium_required_error(callback, db)
         return
     except ConnectionError:
         pass
     except Forbidden:
         pass
-    await menu(callback)
-    await update_menu_for_all_users(bot, callback.from_user.id)
+    await menu(callback, db, spotify)
+    await answer_callback(callback)
+    update_menu_later(bot, db, spotify, callback.from_user.id)
 
 
 @router.callback_query(F.data == 'leave_session')
-async def leave_session(callback: CallbackQuery):
+async def leave_session(callback: CallbackQuery, db: DataBase):
     user_id = callback.from_user.id
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="✅", callback_data="confirm_leave_session"))
     builder.add(InlineKeyboardButton(text='❎', callback_data="menu"))
-    if user_id not in db.admins or len(db.admins) > 1:
+    # admins from the file who haven't joined don't keep the session going
+    if user_id not in db.admins or len(db.admins.keys() & db.users.keys()) > 1:
         msg = await callback.message.edit_text(text='Вы уверены, что хотите покинуть сессию?',
                                                reply_markup=builder.as_markup())
         db.update_last_message(user_id, msg)
     else:
-        await confirm_end_session(callback)
+        await confirm_end_session(callback, db)
 
 
 @router.callback_query(F.data == "confirm_leave_session")
 async def confirm_leave_session(callback: CallbackQuery):
     user_id = callback.from_user.id
-    if user_id in db.admins:
-        db.del_admin(user_id)
-    if user_id in db.users:
-        db.del_user(user_id)
+    sessions.leave(user_id)
     await callback.message.edit_text(text='вы покинули сессию')
-    await asyncio.sleep(5)
-    await callback.message.delete()
+    delayed_actions.delete_message_later(callback.bot, callback.message.chat.id, callback.message.message_id,
+                                         MESSAGE_TTL_SECONDS)
+
+
+def leader_only(func):
+    """
+    the periodic update runs only on the worker holding the lease, see SessionRegistry.lead
+    """
+    @functools.wraps(func)
+    async def wrapper(*args):
+        if sessions.is_leader:
+            await func(*args)
+    return wrapper
+
+
+async def include_update_functions(bot: Bot, session: Session):
+    db, spotify = session.db, session.spotify
+    await db.include_update_functions([leader_only(update_queue_for_all_users), leader_only(update_menu_for_all_users)],
+                                      [[bot, db, spotify], [bot, db, spotify]])
+
+
+async def answer_callback(callback: CallbackQuery):
+    # stops the spinner on the button before the other users get their views
+    try:
+        await callback.answer()
+    except TelegramBadRequest:
+        # the query is too old to be answered
+        pass
+
+
+def update_menu_later(bot: Bot, db: DataBase, spotify: AsyncSpotify, *ignore_list):
+    """
+    broadcasts the menu in the background, a request made while one of the session runs replaces the waiting one
+    """
+    background_updates.schedule((db.token, ViewKind.MENU), update_menu_for_all_users, bot, db, spotify,
+                                skip=ignore_list)
+
+
+def update_queue_later(bot: Bot, db: DataBase, spotify: AsyncSpotify):
+    background_updates.schedule((db.token, ViewKind.QUEUE), update_queue_for_all_users, bot, db, spotify)
 
 
-async def update_menu_for_all_users(bot: Bot, *ignore_list):
+async def update_menu_for_all_users(bot: Bot, db: DataBase, spotify: AsyncSpotify, *ignore_list):
     if db.is_active():
-        curr = None
-        for user_id, message in db.last_message.items():
-            old: str = message.text
-            if old.startswith("🎧"):
-                if curr is None:
-                    try:
-                        curr = await get_menu_text()
-                    except ConnectionError:
-                        await handle_connection_error(message, bot)
-                        return
-                if user_id not in ignore_list:
-                    old_split = old.split('\n\n')
-                    old_split = [item[item.find(":") + 2:] for item in old_split]
-                    curr_split = curr.split('\n\n')
-                    curr_split = [item[item.find(":") + 2:] for item in curr_split]
-                    if old_split != curr_split:
-                        if user_id in db.admins:
-                            markup = get_admin_menu_keyboard()
-                        else:
-                            markup = get_user_menu_keyboard()
-                        try:
-                            msg = await bot.edit_message_text(chat_id=user_id, text=curr, message_id=message.message_id,
-                                                              reply_markup=markup)
-                            db.update_last_message(user_id, msg)
-                        except:
-                            pass
-
-
-async def update_queue_for_all_users(bot: Bot):
+        messages = {user_id: message for user_id, message in db.last_message.items()
+                    if message.kind == ViewKind.MENU and user_id not in ignore_list}
+        if len(messages) == 0:
+            return
+        try:
+            model = await get_menu_model(db, spotify)
+        except RateLimited:
+            return
+        except ConnectionError:
+            await handle_connection_error(next(iter(messages.values())), db, bot)
+            return
+        await broadcast_view(bot, db, messages, lambda role: render_menu(role, db, model))
+
+
+async def update_queue_for_all_users(bot: Bot, db: DataBase, spotify: AsyncSpotify):
     if db.is_active():
-        queue = None
-        for user_id, message in db.last_message.items():
-            old: str = message.text
-            if old.startswith('треки в очереди') or old.startswith("в очереди нет треков"):
-                if queue is None:
-                    try:
-                        queue = await get_queue_text()
-                    except PremiumRequired:
-                        await handle_connection_error(message, bot)
-                        return
-                    except ConnectionError:
-                        await handle_premium_required_error(message)
-                        return
-                if queue is None:
-                    new = "в очереди нет треков"
-                else:
-                    new = "треки в очереди:\n\n" + queue
-                if old != new:
-                    try:
-                        msg = await bot.edit_message_text(chat_id=user_id, text=new, message_id=message.message_id,
-                                                          reply_markup=get_menu_keyboard())
-                        db.update_last_message(user_id, msg)
-                    except:
-                        pass
+        messages = {user_id: message for user_id, message in db.last_message.items() if message.kind == ViewKind.QUEUE}
+        if len(messages) == 0:
+            return
+        try:
+            model = await get_queue_model(db, spotify)
+        except (PremiumRequired, RateLimited):
+            return
+        except ConnectionError:
+            await handle_connection_error(next(iter(messages.values())), db, bot)
+            return
+        await broadcast_view(bot, db, messages, lambda role: render_queue(role, db, model))
+
+
+async def broadcast_view(bot: Bot, db: DataBase, messages: dict[int, LastMessage], render):
+    """
+    edits messages of users whose view differs from the rendered one, unchanged views cost no api calls
+    """
+    def edit_view(user_id, message: LastMessage, view: RenderedView):
+        async def edit(send):
+            msg = await send(bot.edit_message_text, chat_id=message.chat_id, text=view.text,
+                             message_id=message.message_id, reply_markup=view.markup)
+            db.update_last_message(user_id, msg, view.content_hash)
+        return edit
+
+    views = {role: render(role) for role in Role}
+    actions = {}
+    for user_id, message in messages.items():
+        view = views[get_role(user_id, db)]
+        if not message.shows(view.content_hash):
+            actions[user_id] = edit_view(user_id, message, view)
+    await broadcaster.broadcast(actions)
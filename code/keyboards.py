@@ -0,0 +1,92 @@
+from functools import lru_cache, wraps
+
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
+from pydantic import ConfigDict
+
+# markups don't depend on anything but role and session mode, so every variant is built once and shared
+
+
+class SharedButton(InlineKeyboardButton):
+    """
+    button shared by every markup of its variant, so it can't be changed
+    """
+    model_config = ConfigDict(frozen=True)
+
+
+def prebuilt(build):
+    """
+    builds every variant of the markup once, each call gets its own rows of the shared buttons,
+    so that a caller editing its markup doesn't change it for the others
+    """
+
+    @lru_cache(maxsize=None)
+    def rows(*args) -> tuple[tuple[SharedButton, ...], ...]:
+        return tuple(tuple(SharedButton(**button.model_dump(exclude_none=True)) for button in row)
+                     for row in build(*args).inline_keyboard)
+
+    @wraps(build)
+    def markup(*args) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup.model_construct(inline_keyboard=[list(row) for row in rows(*args)])
+
+    return markup
+
+
+@prebuilt
+def settings_keyboard(is_admin: bool) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="посмотреть токен", callback_data="view_token"))
+    builder.row(InlineKeyboardButton(text='ссылка приглашение', callback_data="view_url"))
+    builder.row(InlineKeyboardButton(text='QR-код', callback_data="view_qr"))
+    builder.row(InlineKeyboardButton(text="сменить устройство", callback_data="view_devices"))
+    if is_admin:
+        builder.row(InlineKeyboardButton(text='изменить режим', callback_data="change_mode"))
+        # builder.row(InlineKeyboardButton(text='добавить админа', callback_data="view_admins_to_add"))
+    builder.row(InlineKeyboardButton(text='покинуть сессию', callback_data="leave_session"))
+    if is_admin:
+        builder.row(InlineKeyboardButton(text="завершить сессию", callback_data="confirm_end_session"))
+    builder.row(InlineKeyboardButton(text='назад', callback_data="menu"))
+    return builder.as_markup()
+
+
+@prebuilt
+def admin_menu_keyboard() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="⚙️ настройки ⚙️", callback_data="get_settings"))
+    # builder.row(InlineKeyboardButton(text='🎵 добавить трек 🎵', callback_data='add_track'))
+    builder.row(InlineKeyboardButton(text='💽 очередь 💽', callback_data="view_queue"))
+    builder.row(InlineKeyboardButton(text='📖 текст песни 📖', callback_data="view_lyrics"))
+    builder.row(InlineKeyboardButton(text='🔉', callback_data='decrease_volume'))
+    builder.add(InlineKeyboardButton(text='🔇', callback_data='mute_volume'))
+    builder.add(InlineKeyboardButton(text='🔊', callback_data="increase_volume"))
+    # builder.row(InlineKeyboardButton(text="🔄 обновить 🔄", callback_data='refresh'))
+    builder.row(InlineKeyboardButton(text="⏮", callback_data="previous_track"))
+    builder.add(InlineKeyboardButton(text="⏯", callback_data="start_pause"))
+    builder.add(InlineKeyboardButton(text="⏭", callback_data="next_track"))
+    return builder.as_markup()
+
+
+@prebuilt
+def user_menu_keyboard(share_mode: bool) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="⚙️ настройки ⚙️", callback_data="get_settings"))
+    builder.row(InlineKeyboardButton(text='🎵 добавить трек 🎵', callback_data="add_track"))
+    builder.row(InlineKeyboardButton(text='💽 очередь 💽', callback_data="view_queue"))
+    builder.row(InlineKeyboardButton(text='📖 текст песни 📖', callback_data="view_lyrics"))
+    if share_mode:
+        builder.row(InlineKeyboardButton(text='🔉', callback_data='decrease_volume'))
+        builder.add(InlineKeyboardButton(text='🔇', callback_data='mute_volume'))
+        builder.add(InlineKeyboardButton(text='🔊', callback_data="increase_volume"))
+    # builder.row(InlineKeyboardButton(text="🔄обновить🔄", callback_data='refresh'))
+    if share_mode:
+        builder.row(InlineKeyboardButton(text="⏮", callback_data="previous_track"))
+        builder.add(InlineKeyboardButton(text="⏯", callback_data="start_pause"))
+        builder.add(InlineKeyboardButton(text="⏭", callback_data="next_track"))
+    return builder.as_markup()
+
+
+@prebuilt
+def menu_keyboard() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text='в меню', callback_data='menu'))
+    return builder.as_markup()
@@ -0,0 +1,74 @@
+from enum import Enum
+from hashlib import blake2b
+
+from aiogram.types import Message
+
+
+class ViewKind(Enum):
+    OTHER = 0
+    MENU = 1
+    QUEUE = 2
+
+
+def view_of(text: str | None) -> tuple[ViewKind, int]:
+    """
+    :return: kind of the view shown by the text and hash of its content
+    """
+    if text is None:
+        return ViewKind.OTHER, 0
+    if text.startswith("🎧"):
+        kind = ViewKind.MENU
+    elif text.startswith('треки в очереди') or text.startswith("в очереди нет треков"):
+        kind = ViewKind.QUEUE
+    else:
+        kind = ViewKind.OTHER
+    # stable between processes, so that hashes restored from the state store stay comparable
+    digest = blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return kind, int.from_bytes(digest, "big")
+
+
+class LastMessage:
+    """
+    the last message the bot shows to a user, kept instead of the whole aiogram message
+    """
+
+    __slots__ = ("chat_id", "message_id", "kind", "content_hash")
+
+    def __init__(self, chat_id: int, message_id: int, kind: ViewKind = ViewKind.OTHER, content_hash: int = 0):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.kind = kind
+        self.content_hash = content_hash
+
+    @classmethod
+    def from_message(cls, message: Message, content_hash: int | None = None) -> "LastMessage":
+        """
+        :param content_hash: hash of the rendered view shown by the message, the hash of its text by default
+        """
+        kind, text_hash = view_of(message.text)
+        return cls(message.chat.id, message.message_id, kind, text_hash if content_hash is None else content_hash)
+
+    def shows(self, content_hash: int) -> bool:
+        """
+        :return: True if the message already shows the content with the hash
+        """
+        return self.content_hash == content_hash
+
+    def dump(self) -> tuple:
+        return self.chat_id, self.message_id, self.kind.value, self.content_hash
+
+    @classmethod
+    def load(cls, item) -> "LastMessage":
+        """
+        :param item: dumped message, (chat_id, message_id, text) stored by older versions or just the ids
+        """
+        if len(item) == 2:
+            return cls(*item)
+        if len(item) == 3:
+            chat_id, message_id, text = item
+            return cls(chat_id, message_id, *view_of(text))
+        chat_id, message_id, kind, content_hash = item
+        return cls(chat_id, message_id, ViewKind(kind), content_hash)
+
+    def __repr__(self):
+        return f"LastMessage(chat_id={self.chat_id}, message_id={self.message_id}, kind={self.kind.name})"
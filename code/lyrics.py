@@ -1,7 +1,8 @@
 import asyncio
-import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import lyrics_find_engine
+import metrics
 
 
 class Lyrics:
@@ -36,47 +37,54 @@ class Lyrics:
         return self._split_lyrics
 
 
+class LyricsNotFound(ValueError):
+    """
+    genius has no lyrics for the song, unlike other lookup failures this result is worth caching
+    """
+    pass
+
+
 class LyricsFinder:
+    __MAX_WORKERS = 4
+    __TIMEOUT_SECONDS = 15
+    # a lookup makes two requests to genius, with a retry each they end within the lookup timeout,
+    # so a timed out lookup doesn't keep its worker thread busy for long
+    __REQUEST_TIMEOUT_SECONDS = 3
+    __REQUEST_RETRIES = 1
+
+    # genius client is synchronous, lookups run in a bounded pool shared by all finders
+    _executor = ThreadPoolExecutor(max_workers=__MAX_WORKERS, thread_name_prefix="lyrics")
 
     def __init__(self):
-        self._genius_api = lyrics_find_engine.Genius(verbose=False, remove_section_headers=True)
-        self._found_res = None
+        self._genius_api = lyrics_find_engine.Genius(verbose=False, remove_section_headers=True,
+                                                     timeout=self.__REQUEST_TIMEOUT_SECONDS,
+                                                     retries=self.__REQUEST_RETRIES)
 
     def _api_request(self, title, artist):
+        return self._genius_api.search_song(title=title, artist=artist, get_full_info=False)
+
+    @metrics.timed(metrics.lyrics_fetch_seconds, metrics.lyrics_fetch_errors)
+    async def find(self, artist: str, name: str, timeout: float = __TIMEOUT_SECONDS) -> Lyrics:
+        """
+        :raises LyricsNotFound: genius has no lyrics for the song
+        :raises ValueError: lookup failed or took longer than timeout
+        """
+        loop = asyncio.get_running_loop()
         try:
-            self._found_res = self._genius_api.search_song(title=title, artist=artist, get_full_info=False)
-        except:
-            self._found_res = ""
+            song = await asyncio.wait_for(loop.run_in_executor(self._executor, self._api_request, name, artist),
+                                          timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            raise ValueError("lyrics lookup failed")
+        if song is None or song.lyrics is None:
+            raise LyricsNotFound("lyrics not found")
+        raw_lyrics: str = song.lyrics
+        last_non_digit = raw_lyrics.rfind("Embed") - 1 if raw_lyrics.rfind("Embed") != -1 else len(raw_lyrics) - 1
+        for i in range(last_non_digit, -1, -1):
+            if not raw_lyrics[i].isdigit():
+                last_non_digit = i
+                break
+        lyrics = raw_lyrics[raw_lyrics.find("\n") + 1:last_non_digit + 1]
+        return Lyrics(name, artist, lyrics)
 
-    async def find(self, artist: str, name: str) -> Lyrics:
-        try:
-            self._found_res = None
-            thread = threading.Thread(target=self._api_request, args=(name, artist,))
-            thread.start()
-            while self._found_res is None:
-                await asyncio.sleep(0.5)
-
-            if self._found_res == "":
-                raise Exception("No song name found")
-        except:
-            raise ValueError("lyrics not found")
-        else:
-            song = self._found_res
-            raw_lyrics: str = song.lyrics
-            last_non_digit = raw_lyrics.rfind("Embed") - 1 if raw_lyrics.rfind("Embed") != -1 else len(raw_lyrics) - 1
-            for i in range(last_non_digit, -1, -1):
-                if not raw_lyrics[i].isdigit():
-                    last_non_digit = i
-                    break
-            lyrics = raw_lyrics[raw_lyrics.find("\n") + 1:last_non_digit + 1]
-            return Lyrics(name, artist, lyrics)
-
-
-async def test():
-    l = LyricsFinder()
-    song = await l.find("annihilate", "metro boomin")
-    print(song.lyrics)
-
-
-if __name__ == '__main__':
-    asyncio.run(test())
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from cache import CacheStats
+from config_reader import config
+from lyrics import Lyrics, LyricsNotFound
+
+logger = logging.getLogger(__name__)
+
+
+class LyricsCacheStats(CacheStats):
+    __slots__ = ("disk_hits", "negative_hits")
+
+    def __init__(self):
+        super().__init__()
+        self.disk_hits = 0
+        self.negative_hits = 0
+
+    def as_dict(self) -> dict:
+        res = super().as_dict()
+        res["disk_hits"] = self.disk_hits
+        res["negative_hits"] = self.negative_hits
+        return res
+
+    @property
+    def hit_rate(self) -> float:
+        # lookups answered by either tier, only misses went to genius
+        total = self.hits + self.disk_hits + self.misses + self.coalesced
+        return (self.hits + self.disk_hits + self.coalesced) / total if total else 0.0
+
+
+class LyricsCache:
+    """
+    two-tier lyrics cache: bounded in-memory lru in front of a sqlite file kept under data_path,
+    songs without lyrics are remembered too, but for a shorter time
+    """
+
+    __MEMORY_SIZE = 256
+    __TTL_SECONDS = 30 * 24 * 60 * 60
+    __NEGATIVE_TTL_SECONDS = 6 * 60 * 60
+    __FILE_NAME = "lyrics_cache.sqlite3"
+    # expired rows are never read, so they are purged only now and then
+    __PURGE_EVERY_WRITES = 100
+
+    def __init__(self, data_path, memory_size=__MEMORY_SIZE, ttl=__TTL_SECONDS, negative_ttl=__NEGATIVE_TTL_SECONDS,
+                 purge_every=__PURGE_EVERY_WRITES):
+        os.makedirs(data_path, exist_ok=True)
+        self._file_name = f"{data_path}/{self.__FILE_NAME}"
+        self._memory_size = memory_size
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._purge_every = purge_every
+        self._writes = 0
+        self._memory: OrderedDict[tuple, tuple[float, Lyrics | None]] = OrderedDict()
+        self._in_flight: dict[tuple, asyncio.Task] = {}
+        # number of callers waiting for every lookup in flight
+        self._waiting: dict[tuple, int] = {}
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self.stats = LyricsCacheStats()
+
+    @staticmethod
+    def normalize(artist: str, name: str) -> tuple[str, str]:
+        def clean(text):
+            text = re.sub(r"[(\[].*?[)\]]", " ", text.casefold())
+            return " ".join(re.sub(r"\W+", " ", text).split())
+
+        return clean(artist), clean(name)
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self._file_name, check_same_thread=False)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS lyrics (artist_key TEXT, name_key TEXT, artist TEXT, "
+                                     "name TEXT, lyrics TEXT, expires REAL, PRIMARY KEY (artist_key, name_key))")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS lyrics_expires ON lyrics(expires)")
+        return self._connection
+
+    def _disk_get(self, key):
+        with self._lock:
+            row = self._db().execute("SELECT artist, name, lyrics, expires FROM lyrics "
+                                     "WHERE artist_key = ? AND name_key = ?", key).fetchone()
+        if row is None or row[3] <= time.time():
+            return None
+        artist, name, text, expires = row
+        return expires, None if text is None else Lyrics(name, artist, text)
+
+    def _disk_set(self, key, lyrics: Lyrics | None, expires: float):
+        values = (None, None, None) if lyrics is None else (lyrics.artist, lyrics.name, lyrics.lyrics)
+        with self._lock:
+            with self._db() as connection:
+                connection.execute("INSERT OR REPLACE INTO lyrics VALUES (?, ?, ?, ?, ?, ?)", (*key, *values, expires))
+                self._writes += 1
+                if self._writes % self._purge_every == 0:
+                    connection.execute("DELETE FROM lyrics WHERE expires <= ?", (time.time(),))
+
+    def _remember(self, key, lyrics: Lyrics | None, expires: float):
+        self._memory[key] = (expires, lyrics)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_size:
+            self._memory.popitem(last=False)
+
+    def _from_entry(self, entry):
+        lyrics = entry[1]
+        if lyrics is None:
+            self.stats.negative_hits += 1
+            raise LyricsNotFound("lyrics not found")
+        return lyrics
+
+    def __len__(self):
+        return len(self._memory)
+
+    def contains(self, artist: str, name: str) -> bool:
+        entry = self._memory.get(self.normalize(artist, name))
+        return entry is not None and entry[0] > time.time()
+
+    async def get(self, artist: str, name: str, loader, on_miss=None) -> Lyrics:
+        """
+        :param loader: coroutine function (artist, name) -> Lyrics, raises LyricsNotFound if there are no lyrics
+        :param on_miss: optional coroutine function awaited by this caller before waiting for a slow lookup
+        :raises ValueError: lyrics not found
+        """
+        key = self.normalize(artist, name)
+        entry = self._memory.get(key)
+        if entry is not None and entry[0] > time.time():
+            self._memory.move_to_end(key)
+            self.stats.hits += 1
+            return self._from_entry(entry)
+
+        task = self._in_flight.get(key)
+        if task is None:
+            entry = await asyncio.to_thread(self._disk_get, key)
+            if entry is not None:
+                self.stats.disk_hits += 1
+                self._remember(key, entry[1], entry[0])
+                return self._from_entry(entry)
+            # another caller could start the lookup while the disk was read
+            task = self._in_flight.get(key)
+        if task is not None:
+            self.stats.coalesced += 1
+        else:
+            self.stats.misses += 1
+            task = asyncio.ensure_future(self._load(key, artist, name, loader))
+            self._in_flight[key] = task
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            if on_miss is not None:
+                try:
+                    await on_miss()
+                except Exception:
+                    logger.warning("lyrics waiter failed", exc_info=True)
+            # shielded, so that a cancelled caller doesn't cancel the lookup for the others
+            return self._from_entry(await asyncio.shield(task))
+        finally:
+            waiting = self._waiting.pop(key) - 1
+            if waiting:
+                self._waiting[key] = waiting
+            elif not task.done():
+                # nobody waits for the lookup anymore, e.g. its prefetch was cancelled
+                task.cancel()
+
+    async def _load(self, key, artist, name, loader):
+        try:
+            try:
+                lyrics, expires = await loader(artist, name), time.time() + self._ttl
+            except LyricsNotFound:
+                lyrics, expires = None, time.time() + self._negative_ttl
+            self._remember(key, lyrics, expires)
+            try:
+                await asyncio.to_thread(self._disk_set, key, lyrics, expires)
+            except sqlite3.Error:
+                logger.warning("can't store lyrics on disk", exc_info=True)
+            return expires, lyrics
+        finally:
+            self._in_flight.pop(key, None)
+
+    def _disk_delete(self, key):
+        with self._lock:
+            with self._db() as connection:
+                connection.execute("DELETE FROM lyrics WHERE artist_key = ? AND name_key = ?", key)
+
+    async def invalidate(self, artist: str, name: str):
+        key = self.normalize(artist, name)
+        self.stats.invalidations += 1
+        self._memory.pop(key, None)
+        await asyncio.to_thread(self._disk_delete, key)
+
+
+lyrics_cache = LyricsCache(config.data_path.get_secret_value())
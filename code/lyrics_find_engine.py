@@ -1,8 +1,38 @@
 import lyricsgenius
+import lxml.etree
+import lxml.html
 from lyricsgenius.utils import clean_str
-from bs4 import BeautifulSoup
 import re
 
+# first div whose class is exactly "lyrics" or contains "Lyrics__Root", as BeautifulSoup matched it before
+_LYRICS_DIV = lxml.etree.XPath("(//div[contains(@class, 'Lyrics__Root') or "
+                               "contains(concat(' ', normalize-space(@class), ' '), ' lyrics ')])[1]")
+# visible text only: comments and script/style/template contents are skipped like BeautifulSoup.get_text() does
+_VISIBLE_TEXT = lxml.etree.XPath(".//text()[not(ancestor::script or ancestor::style or ancestor::template)]")
+
+
+def extract_lyrics(page: str) -> str | None:
+    """Finds the lyrics container of a Genius song page and returns its text.
+
+    The page is parsed by lxml straight into a C tree and the container is located
+    with a precompiled XPath, so no Python objects are created for the rest of the page.
+
+    Args:
+        page (:obj:`str`): HTML of the song page.
+
+    Returns:
+        :obj:`str` \\|‌ :obj:`None`: text of the lyrics container or `None` if there is none.
+
+    """
+    try:
+        html = lxml.html.document_fromstring(page.replace('<br/>', '\n'))
+    except (lxml.etree.ParserError, ValueError):
+        return None
+    divs = _LYRICS_DIV(html)
+    if not divs:
+        return None
+    return ''.join(_VISIBLE_TEXT(divs[0]))
+
 
 class Genius(lyricsgenius.Genius):
     """User-level interface with the Genius.com API and public API.
@@ -65,7 +95,7 @@ class Genius(lyricsgenius.Genius):
                          )
 
     def lyrics(self, song_id=None, song_url=None, remove_section_headers=False):
-        """Uses BeautifulSoup to scrape song info off of a Genius song URL
+        """Scrapes song lyrics off of a Genius song URL
 
         You must supply either `song_id` or song_url`.
 
@@ -100,22 +130,14 @@ class Genius(lyricsgenius.Genius):
             path = self.song(song_id)['song']['path'][1:]
 
         # Scrape the song lyrics from the HTML
-        html = BeautifulSoup(
-            self._make_request(path, web=True).replace('<br/>', '\n'),
-            "lxml"
-        )
-
-        # Determine the class of the div
-        div = html.find("div", class_=re.compile("^lyrics$|Lyrics__Root"))
-        if div is None:
+        lyrics = extract_lyrics(self._make_request(path, web=True))
+        if lyrics is None:
             if self.verbose:
                 print("Couldn't find the lyrics section. "
                       "Please report this if the song has lyrics.\n"
                       "Song URL: https://genius.com/{}".format(path))
             return None
 
-        lyrics = div.get_text()
-
         # Remove [Verse], [Bridge], etc.
         if self.remove_section_headers or remove_section_headers:
             lyrics = re.sub(r'(\[.*?\])*', '', lyrics)
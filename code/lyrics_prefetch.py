@@ -0,0 +1,65 @@
+import asyncio
+import logging
+
+from lyrics_cache import lyrics_cache
+
+logger = logging.getLogger(__name__)
+
+
+class LyricsPrefetcher:
+    """
+    warms lyrics cache for the upcoming tracks in background,
+    lookups of tracks which left the upcoming window are cancelled
+    """
+
+    __CONCURRENCY = 1
+    __START_DELAY_SECONDS = 1
+
+    def __init__(self, loader, depth: int, concurrency: int = __CONCURRENCY):
+        self._loader = loader
+        self._depth = depth
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: dict[tuple, asyncio.Task] = {}
+        self.prefetched = 0
+        self.cancelled = 0
+
+    def update(self, tracks: list[tuple[str, str]]):
+        """
+        :param tracks: (artist, name) of the current and upcoming tracks in play order
+        """
+        wanted = {}
+        for artist, name in tracks[:self._depth]:
+            key = lyrics_cache.normalize(artist, name)
+            if key not in wanted and not lyrics_cache.contains(artist, name):
+                wanted[key] = (artist, name)
+
+        for key in list(self._tasks):
+            if key not in wanted:
+                self._tasks.pop(key).cancel()
+        for key, (artist, name) in wanted.items():
+            if key not in self._tasks:
+                self._tasks[key] = asyncio.create_task(self._prefetch(key, artist, name))
+
+    async def _prefetch(self, key, artist, name):
+        try:
+            # low priority: let interactive lookups started at the same moment go first
+            await asyncio.sleep(self.__START_DELAY_SECONDS)
+            async with self._semaphore:
+                await lyrics_cache.get(artist, name, self._loader)
+            self.prefetched += 1
+        except ValueError:
+            pass
+        except asyncio.CancelledError:
+            # the lookup itself is cancelled by the cache unless an interactive caller waits for it too
+            self.cancelled += 1
+            raise
+        except Exception:
+            logger.warning("lyrics prefetch failed", exc_info=True)
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                self._tasks.pop(key)
+
+    def cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
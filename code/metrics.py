@@ -0,0 +1,242 @@
+"""
+counters, gauges and histograms of the bot rendered in the prometheus text format and served on /metrics
+"""
+import asyncio
+import functools
+import inspect
+import math
+import time
+from abc import ABC, abstractmethod
+from typing import Callable
+
+from aiohttp import web
+
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    def _key(self, labels: dict) -> tuple:
+        if labels.keys() != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labels)
+
+    @abstractmethod
+    def samples(self) -> list[str]:
+        """
+        :return: lines of the metric in the prometheus text format
+        """
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """
+    value set by the code, or taken from the function when metrics are collected
+    """
+    type = "gauge"
+
+    def __init__(self, name, documentation, labels=(), function: Callable[[], float] | None = None):
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple, float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def samples(self):
+        values = {(): self._function()} if self._function is not None else self._values
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets: tuple[float, ...] = _DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self._buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> count of observations in every bucket (not cumulative), sum of observations
+        self._counts: dict[tuple, list[int]] = {}
+        self._sums: dict[tuple, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * len(self._buckets)
+            self._sums[key] = 0.0
+        for index, bound in enumerate(self._buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        self._sums[key] += value
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def samples(self):
+        lines = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self._buckets, counts):
+                cumulative += count
+                le = _format_labels(self.labels, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(self._sums[key])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=(), function=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name, documentation, labels=(), buckets=_DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+handler_seconds = registry.histogram("bot_handler_seconds", "time of handling an update by its action",
+                                     ("action",))
+handler_errors = registry.counter("bot_handler_errors_total", "updates whose handling raised", ("action", "error"))
+spotify_call_seconds = registry.histogram("bot_spotify_call_seconds", "time of AsyncSpotify method calls",
+                                          ("method",))
+spotify_call_errors = registry.counter("bot_spotify_call_errors_total", "AsyncSpotify method calls which raised",
+                                       ("method", "error"))
+spotify_retries = registry.counter("bot_spotify_retries_total", "spotify api requests repeated after a failure")
+spotify_rate_limited = registry.counter("bot_spotify_rate_limited_total", "spotify api answers with status 429")
+lyrics_fetch_seconds = registry.histogram("bot_lyrics_fetch_seconds", "time of lyrics lookups on genius",
+                                          buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30))
+lyrics_fetch_errors = registry.counter("bot_lyrics_fetch_errors_total", "lyrics lookups which found nothing or failed",
+                                       ("error",))
+job_seconds = registry.histogram("bot_scheduler_job_seconds", "time of scheduled jobs", ("job",))
+job_errors = registry.counter("bot_scheduler_job_errors_total", "scheduled jobs which raised", ("job", "error"))
+
+
+def timed(histogram: Histogram, errors: Counter, **labels):
+    """
+    decorator of coroutine functions observing their time in the histogram and counting exceptions by type
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception as error:
+                errors.inc(error=type(error).__name__, **labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def instrumented(histogram: Histogram, errors: Counter):
+    """
+    class decorator timing every public coroutine method, labelled by method name
+    """
+    def decorator(cls):
+        for name, value in list(vars(cls).items()):
+            if not name.startswith("_") and inspect.isfunction(value) and inspect.iscoroutinefunction(value):
+                setattr(cls, name, timed(histogram, errors, method=name)(value))
+        return cls
+    return decorator
+
+
+def timed_job(func):
+    """
+    wraps a function or coroutine function run by the scheduler, so that its time is observed by name
+    """
+    name = getattr(func, "__name__", type(func).__name__)
+    if asyncio.iscoroutinefunction(func):
+        return timed(job_seconds, job_errors, job=name)(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception as error:
+            job_errors.inc(job=name, error=type(error).__name__)
+            raise
+        finally:
+            job_seconds.observe(time.perf_counter() - start, job=name)
+    return wrapper
+
+
+async def metrics_handler(request):
+    return web.Response(body=registry.render().encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def serve(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
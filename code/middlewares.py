@@ -0,0 +1,71 @@
+import re
+import time
+from typing import Any, Awaitable, Callable, Collection
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+import metrics
+from sessions import SessionRegistry
+
+
+def action_of(update: Update, actions: Collection[str] = ()) -> str:
+    """
+    name of what the user did: callback data or its factory prefix, command or kind of the update
+    :param actions: known callback data, prefixes and commands, anything else is 'other' to keep few distinct values
+    """
+    if update.callback_query is not None and update.callback_query.data:
+        data = update.callback_query.data
+        # callback factories separate the prefix from packed values with a non-word character
+        action = data if data in actions else re.split(r"\W", data, maxsplit=1)[0]
+    elif update.message is not None:
+        text = update.message.text or ""
+        if not text.startswith("/"):
+            return "message"
+        action = text.split(maxsplit=1)[0].split("@", 1)[0]
+    else:
+        return update.event_type
+    return action if action in actions else "other"
+
+
+class SessionMiddleware(BaseMiddleware):
+    """
+    passes session of the user to filters and handlers as 'session', 'db' and 'spotify'
+    """
+
+    def __init__(self, registry: SessionRegistry):
+        self._registry = registry
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        session = self._registry.lobby if user is None else await self._registry.resolve(user.id)
+        data["session"] = session
+        data["db"] = session.db
+        data["spotify"] = session.spotify
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            session.register_update(time.perf_counter() - start)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    observes handling time of every update by its action
+    """
+
+    def __init__(self, actions: Collection[str]):
+        self._actions = actions
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: dict[str, Any]) -> Any:
+        action = action_of(event, self._actions)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as error:
+            metrics.handler_errors.inc(action=action, error=type(error).__name__)
+            raise
+        finally:
+            metrics.handler_seconds.observe(time.perf_counter() - start, action=action)
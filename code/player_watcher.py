@@ -0,0 +1,165 @@
+import asyncio
+import logging
+from enum import Enum
+
+import spotify_errors
+
+logger = logging.getLogger(__name__)
+
+
+class PlayerEvent(Enum):
+    TRACK_CHANGED = "track_changed"
+    PLAYBACK_CHANGED = "playback_changed"
+
+
+class PlayerWatcher:
+    """
+    background task polling the player with adaptive backoff and notifying waiters about changes
+    """
+
+    __MIN_INTERVAL = 0.5
+    __MAX_INTERVAL = 10
+    __BACKOFF_FACTOR = 2
+    __TRACK_END_MARGIN = 0.5
+    __DEFAULT_TIMEOUT = 5
+
+    def __init__(self, spotify):
+        self._spotify = spotify
+        self._interval = self.__MIN_INTERVAL
+        self._task: asyncio.Task | None = None
+        self._wake: asyncio.Event | None = None
+        self._waiters: list[tuple[set[PlayerEvent], asyncio.Future]] = []
+        self._listeners = []
+        self._track_id = None
+        self._is_playing = None
+        self.polls = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        for _, waiter in self._waiters:
+            if not waiter.done():
+                waiter.cancel()
+        self._waiters.clear()
+
+    def kick(self):
+        """
+        resets backoff and polls right away, called after commands changing the player
+        """
+        self._interval = self.__MIN_INTERVAL
+        if self._wake is not None:
+            self._wake.set()
+
+    def expect(self, *events: PlayerEvent) -> asyncio.Future:
+        """
+        registers interest in the next of given events, call it before sending the command to the player
+        so that a change noticed while the command is in flight is not missed
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((set(events), waiter))
+        return waiter
+
+    async def wait(self, waiter: asyncio.Future, timeout: float = __DEFAULT_TIMEOUT) -> PlayerEvent | None:
+        """
+        :return: event which resolved the waiter or None if nothing happened in time
+        """
+        self.kick()
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.discard(waiter)
+
+    def discard(self, waiter: asyncio.Future):
+        """
+        drops the waiter, e.g. when the command it was expected for failed, so that polling can back off again
+        """
+        if not waiter.done():
+            waiter.cancel()
+        self._waiters = [item for item in self._waiters if item[1] is not waiter]
+
+    async def wait_for(self, *events: PlayerEvent, timeout: float = __DEFAULT_TIMEOUT) -> PlayerEvent | None:
+        return await self.wait(self.expect(*events), timeout)
+
+    def subscribe(self, listener):
+        """
+        :param listener: function called with the list of events on every change
+        """
+        self._listeners.append(listener)
+
+    def _emit(self, events: list[PlayerEvent]):
+        for listener in self._listeners:
+            try:
+                listener(events)
+            except Exception:
+                logger.exception("player watcher listener failed")
+        remaining = []
+        for expected, waiter in self._waiters:
+            if waiter.done():
+                continue
+            matched = [event for event in events if event in expected]
+            if matched:
+                waiter.set_result(matched[0])
+            else:
+                remaining.append((expected, waiter))
+        self._waiters = remaining
+
+    def _next_interval(self, currently_playing) -> float:
+        if self._waiters:
+            return self.__MIN_INTERVAL
+        interval = self._interval
+        if currently_playing is not None and currently_playing.is_playing and currently_playing.track is not None:
+            # wake up right after the track is expected to end
+            left = (currently_playing.track.duration - currently_playing.progress).total_seconds()
+            interval = min(interval, max(self.__MIN_INTERVAL, left + self.__TRACK_END_MARGIN))
+        return interval
+
+    async def _poll(self):
+        self.polls += 1
+        currently_playing = await self._spotify.refresh_player_state()
+        track_id = None if currently_playing.track is None else currently_playing.track.id
+        events = []
+        if self._track_id is not None and track_id != self._track_id:
+            events.append(PlayerEvent.TRACK_CHANGED)
+        if self._is_playing is not None and currently_playing.is_playing != self._is_playing:
+            events.append(PlayerEvent.PLAYBACK_CHANGED)
+        self._track_id, self._is_playing = track_id, currently_playing.is_playing
+        if events:
+            self._interval = self.__MIN_INTERVAL
+            self._emit(events)
+        else:
+            self._interval = min(self.__MAX_INTERVAL, self._interval * self.__BACKOFF_FACTOR)
+        return currently_playing
+
+    async def _run(self):
+        while True:
+            currently_playing = None
+            self._wake.clear()
+            try:
+                currently_playing = await self._poll()
+            except spotify_errors.RateLimited as error:
+                self._interval = max(self._interval, error.retry_after)
+            except spotify_errors.SpotifyErrors:
+                self._interval = min(self.__MAX_INTERVAL, self._interval * self.__BACKOFF_FACTOR)
+            except Exception:
+                logger.exception("player watcher poll failed")
+                self._interval = self.__MAX_INTERVAL
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._next_interval(currently_playing))
+            except asyncio.TimeoutError:
+                pass
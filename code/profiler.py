@@ -0,0 +1,137 @@
+"""
+time-boxed sampling profiler of the running event loop, started by admins from the bot,
+writes collapsed stacks ready for flamegraph.pl or speedscope
+"""
+import asyncio
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    # ';' separates frames of a collapsed stack
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+class _SlowCallbacks(logging.Handler):
+    """
+    collects warnings asyncio logs in debug mode about callbacks which blocked the loop
+    """
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.records: list[str] = []
+
+    def emit(self, record):
+        message = record.getMessage()
+        if message.startswith("Executing"):
+            self.records.append(message)
+
+
+class ProfileResult:
+
+    def __init__(self, stacks: Counter, slow_callbacks: list[str], seconds: float, samples: int):
+        self.stacks = stacks
+        self.slow_callbacks = slow_callbacks
+        self.seconds = seconds
+        self.samples = samples
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, max_slow_callbacks=5) -> str:
+        lines = [f"{self.samples} loop samples in {self.seconds:.1f} s, slow callbacks: {len(self.slow_callbacks)}"]
+        lines += self.slow_callbacks[:max_slow_callbacks]
+        return "\n".join(lines)
+
+
+class LoopProfiler:
+    """
+    a thread samples what the loop thread executes, a task samples where the other tasks are suspended,
+    loop debug mode reports callbacks running longer than the threshold; only one profile runs at a time
+    """
+
+    __MAX_SECONDS = 60
+    __LOOP_INTERVAL = 0.005
+    __TASKS_INTERVAL = 0.05
+    __MAX_DEPTH = 64
+
+    def __init__(self):
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    @classmethod
+    def _stack(cls, frame) -> list[str]:
+        stack = []
+        while frame is not None and len(stack) < cls.__MAX_DEPTH:
+            stack.append(_frame_name(frame))
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def _sample_loop(self, thread_id, stacks: Counter, stop: threading.Event):
+        while not stop.is_set():
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stacks[";".join(["[loop]"] + self._stack(frame))] += 1
+            stop.wait(self.__LOOP_INTERVAL)
+
+    async def _sample_tasks(self, stacks: Counter, deadline: float):
+        current = asyncio.current_task()
+        while time.monotonic() < deadline:
+            for task in asyncio.all_tasks():
+                if task is current or task.done():
+                    continue
+                frames = task.get_stack(limit=self.__MAX_DEPTH)
+                coroutine = getattr(task.get_coro(), "__qualname__", "task")
+                stacks[";".join(["[tasks]", coroutine] + [_frame_name(frame) for frame in frames])] += 1
+            await asyncio.sleep(self.__TASKS_INTERVAL)
+
+    async def profile(self, seconds: float, slow_callback_duration: float = 0.1) -> ProfileResult:
+        """
+        :param seconds: duration of the profile, limited to a minute
+        :param slow_callback_duration: callbacks running longer are reported, in seconds
+        """
+        if not 0 < seconds < math.inf:
+            raise ValueError(f"duration of a profile must be a positive number of seconds, got {seconds}")
+        if self._running:
+            raise RuntimeError("profiler is already running")
+        self._running = True
+        seconds = min(seconds, self.__MAX_SECONDS)
+        loop = asyncio.get_running_loop()
+        debug, threshold = loop.get_debug(), loop.slow_callback_duration
+        slow_callbacks = _SlowCallbacks()
+        asyncio_logger = logging.getLogger("asyncio")
+        asyncio_logger.addHandler(slow_callbacks)
+        loop.set_debug(True)
+        loop.slow_callback_duration = slow_callback_duration
+        # each sampler has its own counter, they are merged when both stopped
+        loop_stacks, task_stacks = Counter(), Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample_loop, args=(threading.get_ident(), loop_stacks, stop),
+                                   name="loop-profiler", daemon=True)
+        start = time.monotonic()
+        sampler.start()
+        try:
+            await self._sample_tasks(task_stacks, start + seconds)
+        finally:
+            stop.set()
+            await loop.run_in_executor(None, sampler.join)
+            loop.set_debug(debug)
+            loop.slow_callback_duration = threshold
+            asyncio_logger.removeHandler(slow_callbacks)
+            self._running = False
+        return ProfileResult(loop_stacks + task_stacks, slow_callbacks.records, time.monotonic() - start,
+                             sum(loop_stacks.values()))
+
+
+loop_profiler = LoopProfiler()
@@ -0,0 +1,208 @@
+"""
+in-memory server speaking the redis protocol, implements only the commands used by RedisStateStore,
+lets several bot workers share state locally without a real redis
+
+usage (from the code directory):
+    python redis_stand_in.py [--host localhost] [--port 6379]
+"""
+import argparse
+import asyncio
+import time
+
+
+class RedisStandIn:
+
+    # commands changing their keys, they abort transactions watching the keys
+    __WRITES = {"SET", "DEL", "INCR", "SADD", "SREM", "PEXPIRE"}
+
+    def __init__(self):
+        self._strings: dict[str, str] = {}
+        self._sets: dict[str, set[str]] = {}
+        # key -> number of its changes, compared by EXEC with the number seen by WATCH
+        self._revisions: dict[str, int] = {}
+        # key -> monotonic time when the string expires
+        self._expires: dict[str, float] = {}
+        self._commands = {
+            "PING": self._ping,
+            "SELECT": self._ok,
+            "AUTH": self._ok,
+            "GET": self._get,
+            "SET": self._set,
+            "PEXPIRE": self._pexpire,
+            "DEL": self._del,
+            "INCR": self._incr,
+            "SADD": self._sadd,
+            "SREM": self._srem,
+            "SMEMBERS": self._smembers,
+            "FLUSHDB": self._flushdb,
+        }
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, Exception):
+            return f"-ERR {value}\r\n".encode("utf-8")
+        if isinstance(value, bool):
+            return b"+OK\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(RedisStandIn._encode(item) for item in value)
+        data = value.encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def _ping(self, *args):
+        return args[0] if args else "PONG"
+
+    def _ok(self, *args):
+        return True
+
+    def _expire(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._expires.pop(key)
+            self._strings.pop(key, None)
+
+    def _get(self, key):
+        self._expire(key)
+        return self._strings.get(key)
+
+    def _set(self, key, value, *options):
+        """
+        supports NX and PX options
+        """
+        options = [option.upper() for option in options]
+        self._expire(key)
+        if "NX" in options and (key in self._strings or key in self._sets):
+            return None
+        self._sets.pop(key, None)
+        self._strings[key] = value
+        self._expires.pop(key, None)
+        if "PX" in options:
+            self._expires[key] = time.monotonic() + int(options[options.index("PX") + 1]) / 1000
+        return True
+
+    def _pexpire(self, key, milliseconds):
+        self._expire(key)
+        if key not in self._strings:
+            return 0
+        self._expires[key] = time.monotonic() + int(milliseconds) / 1000
+        return 1
+
+    def _del(self, *keys):
+        for key in keys:
+            self._expires.pop(key, None)
+        return sum(self._strings.pop(key, None) is not None or self._sets.pop(key, None) is not None for key in keys)
+
+    def _incr(self, key):
+        value = int(self._strings.get(key, 0)) + 1
+        self._strings[key] = str(value)
+        return value
+
+    def _sadd(self, key, *members):
+        items = self._sets.setdefault(key, set())
+        before = len(items)
+        items.update(members)
+        return len(items) - before
+
+    def _srem(self, key, *members):
+        items = self._sets.get(key, set())
+        before = len(items)
+        items.difference_update(members)
+        if not items:
+            self._sets.pop(key, None)
+        return before - len(items)
+
+    def _smembers(self, key):
+        return sorted(self._sets.get(key, ()))
+
+    def _flushdb(self):
+        for key in [*self._strings, *self._sets]:
+            self._revisions[key] = self._revisions.get(key, 0) + 1
+        self._strings.clear()
+        self._sets.clear()
+        self._expires.clear()
+        return True
+
+    def execute(self, command: list[str]):
+        name = command[0].upper()
+        handler = self._commands.get(name)
+        if handler is None:
+            return ValueError(f"unknown command '{command[0]}'")
+        if name in self.__WRITES:
+            for key in command[1:] if name == "DEL" else command[1:2]:
+                self._revisions[key] = self._revisions.get(key, 0) + 1
+        try:
+            return handler(*command[1:])
+        except (TypeError, ValueError) as error:
+            return ValueError(str(error))
+
+    def _transact(self, command: list[str], watched: dict[str, int], queued: list | None):
+        """
+        executes transaction commands of a connection, other commands are queued between MULTI and EXEC
+        :return: reply and commands queued now
+        """
+        name = command[0].upper()
+        if name == "WATCH":
+            watched.update({key: self._revisions.get(key, 0) for key in command[1:]})
+            return True, queued
+        if name == "UNWATCH":
+            watched.clear()
+            return True, queued
+        if name == "MULTI":
+            return (ValueError("MULTI calls can not be nested"), queued) if queued is not None else (True, [])
+        if name == "EXEC":
+            if queued is None:
+                return ValueError("EXEC without MULTI"), None
+            changed = any(self._revisions.get(key, 0) != revision for key, revision in watched.items())
+            watched.clear()
+            return None if changed else [self.execute(item) for item in queued], None
+        if queued is not None:
+            queued.append(command)
+            return "QUEUED", queued
+        return self.execute(command), queued
+
+    async def _read_command(self, reader: asyncio.StreamReader) -> list[str] | None:
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # inline command, as sent by telnet
+            return line.decode("utf-8").split()
+        command = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            command.append((await reader.readexactly(length + 2))[:-2].decode("utf-8"))
+        return command
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # keys watched by the connection and commands queued by its MULTI
+        watched, queued = {}, None
+        try:
+            while (command := await self._read_command(reader)) is not None:
+                if command:
+                    reply, queued = self._transact(command, watched, queued)
+                    writer.write(self._encode(reply))
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="localhost", port=6379) -> asyncio.Server:
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    server = await RedisStandIn().serve(args.host, args.port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
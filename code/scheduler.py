@@ -1,5 +1,11 @@
+import asyncio
+import logging
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from metrics import timed_job
+
+logger = logging.getLogger(__name__)
 
 
 class Scheduler:
@@ -14,3 +20,44 @@ class Scheduler:
     def remove_job(self, uri):
         self.scheduler.remove_job(self._jobs[uri].id)
         self._jobs.pop(uri)
+
+
+class DelayedActions:
+    """
+    runs "do it in n seconds" work such as deleting messages on the shared scheduler,
+    so that handlers don't hold their update waiting for it
+    """
+
+    def __init__(self):
+        self._scheduler: AsyncIOScheduler | None = None
+
+    def add_scheduler(self, scheduler: AsyncIOScheduler):
+        self._scheduler = scheduler
+
+    def call_later(self, delay: float, func, *args):
+        """
+        :param func: coroutine function or function called with args after delay seconds
+        """
+        if self._scheduler is not None and self._scheduler.running:
+            self._scheduler.add_job(timed_job(func), "date", args=args, run_date=datetime.now() + timedelta(seconds=delay),
+                                    misfire_grace_time=None)
+        else:
+            loop = asyncio.get_running_loop()
+            if asyncio.iscoroutinefunction(func):
+                loop.call_later(delay, lambda: asyncio.ensure_future(func(*args)))
+            else:
+                loop.call_later(delay, func, *args)
+
+    def delete_message_later(self, bot, chat_id: int, message_id: int, delay: float):
+        self.call_later(delay, _delete_message, bot, chat_id, message_id)
+
+
+async def _delete_message(bot, chat_id, message_id):
+    try:
+        await bot.delete_message(chat_id=chat_id, message_id=message_id)
+    except Exception:
+        # the user may have deleted the message already or blocked the bot
+        logger.debug("can't delete message %s in chat %s", message_id, chat_id)
+
+
+delayed_actions = DelayedActions()
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import os
+import sys
+import socket
+import time
+import uuid
+from collections import deque
+
+import aiohttp
+import asyncspotify
+
+import metrics
+from config_reader import config
+from data_base import DataBase
+from spotify import AsyncSpotify
+from spotify_errors import AuthorizationError, SpotifyErrors
+from state_store import StateStore, create_state_store
+
+logger = logging.getLogger(__name__)
+
+
+def _deep_size(obj, seen=None) -> int:
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(key, seen) + _deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(_deep_size(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += _deep_size(vars(obj), seen)
+    return size
+
+
+class Session:
+    """
+    state of one party: its data base and spotify client
+    """
+
+    def __init__(self, db: DataBase, spotify: AsyncSpotify | None = None):
+        self.db = db
+        self.spotify = spotify
+        self.created_at = time.time()
+        self.handled_updates = 0
+        self.handling_time = 0.0
+
+    @property
+    def token(self):
+        return self.db.token
+
+    def register_update(self, duration: float):
+        self.handled_updates += 1
+        self.handling_time += duration
+
+    def stats(self) -> dict:
+        return {
+            "token": self.token,
+            "users": len(self.db.users),
+            "queue": len(self.db.user_queue),
+            "uptime": time.time() - self.created_at,
+            "handled_updates": self.handled_updates,
+            "handling_time": self.handling_time,
+            "state_size": _deep_size(self.db.users) + _deep_size(self.db.user_queue) +
+                          _deep_size(self.db.last_request),
+        }
+
+
+class SessionRegistry:
+    """
+    routes users to their sessions, users outside of any session share the inactive lobby session,
+    active sessions are kept in the state store and picked up from it by other workers and after restart
+    """
+
+    # lobby users are looked up in the store again after this many seconds, users joining here are seen at once
+    __NO_SESSION_TTL = 1
+    __MAX_NO_SESSION = 10000
+
+    def __init__(self, store: StateStore | None = None):
+        if store is None:
+            store = create_state_store(config.state_store, config.state_store_url, config.data_path.get_secret_value(),
+                                       config.state_flush_interval)
+        self._store = store
+        self._scheduler = None
+        self._lobby = Session(DataBase())
+        self._sessions: dict[str, Session] = {}
+        self._user_sessions: dict[int, Session] = {}
+        # user id -> time until which the user is known to be outside of any session
+        self._no_session: dict[int, float] = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+
+    def add_scheduler(self, scheduler):
+        self._scheduler = scheduler
+        self._lobby.db.add_scheduler(scheduler)
+
+    @property
+    def lobby(self) -> Session:
+        return self._lobby
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __iter__(self):
+        return iter(list(self._sessions.values()))
+
+    def get(self, user_id) -> Session:
+        return self._user_sessions.get(user_id, self._lobby)
+
+    def get_by_token(self, token) -> Session | None:
+        return self._sessions.get(token)
+
+    @property
+    def store(self) -> StateStore:
+        return self._store
+
+    async def resolve(self, user_id) -> Session:
+        """
+        like get, but also notices sessions changed, ended or joined on other workers
+        """
+        session = self._user_sessions.get(user_id)
+        if session is not None and session.token is not None:
+            if not await session.db.sync():
+                await self._forget(session)
+                session = None
+            elif user_id not in session.db.users:
+                self._user_sessions.pop(user_id)
+                session = None
+        if session is None:
+            if self._no_session.get(user_id, 0) > time.monotonic():
+                return self._lobby
+            token = await self._store.call(self._store.user_session, user_id)
+            if token is not None:
+                session = await self.load(token)
+            if session is None or user_id not in session.db.users:
+                self._remember_no_session(user_id)
+                return self._lobby
+            self._user_sessions[user_id] = session
+        return session
+
+    def _remember_no_session(self, user_id):
+        now = time.monotonic()
+        if len(self._no_session) >= self.__MAX_NO_SESSION:
+            self._no_session = {key: until for key, until in self._no_session.items() if until > now}
+        self._no_session[user_id] = now + self.__NO_SESSION_TTL
+
+    async def load(self, token) -> Session | None:
+        """
+        :return: up to date session with the token, taken from the store if it was started by another worker
+        """
+        session = self._sessions.get(token)
+        if session is None:
+            return await self._restore(token)
+        if not await session.db.sync():
+            await self._forget(session)
+            return None
+        return session
+
+    async def _restore(self, token) -> Session | None:
+        item = await self._store.call(self._store.load, token)
+        if item is None:
+            return None
+        db = DataBase(store=self._store)
+        db.add_scheduler(self._scheduler)
+        db.load_state(*item)
+        spotify = AsyncSpotify(self._token_file(db.owner_id))
+        try:
+            await spotify.authorize()
+        except (AuthorizationError, asyncspotify.AuthenticationError):
+            logger.warning(f"can't restore session {token}: no valid spotify token of its owner")
+            await spotify.close()
+            return None
+        except (SpotifyErrors, asyncspotify.HTTPException, aiohttp.ClientError, asyncio.TimeoutError) as error:
+            # there is no active device or spotify is unreachable now, the client is authorized anyway
+            logger.info(f"session {token} is restored without its player: {error!r}")
+        except Exception:
+            logger.exception(f"can't restore session {token}")
+            await spotify.close()
+            return None
+        session = Session(db, spotify)
+        self._sessions[token] = session
+        for user_id in db.users:
+            self._user_sessions.setdefault(user_id, session)
+        return session
+
+    async def restore(self) -> list[Session]:
+        """
+        brings up all sessions saved in the store, used at startup
+        """
+        restored = []
+        for token in await self._store.call(self._store.tokens):
+            session = await self.load(token)
+            if session is not None:
+                restored.append(session)
+        return restored
+
+    async def lead(self, ttl: float) -> bool:
+        """
+        takes or extends the lease of the periodic updates, only one of the workers sharing the store holds it
+        :return: True if this worker runs the periodic updates now
+        """
+        try:
+            self.is_leader = await self._store.call(self._store.acquire_lease, "periodic_updates", self.worker_id,
+                                                    ttl)
+        except Exception:
+            # the updates stop rather than run on several workers
+            logger.exception("can't acquire the lease of the periodic updates")
+            self.is_leader = False
+        return self.is_leader
+
+    async def _forget(self, session: Session):
+        # the session was ended by another worker, its state is gone from the store already
+        self._sessions.pop(session.token, None)
+        session.db.close()
+        session.db.remove_update_functions()
+        for user_id in [user_id for user_id, item in self._user_sessions.items() if item is session]:
+            self._user_sessions.pop(user_id)
+        if session.spotify is not None:
+            await session.spotify.close()
+
+    @staticmethod
+    def _token_file(owner_id) -> str:
+        legacy = config.token_file.get_secret_value()
+        root, ext = os.path.splitext(legacy)
+        path = f"{root}_{owner_id}{ext}"
+        if not os.path.exists(path) and os.path.exists(legacy):
+            # before sessions the only spotify token was kept in the configured file, every admin used it,
+            # so the first owner needing a token takes it over
+            try:
+                os.replace(legacy, path)
+            except FileNotFoundError:
+                # taken over by another worker meanwhile
+                pass
+            else:
+                logger.warning(f"spotify token {legacy} is moved to {path} of session owner {owner_id}")
+        return path
+
+    async def create(self, owner_id, owner_name) -> Session:
+        """
+        creates not yet started session of the admin, replacing the previous not started one
+        """
+        current = self.get(owner_id)
+        if current.db.is_active():
+            if owner_id in current.db.admins:
+                raise ValueError("admin already has an active session")
+            self.leave(owner_id)
+        elif current is not self._lobby and current.spotify is not None:
+            await current.spotify.close()
+        db = DataBase(owner_id, owner_name, self._store)
+        db.add_scheduler(self._scheduler)
+        if owner_id in current.db.last_message:
+            db.update_last_message(owner_id, current.db.last_message.pop(owner_id))
+        session = Session(db, AsyncSpotify(self._token_file(owner_id)))
+        self._user_sessions[owner_id] = session
+        self._no_session.pop(owner_id, None)
+        return session
+
+    def activate(self, session: Session):
+        session.db.set_token()
+        self._sessions[session.token] = session
+        for user_id in session.db.users:
+            self._store.submit(self._store.set_user_session, user_id, session.token)
+
+    def join(self, user_id, user_name, session: Session):
+        if self.get(user_id) is not session:
+            self.leave(user_id)
+        session.db.add_user(user_id, user_name)
+        self._user_sessions[user_id] = session
+        self._no_session.pop(user_id, None)
+        if session.token is not None:
+            self._store.submit(self._store.set_user_session, user_id, session.token)
+
+    def leave(self, user_id):
+        session = self._user_sessions.pop(user_id, None)
+        if session is not None and user_id in session.db.users:
+            session.db.del_user(user_id)
+        if session is not None and session.token is not None:
+            self._store.submit(self._store.set_user_session, user_id, None)
+
+    async def end(self, session: Session):
+        self._sessions.pop(session.token, None)
+        # changes still waiting to be saved must not bring the session back
+        session.db.close()
+        if session.token is not None:
+            self._store.submit(self._store.delete, session.token)
+        session.db.remove_update_functions()
+        for user_id, message in session.db.last_message.items():
+            self._lobby.db.update_last_message(user_id, message)
+        for user_id in [user_id for user_id, item in self._user_sessions.items() if item is session]:
+            self._user_sessions.pop(user_id)
+        if session.spotify is not None:
+            await session.spotify.close()
+
+    def stats(self) -> list[dict]:
+        return [session.stats() for session in self]
+
+    async def close(self):
+        """
+        saves changes of the sessions still waiting and closes the store, used at shutdown
+        """
+        for session in self:
+            try:
+                await session.db.save()
+            except Exception:
+                logger.exception(f"can't save session {session.token}")
+        self._store.close()
+
+
+sessions = SessionRegistry()
+
+metrics.registry.gauge("bot_active_sessions", "started sessions served by this worker", function=lambda: len(sessions))
+metrics.registry.gauge("bot_session_users", "users in sessions served by this worker",
+                       function=lambda: sum(len(session.db.users) for session in sessions))
@@ -1,18 +1,22 @@
 import asyncio
-import time
 
 from asyncspotify.client import get_id
 from asyncspotify.oauth.response import AuthenticationResponse
 from config_reader import config
 import asyncspotify
-import asyncspotify.http
 import spotify_errors
 import lyrics
+from lyrics_cache import lyrics_cache
+from cache import TTLCache
+from player_watcher import PlayerWatcher, PlayerEvent
+from lyrics_prefetch import LyricsPrefetcher
+from spotify_http import PooledHTTP
+import metrics
 
 
-
+@metrics.instrumented(metrics.spotify_call_seconds, metrics.spotify_call_errors)
 class AsyncSpotify:
-    class ModifiedHTTP(asyncspotify.http.HTTP):
+    class ModifiedHTTP(PooledHTTP):
         async def player_add_to_queue(self, uri: str, device_id):
             r = asyncspotify.Route('POST', f'me/player/queue?uri={uri}', device=device_id)
             await self.request(r)
@@ -109,18 +113,20 @@ class AsyncSpotify:
     _album_prefix = 'spotify:album:'
     _playlist_prefix = 'spotify:playlist:'
     _artist_prefix = 'spotify:artist:'
-    _update_timeout = 5
     _volume_step = 5
+    # search results don't depend on the session, so identical queries of all users share one cache
+    _search_cache = TTLCache(config.search_cache_ttl, config.search_cache_size)
 
-    def __init__(self):
+    def __init__(self, token_file: str = None):
         self._client_id = config.spotify_client_id.get_secret_value()
         self._client_secret = config.spotify_client_secret.get_secret_value()
         self._spotify_username = config.spotify_username.get_secret_value()
         self._redirect_uri = config.spotify_redirect_uri.get_secret_value()
         self._scope = asyncspotify.Scope(user_modify_playback_state=True, user_read_playback_state=True)
-        self._token_file = config.token_file.get_secret_value()
+        self._token_file = token_file or config.token_file.get_secret_value()
         self._lyrics_finder = lyrics.LyricsFinder()
-        self._last_song_lyrics: lyrics.Lyrics = None
+        self._lyrics_prefetcher = LyricsPrefetcher(self._lyrics_finder.find, config.lyrics_prefetch_depth)
+        self._prefetch_task: asyncio.Task | None = None
 
         self._auth = AsyncSpotify.ModifiedEasyAuthorizationCodeFlow(
             client_id=self._client_id,
@@ -134,8 +140,9 @@ class AsyncSpotify:
         self._volume = 50
         self._saved_volume = self._volume
         self._playing: bool = False
-        self._cached_currently_playing: asyncspotify.CurrentlyPlaying = None
-        self._last_update_time = 0
+        self._player_cache = TTLCache(config.player_cache_ttl)
+        self._watcher = PlayerWatcher(self)
+        self._watcher.subscribe(self._on_player_event)
         self._authorized = False
 
     async def create_authorize_route(self) -> str:
@@ -151,13 +158,15 @@ class AsyncSpotify:
             self._volume = device.volume_percent
             self._saved_volume = self._volume
             self._authorized = True
+            self._watcher.start()
+            self.prefetch_lyrics()
         except asyncspotify.exceptions.NotFound:
             raise spotify_errors.ConnectionError("there is no active device")
 
 
     async def is_active(self):
         try:
-            await self._session.player_currently_playing()
+            await self._get_currently_playing()
             return True
         except:
             return False
@@ -177,21 +186,56 @@ class AsyncSpotify:
         else:
             raise ValueError("wrong url")
         await self._session.start_playlist(uri)
+        self.invalidate_player_state()
 
     async def close(self):
+        await self._watcher.stop()
+        if self._prefetch_task is not None:
+            self._prefetch_task.cancel()
+        self._lyrics_prefetcher.cancel()
         await self._session.close()
+        await self._session.http.close()
         self._authorized = False
 
-    async def force_update(self):
+    async def _get_currently_playing(self) -> asyncspotify.CurrentlyPlaying:
+        return await self._player_cache.get(None, self._session.player_currently_playing)
+
+    def invalidate_player_state(self):
+        self._player_cache.invalidate()
+        self._watcher.kick()
+
+    async def refresh_player_state(self) -> asyncspotify.CurrentlyPlaying:
+        """
+        fetches the player state bypassing the cache and stores it there for the menus rendered meanwhile
+        """
         try:
-            self._cached_currently_playing = await self._session.player_currently_playing()
+            currently_playing = await self._session.player_currently_playing()
+        except spotify_errors.RateLimited:
+            raise
         except:
             raise spotify_errors.ConnectionError
+        self._player_cache.set(None, currently_playing)
+        return currently_playing
+
+    @property
+    def watcher(self) -> PlayerWatcher:
+        return self._watcher
+
+    @property
+    def player_cache_stats(self):
+        return self._player_cache.stats
+
+    async def force_update(self):
+        self.invalidate_player_state()
+        await self.update()
 
     async def update(self):
-        now = time.time()
-        if (now - self._last_update_time) >= self._update_timeout:
-            await self.force_update()
+        try:
+            await self._get_currently_playing()
+        except spotify_errors.RateLimited:
+            raise
+        except:
+            raise spotify_errors.ConnectionError
 
     @staticmethod
     async def __get_info(item) -> list[list[str]]:
@@ -212,34 +256,57 @@ class AsyncSpotify:
 
     async def get_curr_track(self):
         try:
-            await self.update()
-            currently_playing = self._cached_currently_playing
+            currently_playing = await self._get_currently_playing()
             curr_track = currently_playing.track
             artists = [artist.name for artist in curr_track.artists]
             name = curr_track.name
             return [artists, name]
+        except spotify_errors.RateLimited:
+            raise
         except:
             raise spotify_errors.ConnectionError
 
+    @staticmethod
+    def _lyrics_query(artists: list[str], name: str) -> tuple[str, str]:
+        name = name[:name.find('(')] if '(' in name else name
+        return artists[0], name.strip()
+
     async def get_lyrics(self, func_waiter=None, **func_waiter_kwargs):
         artists, name = await self.get_curr_track()
-        main_author = artists[0]
-        name = name[:name.find('(')] if '(' in name else name
-        name = name.strip()
-        if self._last_song_lyrics:
-            cached_artist, cached_song = self._last_song_lyrics.artist.lower(), self._last_song_lyrics.name.lower()
-            if main_author.lower() == cached_artist and cached_song == name.lower():
-                return self._last_song_lyrics
-            else:
-                if func_waiter is not None:
-                    await func_waiter(**func_waiter_kwargs)
-                self._last_song_lyrics = await self._lyrics_finder.find(main_author, name)
-                return self._last_song_lyrics
-        else:
+        main_author, name = self._lyrics_query(artists, name)
+
+        async def on_miss():
             if func_waiter is not None:
                 await func_waiter(**func_waiter_kwargs)
-            self._last_song_lyrics = await self._lyrics_finder.find(main_author, name)
-            return self._last_song_lyrics
+
+        return await lyrics_cache.get(main_author, name, self._lyrics_finder.find, on_miss=on_miss)
+
+    def _on_player_event(self, events: list[PlayerEvent]):
+        if PlayerEvent.TRACK_CHANGED in events:
+            self.prefetch_lyrics()
+
+    def prefetch_lyrics(self):
+        """
+        starts warming lyrics cache for the current and upcoming tracks in background
+        """
+        if self._prefetch_task is None or self._prefetch_task.done():
+            self._prefetch_task = asyncio.create_task(self._prefetch_lyrics())
+
+    async def _prefetch_lyrics(self):
+        try:
+            await self.get_curr_user_queue()
+        except spotify_errors.SpotifyErrors:
+            pass
+
+    def _update_lyrics_prefetch(self, queue: list[asyncspotify.SimpleTrack]):
+        tracks = []
+        currently_playing = self._player_cache.peek()
+        if currently_playing is not None and currently_playing.track is not None:
+            track = currently_playing.track
+            tracks.append(self._lyrics_query([artist.name for artist in track.artists], track.name))
+        for track in queue:
+            tracks.append(self._lyrics_query([artist.name for artist in track.artists], track.name))
+        self._lyrics_prefetcher.update(tracks)
 
     async def add_track_to_queue(self, uri):
         try:
@@ -248,17 +315,23 @@ class AsyncSpotify:
             await self._session.player_add_to_queue(uri)
         except asyncspotify.Forbidden:
             raise spotify_errors.PremiumRequired
+        except spotify_errors.RateLimited:
+            raise
         except:
             raise spotify_errors.ConnectionError
+        self.prefetch_lyrics()
 
     async def get_curr_user_queue(self) -> list[asyncspotify.SimpleTrack]:
         try:
             queue = await self._session.get_curr_user_queue()
-            return queue
         except asyncspotify.Forbidden:
             raise spotify_errors.PremiumRequired
+        except spotify_errors.RateLimited:
+            raise
         except:
             raise spotify_errors.ConnectionError
+        self._update_lyrics_prefetch(queue)
+        return queue
 
     async def get_formatted_curr_user_queue(self) -> list[str]:
         queue = await self.get_curr_user_queue()
@@ -271,9 +344,11 @@ class AsyncSpotify:
         try:
             await self._session.player_next()
             self._playing = True
-            await self.force_update()
+            self.invalidate_player_state()
         except asyncspotify.Forbidden:
             raise spotify_errors.PremiumRequired
+        except spotify_errors.RateLimited:
+            raise
         except:
             raise spotify_errors.ConnectionError
 
@@ -281,23 +356,28 @@ class AsyncSpotify:
         try:
             await self._session.player_prev()
             self._playing = True
-            await self.force_update()
+            self.invalidate_player_state()
         except asyncspotify.Forbidden:
             raise spotify_errors.PremiumRequired
+        except spotify_errors.RateLimited:
+            raise
         except:
             raise spotify_errors.ConnectionError
 
     async def start_pause(self):
         try:
-            currently_playing = await self._session.player_currently_playing()
+            currently_playing = await self._get_currently_playing()
             if currently_playing.is_playing:
                 self._playing = False
                 await self._session.player_pause()
             else:
                 self._playing = True
                 await self._session.player_play()
+            self.invalidate_player_state()
         except asyncspotify.Forbidden:
             raise spotify_errors.PremiumRequired
+        except spotify_errors.RateLimited:
+            raise
         except:
             raise spotify_errors.ConnectionError
 
@@ -308,6 +388,7 @@ class AsyncSpotify:
             pass
         else:
             self._volume = min(100, self._volume + self._volume_step)
+            self.invalidate_player_state()
 
     async def decrease_volume(self):
         try:
@@ -316,6 +397,7 @@ class AsyncSpotify:
             pass
         else:
             self._volume = max(0, self._volume - self._volume_step)
+            self.invalidate_player_state()
 
     async def get_devices(self) -> list[asyncspotify.Device]:
         devices = await self._session.get_devices()
@@ -326,6 +408,7 @@ class AsyncSpotify:
             await self._session.transfer_playback(device)
             await asyncio.sleep(1)
             await self._session.player_volume(self._volume)
+            self.invalidate_player_state()
         except:
             raise ConnectionError
 
@@ -338,6 +421,7 @@ class AsyncSpotify:
                 self._saved_volume = self._volume
                 self._volume = 0
             await self._session.player_volume(self._volume)
+            self.invalidate_player_state()
         except asyncspotify.Forbidden:
             self._volume, self._saved_volume = old_values
             raise spotify_errors.Forbidden
@@ -350,12 +434,41 @@ class AsyncSpotify:
     def is_playing(self):
         return self._playing
 
+    @staticmethod
+    def normalize_query(request: str) -> str:
+        return ' '.join(request.casefold().split())
+
+    @property
+    def search_cache_stats(self):
+        return AsyncSpotify._search_cache.stats
+
+    async def _search(self, query: str) -> list[list[str]]:
+        return await self.__get_info(await self._session.search("track", q=query, limit=10))
+
     async def search(self, request: str) -> list[list[str]]:
         """
         :param request: запрос
         :return: список с id, автором, названием
         """
+        query = self.normalize_query(request)
+        loaded = False
+
+        async def load():
+            nonlocal loaded
+            loaded = True
+            return await self._search(query)
+
         try:
-            return await self.__get_info(await self._session.search("track", q=request, limit=10))
+            try:
+                return await AsyncSpotify._search_cache.get(query, load)
+            except Exception:
+                if loaded:
+                    raise
+                # the shared search was made by another session, whose token may be expired or rate limited
+                result = await self._search(query)
+                AsyncSpotify._search_cache.set(query, result)
+                return result
+        except spotify_errors.RateLimited:
+            raise
         except:
             raise spotify_errors.ConnectionError
@@ -18,4 +18,21 @@ class AuthorizationError(SpotifyErrors):
     pass
 
 class Forbidden(SpotifyErrors):
+    pass
+
+
+class RateLimited(SpotifyErrors):
+    """
+    spotify asked to wait longer than the retry budget of the request allows
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"rate limited for {retry_after} s")
+        self.retry_after = retry_after
+
+
+class ServiceUnavailable(ConnectionError):
+    """
+    spotify kept answering with server errors
+    """
     pass
\ No newline at end of file
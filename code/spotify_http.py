@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from json import JSONDecodeError, loads
+
+import aiohttp
+import asyncspotify
+import asyncspotify.http
+
+import metrics
+import spotify_errors
+from config_reader import config
+
+logger = logging.getLogger(__name__)
+
+
+class RetryBudget:
+    """
+    limits retries of one request by attempts and by the total time spent waiting between them
+    """
+
+    def __init__(self, attempts: int, seconds: float):
+        self.attempts_left = attempts
+        self._deadline = time.monotonic() + seconds
+
+    @property
+    def seconds_left(self) -> float:
+        return max(0.0, self._deadline - time.monotonic())
+
+    def spend(self, delay: float) -> bool:
+        """
+        :return: False if there is no attempt or time left for a retry after delay seconds
+        """
+        self.attempts_left -= 1
+        return self.attempts_left > 0 and delay <= self.seconds_left
+
+
+class PooledHTTP(asyncspotify.http.HTTP):
+    """
+    asyncspotify transport over a keep-alive connection pool: requests run concurrently instead of one by one,
+    429 and 5xx responses are retried with jittered backoff within a per-request budget, Retry-After is honored,
+    rate limits and outages are raised as distinct errors
+    """
+
+    __BACKOFF_BASE = 0.25
+    __BACKOFF_MAX = 4
+    # spotify may have applied a failed request anyway, only requests safe to repeat are retried then
+    __IDEMPOTENT_METHODS = ("GET", "PUT", "DELETE")
+    __ACCOUNTS_URL = "https://accounts.spotify.com"
+
+    def __init__(self, client, loop=None):
+        self.client = client
+        connector = aiohttp.TCPConnector(limit=config.spotify_pool_size, keepalive_timeout=config.spotify_keepalive,
+                                         ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=config.spotify_request_timeout))
+        self.retries = 0
+        self.rate_limited = 0
+        # requests go to a stand-in of the spotify api instead if it is configured
+        base = config.spotify_api_url.rstrip("/")
+        self._rewrites = ((asyncspotify.Route.BASE, f"{base}/v1"), (self.__ACCOUNTS_URL, f"{base}/accounts")) \
+            if base else ()
+
+    def _url(self, url: str) -> str:
+        for prefix, replacement in self._rewrites:
+            if url.startswith(prefix):
+                return replacement + url[len(prefix):]
+        return url
+
+    def _backoff(self, attempt: int) -> float:
+        # full jitter, so that requests failed together don't retry together
+        return random.uniform(0, min(self.__BACKOFF_MAX, self.__BACKOFF_BASE * 2 ** attempt))
+
+    @staticmethod
+    def _retry_after(value: str | None) -> float | None:
+        """
+        :param value: Retry-After header, either seconds or an http date
+        :return: seconds to wait or None if the header is missing or invalid
+        """
+        if value is None:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                date = parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+            if date.tzinfo is None:
+                date = date.replace(tzinfo=timezone.utc)
+            seconds = (date - datetime.now(timezone.utc)).total_seconds()
+        return max(0.0, seconds) if seconds == seconds else None
+
+    async def request(self, route, data=None, json=None, headers=None, authorize=True):
+        headers = dict(headers or {})
+        if authorize:
+            auth_header = self.client.auth.header
+            if auth_header is None:
+                raise asyncspotify.AuthenticationError('Authorize before attempting an authorized request.')
+            headers.update(auth_header)
+        kw = dict(method=route.method, url=self._url(route.url), headers=headers)
+        if route.params:
+            kw['params'] = route.params
+        if data:
+            kw['data'] = data
+        if json:
+            kw['json'] = json
+            headers['Content-Type'] = 'application/json'
+
+        budget = RetryBudget(config.spotify_max_attempts, config.spotify_retry_budget)
+        attempt = 0
+        while True:
+            try:
+                async with self.session.request(**kw) as response:
+                    status, text = response.status, await response.text()
+                    if 200 <= status < 300:
+                        try:
+                            return loads(text)
+                        except JSONDecodeError:
+                            return None
+                    if status == 429:
+                        retry_after = self._retry_after(response.headers.get('Retry-After'))
+                        if retry_after is None:
+                            retry_after = self._backoff(attempt)
+                        self.rate_limited += 1
+                        metrics.spotify_rate_limited.inc()
+                        if not budget.spend(retry_after):
+                            raise spotify_errors.RateLimited(retry_after)
+                        logger.info("spotify rate limit on %r, retrying in %s s", route, retry_after)
+                        delay = retry_after
+                    elif status >= 500:
+                        delay = self._backoff(attempt)
+                        if route.method not in self.__IDEMPOTENT_METHODS or not budget.spend(delay):
+                            raise spotify_errors.ServiceUnavailable(f"spotify answered {status}")
+                    else:
+                        self._raise_for_status(response, text)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as error:
+                delay = self._backoff(attempt)
+                if route.method not in self.__IDEMPOTENT_METHODS or not budget.spend(delay):
+                    raise spotify_errors.ConnectionError(str(error)) from error
+            attempt += 1
+            self.retries += 1
+            metrics.spotify_retries.inc()
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _raise_for_status(response, text):
+        try:
+            error = loads(text)['error']['message']
+        except (JSONDecodeError, TypeError, KeyError):
+            error = None
+        status = response.status
+        if status == 400:
+            raise asyncspotify.BadRequest(response, error)
+        elif status == 401:
+            raise asyncspotify.Unauthorized(response, error)
+        elif status == 403:
+            raise asyncspotify.Forbidden(response, error)
+        elif status == 404:
+            raise asyncspotify.NotFound(response, error)
+        elif status == 405:
+            raise asyncspotify.NotAllowed(response, error)
+        raise asyncspotify.HTTPException(response, 'Unhandled HTTP status code: %s' % status)
@@ -0,0 +1,267 @@
+"""
+local stand-in for the spotify web api, implements the player, queue, search, devices and token endpoints
+used by AsyncSpotify, with configurable latency, injected server errors and 429 rate limiting,
+point the bot at it with spotify_api_url=http://host:port
+
+usage (from the code directory):
+    python spotify_stand_in.py [--port 8888] [--latency 50] [--jitter 20] [--error-rate 0.01] [--rate 50]
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+from collections import Counter, deque
+
+from aiohttp import web
+
+from token_bucket import TokenBucket
+
+
+class SpotifyStandIn:
+    __QUEUE_LENGTH = 20
+    __TOKEN_TTL = 3600
+
+    def __init__(self, tracks=500, latency=0.0, jitter=0.0, error_rate=0.0, rate=None, burst=None, seed=0):
+        """
+        :param latency: mean delay of every response in seconds
+        :param jitter: the delay is uniformly spread by this many seconds around the mean
+        :param error_rate: share of api requests answered with 500
+        :param rate: requests per second allowed before answering 429, unlimited if None
+        """
+        self._rnd = random.Random(seed)
+        self._latency = latency
+        self._jitter = jitter
+        self._error_rate = error_rate
+        self._limit = None if rate is None else TokenBucket(rate, burst or rate)
+        self._catalog = [self._make_track(index) for index in range(tracks)]
+        self._by_id = {track["id"]: index for index, track in enumerate(self._catalog)}
+        self._devices = [{"id": f"device{i}", "name": name, "type": "Computer", "is_active": i == 0,
+                          "is_private_session": False, "is_restricted": False, "volume_percent": 50}
+                         for i, name in enumerate(["stand-in speaker", "stand-in phone"])]
+        self._tokens: set[str] = set()
+        # player state, the context is the whole catalog played in order
+        self._current = 0
+        self._history: list[int] = []
+        self._queue: deque[int] = deque()
+        self._playing = True
+        self._started = time.monotonic()
+        self._progress = 0.0
+        self.requests = Counter()
+        self.status_codes = Counter()
+
+    def _make_track(self, index) -> dict:
+        track_id = f"{index:022d}"
+        artist = {"id": f"artist{index % 97}", "name": f"Artist {index % 97}", "uri": f"spotify:artist:{index % 97}",
+                  "href": None, "type": "artist", "external_urls": {}}
+        return {
+            "id": track_id, "name": f"Track {index} ({'Remix' if index % 5 == 0 else 'Live'})",
+            "uri": f"spotify:track:{track_id}", "href": None, "type": "track", "artists": [artist],
+            "album": {"id": f"album{index // 10}", "name": f"Album {index // 10}", "uri": None, "href": None,
+                      "album_type": "album", "release_date_precision": "year", "release_date": "2020",
+                      "images": [], "external_urls": {}, "artists": [artist]},
+            "disc_number": 1, "explicit": False, "preview_url": None, "track_number": index % 10 + 1,
+            "is_local": False, "duration_ms": 120000 + self._rnd.randrange(120000), "external_urls": {},
+            "external_ids": {}, "popularity": self._rnd.randrange(100),
+        }
+
+    # player
+
+    def _position(self) -> float:
+        if self._playing:
+            return self._progress + time.monotonic() - self._started
+        return self._progress
+
+    def _advance(self):
+        # tracks which ended since the last request are played through
+        while self._playing and self._position() * 1000 >= self._catalog[self._current]["duration_ms"]:
+            elapsed = self._position() - self._catalog[self._current]["duration_ms"] / 1000
+            self._skip()
+            self._progress, self._started = elapsed, time.monotonic()
+
+    def _skip(self):
+        self._history.append(self._current)
+        self._current = self._queue.popleft() if self._queue else (self._current + 1) % len(self._catalog)
+        self._progress, self._started = 0.0, time.monotonic()
+
+    def _upcoming(self) -> list[int]:
+        upcoming = list(self._queue)[:self.__QUEUE_LENGTH]
+        index = self._current
+        while len(upcoming) < self.__QUEUE_LENGTH:
+            index = (index + 1) % len(self._catalog)
+            upcoming.append(index)
+        return upcoming
+
+    def _active_device(self) -> dict:
+        return next(device for device in self._devices if device["is_active"])
+
+    def _currently_playing(self) -> dict:
+        self._advance()
+        return {"timestamp": int(time.time() * 1000), "progress_ms": int(self._position() * 1000),
+                "is_playing": self._playing, "item": self._catalog[self._current],
+                "currently_playing_type": "track", "context": None}
+
+    # handlers
+
+    async def player(self, request):
+        return web.json_response({**self._currently_playing(), "device": self._active_device(),
+                                  "repeat_state": "off", "shuffle_state": False})
+
+    async def currently_playing(self, request):
+        return web.json_response(self._currently_playing())
+
+    async def queue(self, request):
+        self._advance()
+        return web.json_response({"currently_playing": self._catalog[self._current],
+                                  "queue": [self._catalog[index] for index in self._upcoming()]})
+
+    async def add_to_queue(self, request):
+        index = self._by_id.get(request.query.get("uri", "").split(":")[-1])
+        if index is None:
+            return self._error(400, "Invalid track uri")
+        self._queue.append(index)
+        return web.Response(status=204)
+
+    async def next(self, request):
+        self._advance()
+        self._skip()
+        self._playing = True
+        return web.Response(status=204)
+
+    async def previous(self, request):
+        self._advance()
+        if self._history:
+            self._queue.appendleft(self._current)
+            self._current = self._history.pop()
+        self._progress, self._started, self._playing = 0.0, time.monotonic(), True
+        return web.Response(status=204)
+
+    async def play(self, request):
+        if not self._playing:
+            self._started, self._playing = time.monotonic(), True
+        return web.Response(status=204)
+
+    async def pause(self, request):
+        if self._playing:
+            self._progress, self._playing = self._position(), False
+        return web.Response(status=204)
+
+    async def volume(self, request):
+        try:
+            volume = int(request.query["volume_percent"])
+        except (KeyError, ValueError):
+            return self._error(400, "Invalid volume")
+        self._active_device()["volume_percent"] = max(0, min(100, volume))
+        return web.Response(status=204)
+
+    async def transfer(self, request):
+        device_ids = (await request.json()).get("device_ids", [])
+        if not device_ids or device_ids[0] not in {device["id"] for device in self._devices}:
+            return self._error(404, "Device not found")
+        for device in self._devices:
+            device["is_active"] = device["id"] == device_ids[0]
+        return web.Response(status=204)
+
+    async def devices(self, request):
+        return web.json_response({"devices": self._devices})
+
+    async def search(self, request):
+        query = request.query.get("q", "").casefold()
+        limit = int(request.query.get("limit", 20))
+        items = [track for track in self._catalog
+                 if query in track["name"].casefold() or query in track["artists"][0]["name"].casefold()][:limit]
+        return web.json_response({"tracks": {"items": items, "total": len(items), "limit": limit, "offset": 0,
+                                             "next": None, "previous": None, "href": None}})
+
+    async def token(self, request):
+        form = await request.post()
+        if form.get("grant_type") not in ("authorization_code", "refresh_token"):
+            return web.json_response({"error": "unsupported_grant_type"}, status=400)
+        access_token = f"stand-in-{self._rnd.getrandbits(64):016x}"
+        self._tokens.add(access_token)
+        return web.json_response({"access_token": access_token, "token_type": "Bearer",
+                                  "expires_in": self.__TOKEN_TTL, "scope": form.get("scope", ""),
+                                  "refresh_token": "stand-in-refresh"})
+
+    # behavior shared by all api requests
+
+    @staticmethod
+    def _error(status, message):
+        return web.json_response({"error": {"status": status, "message": message}}, status=status)
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        resource = request.match_info.route.resource
+        self.requests[f"{request.method} {request.path if resource is None else resource.canonical}"] += 1
+        response = await self._respond(request, handler)
+        self.status_codes[response.status] += 1
+        return response
+
+    async def _respond(self, request, handler):
+        if self._latency or self._jitter:
+            await asyncio.sleep(max(0.0, self._latency + self._rnd.uniform(-self._jitter, self._jitter)))
+        if request.path.startswith("/accounts") or request.path == "/stats":
+            return await handler(request)
+        if request.headers.get("Authorization", "").split(" ")[-1] not in self._tokens:
+            return self._error(401, "Invalid access token")
+        if self._limit is not None:
+            wait = self._limit.take()
+            if wait:
+                # spotify sends whole seconds
+                return web.Response(status=429, headers={"Retry-After": str(math.ceil(wait))})
+        if self._rnd.random() < self._error_rate:
+            return self._error(500, "Injected server error")
+        return await handler(request)
+
+    async def stats(self, request):
+        return web.json_response({"requests": dict(self.requests), "status_codes": dict(self.status_codes)})
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.add_routes([
+            web.get("/v1/me/player", self.player),
+            web.put("/v1/me/player", self.transfer),
+            web.get("/v1/me/player/currently-playing", self.currently_playing),
+            web.get("/v1/me/player/queue", self.queue),
+            web.post("/v1/me/player/queue", self.add_to_queue),
+            web.post("/v1/me/player/next", self.next),
+            web.post("/v1/me/player/previous", self.previous),
+            web.put("/v1/me/player/play", self.play),
+            web.put("/v1/me/player/pause", self.pause),
+            web.put("/v1/me/player/volume", self.volume),
+            web.get("/v1/me/player/devices", self.devices),
+            web.get("/v1/search", self.search),
+            web.post("/accounts/api/token", self.token),
+            web.get("/stats", self.stats),
+        ])
+        return app
+
+    async def serve(self, host="localhost", port=8888) -> web.AppRunner:
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--tracks", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0, help="mean response delay, ms")
+    parser.add_argument("--jitter", type=float, default=0, help="spread of the delay, ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of requests answered with 500")
+    parser.add_argument("--rate", type=float, default=None, help="requests per second before answering 429")
+    parser.add_argument("--burst", type=float, default=None)
+    args = parser.parse_args()
+    stand_in = SpotifyStandIn(args.tracks, args.latency / 1000, args.jitter / 1000, args.error_rate, args.rate,
+                              args.burst)
+    runner = await stand_in.serve(args.host, args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
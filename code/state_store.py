@@ -0,0 +1,556 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+class StateConflict(Exception):
+    """
+    the state was changed or deleted by another worker since the version the save is based on
+    """
+
+
+class StateStore(ABC):
+    """
+    storage of session states shared between bot workers,
+    every save of a session bumps its version so that workers can notice foreign changes
+    and a save based on an outdated version is refused instead of overwriting them
+    """
+
+    # stores doing disk or network i/o are called from one background thread through call() and submit(),
+    # so that they don't block the event loop and their calls are executed in order
+    blocking = False
+    _executor: ThreadPoolExecutor | None = None
+
+    def _thread(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-store")
+        return self._executor
+
+    async def call(self, method, *args):
+        """
+        :param method: method of this store, called with args without blocking the event loop
+        """
+        if not self.blocking:
+            return method(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._thread(), method, *args)
+
+    def submit(self, method, *args):
+        """
+        like call(), but doesn't wait for the method, which is called right away if there is no event loop
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or not self.blocking:
+            method(*args)
+            return
+        # queued right now, so that calls made after this one are executed after it
+        loop.run_in_executor(self._thread(), method, *args).add_done_callback(self._submitted_done)
+
+    @staticmethod
+    def _submitted_done(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("state store call failed", exc_info=future.exception())
+
+    @abstractmethod
+    def load(self, token: str) -> tuple[dict, int] | None:
+        """
+        :return: state and its version or None if there is no such session
+        """
+
+    @abstractmethod
+    def save(self, token: str, state: dict, expected_version: int | None) -> int:
+        """
+        :param expected_version: version the state is based on, None for a new session
+        :return: new version of the state
+        :raises StateConflict: stored version is not the expected one
+        """
+
+    @abstractmethod
+    def version(self, token: str) -> int | None:
+        pass
+
+    @abstractmethod
+    def delete(self, token: str):
+        pass
+
+    @abstractmethod
+    def tokens(self) -> list[str]:
+        pass
+
+    @abstractmethod
+    def user_session(self, user_id: int) -> str | None:
+        pass
+
+    @abstractmethod
+    def set_user_session(self, user_id: int, token: str | None):
+        pass
+
+    @abstractmethod
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        takes the named lease for ttl seconds if it is free or expired, extends it if the owner holds it already
+        :return: True if the owner holds the lease now
+        """
+
+    def close(self):
+        """
+        waits for submitted calls and releases resources of the store
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class MemoryStateStore(StateStore):
+
+    def __init__(self):
+        self._states: dict[str, tuple[str, int]] = {}
+        self._users: dict[int, str] = {}
+        self._leases: dict[str, tuple[str, float]] = {}
+
+    def load(self, token):
+        item = self._states.get(token)
+        return None if item is None else (json.loads(item[0]), item[1])
+
+    def save(self, token, state, expected_version):
+        current = self.version(token)
+        if current != expected_version:
+            raise StateConflict(token)
+        version = (current or 0) + 1
+        # stored serialized, so that callers can't change stored state by mutating their objects
+        self._states[token] = (json.dumps(state, ensure_ascii=False), version)
+        return version
+
+    def version(self, token):
+        item = self._states.get(token)
+        return None if item is None else item[1]
+
+    def delete(self, token):
+        self._states.pop(token, None)
+        self._users = {user_id: value for user_id, value in self._users.items() if value != token}
+
+    def tokens(self):
+        return list(self._states)
+
+    def user_session(self, user_id):
+        return self._users.get(user_id)
+
+    def set_user_session(self, user_id, token):
+        if token is None:
+            self._users.pop(user_id, None)
+        else:
+            self._users[user_id] = token
+
+    def acquire_lease(self, name, owner, ttl):
+        now = time.monotonic()
+        holder = self._leases.get(name)
+        if holder is not None and holder[0] != owner and holder[1] > now:
+            return False
+        self._leases[name] = (owner, now + ttl)
+        return True
+
+
+class SQLiteStateStore(StateStore):
+    blocking = True
+
+    def __init__(self, file_name: str):
+        self._connection = sqlite3.connect(file_name, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS sessions "
+                                 "(token TEXT PRIMARY KEY, state TEXT NOT NULL, version INTEGER NOT NULL)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, token TEXT NOT NULL)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS leases "
+                                 "(name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)")
+        self._lock = threading.Lock()
+
+    def _execute(self, query, args=()):
+        with self._lock:
+            return self._connection.execute(query, args).fetchall()
+
+    def load(self, token):
+        rows = self._execute("SELECT state, version FROM sessions WHERE token = ?", (token,))
+        return None if not rows else (json.loads(rows[0][0]), rows[0][1])
+
+    def save(self, token, state, expected_version):
+        data = json.dumps(state, ensure_ascii=False)
+        if expected_version is None:
+            try:
+                rows = self._execute("INSERT INTO sessions VALUES (?, ?, 1) RETURNING version", (token, data))
+            except sqlite3.IntegrityError:
+                raise StateConflict(token)
+        else:
+            rows = self._execute("UPDATE sessions SET state = ?, version = version + 1 "
+                                 "WHERE token = ? AND version = ? RETURNING version", (data, token, expected_version))
+        if not rows:
+            raise StateConflict(token)
+        return rows[0][0]
+
+    def version(self, token):
+        rows = self._execute("SELECT version FROM sessions WHERE token = ?", (token,))
+        return None if not rows else rows[0][0]
+
+    def delete(self, token):
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.execute("DELETE FROM sessions WHERE token = ?", (token,))
+            self._connection.execute("DELETE FROM users WHERE token = ?", (token,))
+            self._connection.execute("COMMIT")
+
+    def tokens(self):
+        return [row[0] for row in self._execute("SELECT token FROM sessions")]
+
+    def user_session(self, user_id):
+        rows = self._execute("SELECT token FROM users WHERE user_id = ?", (user_id,))
+        return None if not rows else rows[0][0]
+
+    def set_user_session(self, user_id, token):
+        if token is None:
+            self._execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+        else:
+            self._execute("INSERT OR REPLACE INTO users VALUES (?, ?)", (user_id, token))
+
+    def acquire_lease(self, name, owner, ttl):
+        now = time.time()
+        rows = self._execute("INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE SET "
+                             "owner = excluded.owner, expires = excluded.expires "
+                             "WHERE leases.owner = excluded.owner OR leases.expires <= ? RETURNING owner",
+                             (name, owner, now + ttl, now))
+        return bool(rows)
+
+    def close(self):
+        super().close()
+        self._connection.close()
+
+
+class JournalStateStore(MemoryStateStore):
+    """
+    memory store persisted write-behind: changes are coalesced and appended to a journal in background
+    every flush_interval seconds, the journal is compacted into a snapshot replaced atomically,
+    so saving never blocks the event loop and a crash loses at most one flush interval
+    """
+
+    def __init__(self, file_name: str, flush_interval: float = 1, compact_after: int = 1000):
+        super().__init__()
+        self._snapshot_name = file_name
+        self._journal_name = file_name + ".journal"
+        self._flush_interval = flush_interval
+        self._compact_after = compact_after
+        # latest change of every session and user waiting to be written, older ones are overwritten
+        self._pending: dict[tuple, dict] = {}
+        self._journal_records = 0
+        self._flush_task: asyncio.Task | None = None
+        self._write_lock = threading.Lock()
+        self._recover()
+
+    def _recover(self):
+        if os.path.exists(self._snapshot_name):
+            with open(self._snapshot_name, "r", encoding="utf-8") as file:
+                snapshot = json.load(file)
+            self._states = {token: (state, version) for token, state, version in snapshot["sessions"]}
+            self._users = {int(user_id): token for user_id, token in snapshot["users"]}
+        if os.path.exists(self._journal_name):
+            with open(self._journal_name, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # torn last line of a flush interrupted by a crash
+                        logger.warning("skipping damaged state journal record")
+                        continue
+                    self._apply(record)
+                    self._journal_records += 1
+
+    def _apply(self, record: dict):
+        if record["op"] == "save":
+            self._states[record["token"]] = (record["state"], record["version"])
+        elif record["op"] == "delete":
+            MemoryStateStore.delete(self, record["token"])
+        elif record["op"] == "user":
+            MemoryStateStore.set_user_session(self, record["user_id"], record["token"])
+
+    def _schedule(self, key: tuple, record: dict):
+        self._pending[key] = record
+        if self._flush_task is not None and not self._flush_task.done():
+            # the running flush writes changes made meanwhile after the current write
+            return
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+        except RuntimeError:
+            # no event loop, e.g. in scripts, nothing to be blocked
+            self.flush()
+
+    async def _flush_later(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            await asyncio.sleep(self._flush_interval)
+            # pending changes are detached on the loop, the writing thread gets only their list
+            items, self._pending = list(self._pending.items()), {}
+            try:
+                await loop.run_in_executor(None, self._write, [record for _, record in items])
+            except Exception:
+                logger.exception("state journal flush failed")
+                # written again with the next flush, before the changes made meanwhile
+                self._pending = {**dict(items), **self._pending}
+
+    def flush(self):
+        """
+        writes pending changes to the journal, compacts it into the snapshot when it is long enough
+        """
+        records, self._pending = list(self._pending.values()), {}
+        self._write(records)
+
+    def _write(self, records: list[dict]):
+        with self._write_lock:
+            if records:
+                with open(self._journal_name, "a", encoding="utf-8") as file:
+                    file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+                    file.flush()
+                    os.fsync(file.fileno())
+                self._journal_records += len(records)
+            if self._journal_records >= self._compact_after:
+                self._compact()
+
+    def _compact(self):
+        # memory already holds everything journaled, so the snapshot of it makes the journal redundant
+        snapshot = {"sessions": [(token, state, version) for token, (state, version) in list(self._states.items())],
+                    "users": list(self._users.items())}
+        atomic_write(self._snapshot_name, json.dumps(snapshot, ensure_ascii=False))
+        os.remove(self._journal_name)
+        self._journal_records = 0
+
+    def save(self, token, state, expected_version):
+        version = super().save(token, state, expected_version)
+        self._schedule(("session", token), {"op": "save", "token": token, "state": self._states[token][0],
+                                            "version": version})
+        return version
+
+    def delete(self, token):
+        super().delete(token)
+        # deletion drops users of the session as well, their pending changes must not be written after it
+        for key in [key for key, record in self._pending.items() if record.get("token") == token]:
+            self._pending.pop(key)
+        self._schedule(("session", token), {"op": "delete", "token": token})
+
+    def set_user_session(self, user_id, token):
+        super().set_user_session(user_id, token)
+        self._schedule(("user", user_id), {"op": "user", "user_id": user_id, "token": token})
+
+    def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        self.flush()
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisConnection:
+    """
+    minimal blocking client of the redis serialization protocol (RESP2)
+    """
+
+    def __init__(self, host="localhost", port=6379, db=0, password=None, timeout=5):
+        self._address = (host, port)
+        self._db = db
+        self._password = password
+        self._timeout = timeout
+        self._socket: socket.socket | None = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._socket = socket.create_connection(self._address, timeout=self._timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._socket.makefile("rb")
+        if self._password:
+            self._call([("AUTH", self._password)])
+        if self._db:
+            self._call([("SELECT", self._db)])
+
+    def close(self):
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+            self._socket = self._file = None
+
+    @staticmethod
+    def _encode(command) -> bytes:
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("redis closed the connection")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            return RedisError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(payload)
+            return None if length == -1 else [self._read_reply() for _ in range(length)]
+        raise RedisError(f"unexpected reply {line!r}")
+
+    def _call(self, commands):
+        self._socket.sendall(b"".join(self._encode(command) for command in commands))
+        replies = [self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def pipeline(self, *commands) -> list:
+        """
+        sends commands in one round trip, reconnects once if the connection was lost
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._socket is None:
+                        self._connect()
+                    return self._call(commands)
+                except (ConnectionError, OSError):
+                    self.close()
+                    if attempt == 1:
+                        raise
+
+    def execute(self, *command):
+        return self.pipeline(command)[0]
+
+    def compare_and_execute(self, key: str, expected: str | None, *commands) -> list | None:
+        """
+        executes commands in a transaction if the key holds the expected value and isn't changed meanwhile
+        :return: replies of the commands or None if the key didn't hold the expected value
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._socket is None:
+                        self._connect()
+                    self._call([("WATCH", key)])
+                    break
+                except (ConnectionError, OSError):
+                    self.close()
+                    if attempt == 1:
+                        raise
+            try:
+                # the transaction isn't repeated on a lost connection, it may have been executed already
+                if self._call([("GET", key)])[0] != expected:
+                    self._call([("UNWATCH",)])
+                    return None
+                return self._call([("MULTI",), *commands, ("EXEC",)])[-1]
+            except (ConnectionError, OSError):
+                self.close()
+                raise
+
+
+class RedisStateStore(StateStore):
+    __PREFIX = "spotify_bot"
+    blocking = True
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        db = int(parsed.path[1:]) if parsed.path not in ("", "/") else 0
+        self._redis = RedisConnection(parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password)
+
+    def _key(self, *parts) -> str:
+        return ":".join([self.__PREFIX, *map(str, parts)])
+
+    def load(self, token):
+        state, version = self._redis.pipeline(("GET", self._key("session", token)),
+                                              ("GET", self._key("session", token, "version")))
+        return None if state is None else (json.loads(state), int(version or 0))
+
+    def save(self, token, state, expected_version):
+        version_key = self._key("session", token, "version")
+        replies = self._redis.compare_and_execute(
+            version_key, None if expected_version is None else str(expected_version),
+            ("SET", self._key("session", token), json.dumps(state, ensure_ascii=False)),
+            ("SADD", self._key("sessions"), token),
+            ("INCR", version_key))
+        if replies is None:
+            raise StateConflict(token)
+        return replies[-1]
+
+    def version(self, token):
+        version = self._redis.execute("GET", self._key("session", token, "version"))
+        return None if version is None else int(version)
+
+    def delete(self, token):
+        users_key = self._key("session", token, "users")
+        users = self._redis.execute("SMEMBERS", users_key) or []
+        self._redis.pipeline(("DEL", self._key("session", token), self._key("session", token, "version"), users_key,
+                              *[self._key("user", user_id) for user_id in users]),
+                             ("SREM", self._key("sessions"), token))
+
+    def tokens(self):
+        return self._redis.execute("SMEMBERS", self._key("sessions")) or []
+
+    def user_session(self, user_id):
+        return self._redis.execute("GET", self._key("user", user_id))
+
+    def set_user_session(self, user_id, token):
+        previous = self.user_session(user_id)
+        commands = []
+        if previous is not None:
+            commands.append(("SREM", self._key("session", previous, "users"), user_id))
+        if token is None:
+            commands.append(("DEL", self._key("user", user_id)))
+        else:
+            commands.append(("SET", self._key("user", user_id), token))
+            commands.append(("SADD", self._key("session", token, "users"), user_id))
+        self._redis.pipeline(*commands)
+
+    def acquire_lease(self, name, owner, ttl):
+        key, milliseconds = self._key("lease", name), max(1, int(ttl * 1000))
+        if self._redis.execute("SET", key, owner, "NX", "PX", milliseconds) is not None:
+            return True
+        # extended only if it is still held by the owner, the key expires on its own otherwise
+        return self._redis.compare_and_execute(key, owner, ("PEXPIRE", key, milliseconds)) is not None
+
+    def close(self):
+        super().close()
+        self._redis.close()
+
+
+def create_state_store(kind: str, url: str, data_path: str, flush_interval: float = 1) -> StateStore:
+    """
+    :param kind: memory, file, sqlite or redis
+    :param url: snapshot or sqlite file name or redis url (redis://[:password@]host:port/db), optional
+    """
+    if kind == "memory":
+        return MemoryStateStore()
+    if kind == "file":
+        return JournalStateStore(url or f"{data_path}/state.json", flush_interval)
+    if kind == "sqlite":
+        return SQLiteStateStore(url or f"{data_path}/state.sqlite3")
+    if kind == "redis":
+        return RedisStateStore(url or "redis://localhost:6379/0")
+    raise ValueError(f"unknown state store '{kind}'")
@@ -0,0 +1,139 @@
+"""
+stand-in for the telegram bot api as an aiogram session, answers the methods used by handlers without network,
+counts the calls and keeps the text of every message, so that the router and broadcasts can be driven offline;
+sending and editing is held to flood limits like telegram does, calls over them fail with TelegramRetryAfter
+
+usage:
+    bot = Bot(token, session=TelegramStandIn())
+"""
+import asyncio
+import itertools
+import json
+import math
+import time
+from collections import Counter
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+
+from token_bucket import TokenBucket
+
+# methods answered with the sent or edited message, the others are answered with True
+_SENDING_METHODS = {"sendMessage", "sendPhoto", "sendDocument"}
+_EDITING_METHODS = {"editMessageText", "editMessageReplyMarkup"}
+
+
+class TelegramStandIn(BaseSession):
+    # limits of sending and editing messages, per bot and per chat
+    GLOBAL_RATE = 30
+    PER_CHAT_RATE = 1
+    PER_CHAT_BURST = 3
+
+    def __init__(self, latency: float = 0.0, global_rate: float | None = GLOBAL_RATE,
+                 per_chat_rate: float | None = PER_CHAT_RATE, per_chat_burst: float = PER_CHAT_BURST):
+        """
+        :param latency: delay of every call in seconds
+        :param global_rate: messages per second the bot may send and edit, unlimited if None
+        :param per_chat_rate: messages per second the bot may send and edit in one chat, unlimited if None
+        """
+        super().__init__()
+        self._latency = latency
+        self._message_ids = itertools.count(1)
+        self._global_limit = None if global_rate is None else TokenBucket(global_rate, global_rate)
+        self._per_chat_rate = per_chat_rate
+        self._per_chat_burst = per_chat_burst
+        self._chat_limits: dict[int, TokenBucket] = {}
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        # (chat id, message id) -> text and markup of messages which weren't deleted
+        self.messages: dict[tuple[int, int], tuple[str | None, str | None]] = {}
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    @staticmethod
+    def _message(chat_id, message_id, text=None) -> dict:
+        message = {"message_id": message_id, "date": int(time.time()), "chat": {"id": int(chat_id), "type": "private"}}
+        if text is not None:
+            message["text"] = text
+        return message
+
+    def text(self, chat_id, message_id) -> str | None:
+        """
+        :return: text the message shows now, None if there is no such message or it has no text
+        """
+        return self.messages.get((int(chat_id), message_id), (None, None))[0]
+
+    def _retry_after(self, chat_id) -> float:
+        """
+        :return: 0 if the message fits into the limits, otherwise seconds to wait, like telegram answers
+        """
+        chat_limit = None
+        if self._per_chat_rate is not None:
+            chat_limit = self._chat_limits.get(chat_id)
+            if chat_limit is None:
+                chat_limit = self._chat_limits[chat_id] = TokenBucket(self._per_chat_rate, self._per_chat_burst)
+            wait = chat_limit.take()
+            if wait:
+                return wait
+        if self._global_limit is not None:
+            wait = self._global_limit.take()
+            if wait:
+                # the message isn't sent, so it doesn't count in its chat
+                if chat_limit is not None:
+                    chat_limit.give_back()
+                return wait
+        return 0
+
+    def _answer(self, name: str, method: TelegramMethod) -> tuple[int, dict]:
+        if name in _SENDING_METHODS or name in _EDITING_METHODS:
+            chat_id = int(method.chat_id)
+            retry_after = self._retry_after(chat_id)
+            if retry_after:
+                self.rate_limited[name] += 1
+                retry_after = math.ceil(retry_after)
+                return 429, {"ok": False, "error_code": 429, "parameters": {"retry_after": retry_after},
+                             "description": f"Too Many Requests: retry after {retry_after}"}
+            text = getattr(method, "text", None)
+            markup = None if method.reply_markup is None else repr(method.reply_markup)
+            if name in _SENDING_METHODS:
+                message_id = next(self._message_ids)
+            else:
+                message_id = method.message_id
+                current = self.messages.get((chat_id, message_id))
+                if current is None:
+                    return self._bad_request("message to edit not found")
+                if name == "editMessageReplyMarkup":
+                    text = current[0]
+                if current == (text, markup):
+                    return self._bad_request("message is not modified")
+            self.messages[(chat_id, message_id)] = (text, markup)
+            return 200, {"ok": True, "result": self._message(chat_id, message_id, text)}
+        if name == "deleteMessage":
+            # messages of users are deleted too, they are unknown here
+            self.messages.pop((int(method.chat_id), method.message_id), None)
+        elif name == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "stand-in",
+                                                "username": "StandInBot"}}
+        return 200, {"ok": True, "result": True}
+
+    @staticmethod
+    def _bad_request(description) -> tuple[int, dict]:
+        return 400, {"ok": False, "error_code": 400, "description": f"Bad Request: {description}"}
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: int | None = None):
+        name = method.__api_method__
+        self.calls[name] += 1
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        status_code, answer = self._answer(name, method)
+        # parsed the same way as real answers, so that handlers get bound aiogram objects and aiogram errors
+        return self.check_response(bot=bot, method=method, status_code=status_code, content=json.dumps(answer)).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
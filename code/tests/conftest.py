@@ -0,0 +1,29 @@
+"""
+settings required by config_reader are replaced with local values before the bot modules are imported,
+tests never reach telegram, spotify or genius
+
+usage (from the code directory):
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+
+_DATA_PATH = tempfile.mkdtemp(prefix="spotify_bot_tests_")
+for name, value in {
+    "BOT_TOKEN": "42:stand-in",
+    "SPOTIFY_USERNAME": "stand-in",
+    "SPOTIFY_CLIENT_ID": "stand-in",
+    "SPOTIFY_CLIENT_SECRET": "stand-in",
+    "SPOTIFY_REDIRECT_URI": "http://localhost/callback",
+    "DATA_PATH": _DATA_PATH,
+    "TOKEN_FILE": os.path.join(_DATA_PATH, "token.json"),
+    "ADMIN_FILE": os.path.join(_DATA_PATH, "admins.json"),
+    "STATE_STORE": "memory",
+    "RESTORE_SESSIONS": "false",
+    "LYRICS_PREFETCH_DEPTH": "0",
+    "METRICS_PORT": "0",
+}.items():
+    os.environ[name] = value
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
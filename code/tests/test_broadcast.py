@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+from aiogram import Bot
+
+from broadcast import Broadcaster, Coalescer
+from telegram_stand_in import TelegramStandIn
+from token_bucket import TokenBucket
+
+
+def test_token_bucket_paces_after_burst():
+    bucket = TokenBucket(rate=50, capacity=5)
+
+    async def main():
+        start = time.monotonic()
+        for _ in range(15):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # 5 tokens right away, 10 more refilled at 50 per second
+    elapsed = asyncio.run(main())
+    assert 0.17 <= elapsed < 0.5
+    assert not bucket.full
+
+
+def test_broadcaster_repeats_only_the_refused_call():
+    # the stand-in allows one message per chat at once, the broadcaster doesn't know it
+    telegram = TelegramStandIn(per_chat_rate=20, per_chat_burst=1)
+    bot = Bot("42:stand-in", session=telegram)
+
+    def goodbye(chat_id):
+        async def action(send):
+            await send(bot.send_message, chat_id=chat_id, text="goodbye")
+            await send(bot.send_message, chat_id=chat_id, text="see you")
+        return action
+
+    report = asyncio.run(Broadcaster(per_chat_rate=1000, per_chat_burst=10).broadcast(
+        {chat_id: goodbye(chat_id) for chat_id in (1, 2)}))
+    assert (report.sent, report.failed) == (2, 0) and report.retries == 2
+    assert sorted(telegram.messages.values()) == [("goodbye", None)] * 2 + [("see you", None)] * 2
+
+
+def test_broadcaster_reports_chats_whose_action_failed():
+    async def fail(send):
+        raise ValueError("chat not found")
+
+    async def succeed(send):
+        pass
+
+    report = asyncio.run(Broadcaster().broadcast({1: fail, 2: succeed}))
+    assert (report.sent, report.failed) == (1, 1) and isinstance(report.errors[1], ValueError)
+
+
+def test_coalescer_replaces_waiting_request():
+    coalescer = Coalescer()
+    runs = []
+
+    async def update(name, *skip):
+        runs.append((name, set(skip)))
+        await asyncio.sleep(0.01)
+
+    async def main():
+        coalescer.schedule("menu", update, "first", skip={1})
+        await asyncio.sleep(0)
+        # the first one runs, the third replaces the second, chats are left out only if both leave them out
+        coalescer.schedule("menu", update, "second", skip={1, 2})
+        coalescer.schedule("menu", update, "third", skip={2, 3})
+        coalescer.schedule("queue", update, "queue")
+        await coalescer.join()
+
+    asyncio.run(main())
+    assert runs == [("first", {1}), ("queue", set()), ("third", {2})]
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from cache import TTLCache
+
+
+class Loader:
+
+    def __init__(self, delay=0.01):
+        self.calls = 0
+        self.delay = delay
+
+    async def __call__(self, value="value"):
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(self.delay)
+        return f"{value} {call}"
+
+
+def test_concurrent_callers_share_one_request():
+    cache, loader = TTLCache(ttl=10), Loader()
+
+    async def main():
+        return await asyncio.gather(*(cache.get("key", loader) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["value 1"] * 5
+    assert loader.calls == 1
+    assert (cache.stats.misses, cache.stats.coalesced, cache.stats.hits) == (1, 4, 0)
+    assert cache.stats.hit_rate == 0.8
+
+
+def test_cancelled_caller_does_not_cancel_the_request():
+    cache, loader = TTLCache(ttl=10), Loader()
+
+    async def main():
+        first = asyncio.ensure_future(cache.get("key", loader))
+        second = asyncio.ensure_future(cache.get("key", loader))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "value 1"
+    assert cache.peek("key") == "value 1"
+
+
+def test_result_of_invalidated_request_is_not_stored():
+    cache, loader = TTLCache(ttl=10), Loader()
+
+    async def main():
+        stale = asyncio.ensure_future(cache.get("key", loader, "stale"))
+        await asyncio.sleep(0)
+        cache.invalidate("key")
+        # callers after the invalidation don't share the stale request
+        fresh = await cache.get("key", loader, "fresh")
+        return await stale, fresh
+
+    assert asyncio.run(main()) == ("stale 1", "fresh 2")
+    assert cache.peek("key") == "fresh 2"
+
+
+def test_fresh_value_is_not_overwritten_by_request_in_flight():
+    cache, loader = TTLCache(ttl=10), Loader()
+
+    async def main():
+        in_flight = asyncio.ensure_future(cache.get("key", loader, "older"))
+        await asyncio.sleep(0)
+        cache.set("key", "newer")
+        return await in_flight
+
+    assert asyncio.run(main()) == "older 1"
+    assert cache.peek("key") == "newer"
+
+
+def test_expired_value_is_loaded_again():
+    cache, loader = TTLCache(ttl=0.02), Loader(delay=0)
+
+    async def main():
+        first = await cache.get("key", loader)
+        cached = await cache.get("key", loader)
+        await asyncio.sleep(0.03)
+        return first, cached, await cache.get("key", loader)
+
+    assert asyncio.run(main()) == ("value 1", "value 1", "value 2")
+    assert cache.stats.hits == 1 and cache.stats.misses == 2
+
+
+def test_loader_error_reaches_every_waiter():
+    cache = TTLCache(ttl=10)
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("spotify is down")
+
+    async def main():
+        return await asyncio.gather(*(cache.get("key", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert len(results) == 3 and all(isinstance(result, ValueError) for result in results)
+    assert cache.peek("key") is None and len(cache) == 0
+
+
+def test_size_is_limited():
+    cache = TTLCache(ttl=10, max_size=2)
+    for key in range(3):
+        cache.set(key, key)
+    assert len(cache) == 2 and cache.peek(0) is None
+
+
+@pytest.mark.parametrize("everything", [False, True])
+def test_invalidation_is_counted(everything):
+    cache = TTLCache(ttl=10)
+    cache.set("key", 1)
+    cache.invalidate("key", everything=everything)
+    assert cache.peek("key") is None and cache.stats.invalidations == 1
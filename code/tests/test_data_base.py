@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from config_reader import config
+from data_base import DataBase
+from last_message import LastMessage
+from state_store import MemoryStateStore
+
+
+class CountingStore(MemoryStateStore):
+
+    def __init__(self):
+        super().__init__()
+        self.saves = 0
+
+    def save(self, token, state, expected_version):
+        self.saves += 1
+        return super().save(token, state, expected_version)
+
+
+@pytest.fixture(autouse=True)
+def short_save_delay(monkeypatch):
+    monkeypatch.setattr(config, "state_save_delay", 0.01)
+
+
+def worker(store, token) -> DataBase:
+    db = DataBase(store=store)
+    db.load_state(*store.load(token))
+    return db
+
+
+def test_changes_made_together_are_saved_at_once():
+    store = CountingStore()
+
+    async def main():
+        db = DataBase(1, "owner", store)
+        db.set_token()
+        for user_id in range(100):
+            db.add_user(user_id)
+            db.update_last_message(user_id, LastMessage(user_id, 1))
+        await asyncio.sleep(0.1)
+        return db
+
+    db = asyncio.run(main())
+    assert store.saves == 1
+    assert len(worker(store, db.token).last_message) == 100
+
+
+def test_changes_of_two_workers_are_both_kept():
+    store = CountingStore()
+
+    async def main():
+        first = DataBase(1, "owner", store)
+        first.set_token()
+        await first.save()
+        second = worker(store, first.token)
+        first.add_user(2, "guest")
+        second.add_song_to_users_queue(1, "song")
+        await first.save()
+        # based on an outdated version, so the change is made again on top of the first worker's state
+        await second.save()
+        return first.token
+
+    token = asyncio.run(main())
+    saved = worker(store, token)
+    assert set(saved.users) == {1, 2}
+    assert list(saved.user_queue) == [(1, "song")]
+    assert store.saves == 4
+
+
+def test_changes_to_an_ended_session_are_dropped():
+    store = MemoryStateStore()
+
+    async def main():
+        first = DataBase(1, "owner", store)
+        first.set_token()
+        await first.save()
+        second = worker(store, first.token)
+        store.delete(first.token)
+        second.add_user(2, "guest")
+        await second.save()
+        return first.token, await second.sync()
+
+    token, exists = asyncio.run(main())
+    assert store.load(token) is None
+    assert not exists
+
+
+def test_sync_picks_up_foreign_changes():
+    store = MemoryStateStore()
+
+    async def main():
+        first = DataBase(1, "owner", store)
+        first.set_token()
+        # not saved yet, but not ended either
+        assert await first.sync()
+        await first.save()
+        second = worker(store, first.token)
+        first.add_user(2, "guest")
+        await first.save()
+        return second, await second.sync()
+
+    second, exists = asyncio.run(main())
+    assert exists
+    assert set(second.users) == {1, 2}
+
+
+def test_closed_state_is_not_saved():
+    store = MemoryStateStore()
+
+    async def main():
+        db = DataBase(1, "owner", store)
+        db.set_token()
+        db.close()
+        await asyncio.sleep(0.05)
+        return db.token
+
+    assert store.load(asyncio.run(main())) is None
+
+
+def test_reconciling_saves_only_when_songs_are_dropped():
+    store = CountingStore()
+
+    async def main():
+        db = DataBase(1, "owner", store)
+        db.set_token()
+        db.add_song_to_users_queue(1, "a")
+        db.add_song_to_users_queue(1, "b")
+        await db.save()
+        saves = store.saves
+        assert db.reconcile_users_queue(["a", "b"]) == [1, 1]
+        await db.save()
+        assert store.saves == saves
+        assert db.reconcile_users_queue(["b"]) == [1]
+        await db.save()
+        return db.token, store.saves - saves
+
+    token, saves = asyncio.run(main())
+    assert saves == 1
+    assert list(worker(store, token).user_queue) == [(1, "b")]
@@ -0,0 +1,91 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+import handlers
+from broadcast import background_updates
+from config_reader import config
+from middlewares import SessionMiddleware
+from sessions import sessions
+from spotify_stand_in import SpotifyStandIn
+from telegram_stand_in import TelegramStandIn
+
+ADMIN = User(id=1, is_bot=False, first_name="admin", username="admin")
+
+
+def press(data, message_id) -> Update:
+    message = Message(message_id=message_id, date=datetime.now(), chat=Chat(id=ADMIN.id, type="private"), text="")
+    return Update(update_id=message_id, callback_query=CallbackQuery(id="1", from_user=ADMIN, chat_instance="0",
+                                                                     message=message, data=data))
+
+
+class BlockedStandIn(TelegramStandIn):
+    """
+    users blocked the bot after it sent them a message, so it can't delete their messages
+    """
+
+    def _answer(self, name, method):
+        if name == "deleteMessage":
+            return 403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+        return super()._answer(name, method)
+
+
+@pytest.fixture(scope="module")
+def dp() -> Dispatcher:
+    # the router is attached to one dispatcher only
+    dp = Dispatcher()
+    dp.update.outer_middleware(SessionMiddleware(sessions))
+    dp.include_routers(handlers.router)
+    return dp
+
+
+def test_menu_is_shown_again_after_other_views(monkeypatch, dp):
+    async def main():
+        spotify = SpotifyStandIn(tracks=10)
+        runner = await spotify.serve("localhost", 0)
+        monkeypatch.setattr(config, "spotify_api_url", f"http://localhost:{runner.addresses[0][1]}")
+        telegram = TelegramStandIn(global_rate=None, per_chat_rate=None)
+        bot = Bot("42:stand-in", session=telegram)
+        session = await sessions.create(ADMIN.id, ADMIN.username)
+        try:
+            await session.spotify.authorize(f"{config.spotify_redirect_uri.get_secret_value()}?code=test")
+            sessions.activate(session)
+            message_id = (await bot.send_message(chat_id=ADMIN.id, text="Spotify 🎧")).message_id
+            shown = []
+            for data in ("menu", "view_devices", handlers.ChangeDeviceFactory(id="device1", is_active=False).pack(),
+                         "menu", "get_settings", "menu"):
+                await dp.feed_update(bot, press(data, message_id))
+                shown.append(telegram.text(ADMIN.id, message_id))
+            await background_updates.join()
+        finally:
+            await sessions.end(session)
+            await runner.cleanup()
+        return shown
+
+    shown = asyncio.run(main())
+    assert shown[0].startswith("🎧")
+    assert shown[1] == "доступные устройства Spotify"
+    assert shown[2] == "устройство воспроизведения успешно изменено"
+    assert shown[3].startswith("🎧") and shown[5].startswith("🎧")
+
+
+def test_goodbye_is_delivered_once_when_the_menu_can_not_be_deleted(dp):
+    async def main():
+        telegram = BlockedStandIn(global_rate=None, per_chat_rate=None)
+        bot = Bot("42:stand-in", session=telegram)
+        session = await sessions.create(ADMIN.id, ADMIN.username)
+        sessions.activate(session)
+        sessions.join(2, "guest", session)
+        for user_id in (ADMIN.id, 2):
+            session.db.update_last_message(user_id, await bot.send_message(chat_id=user_id, text="Spotify 🎧"))
+        await dp.feed_update(bot, press("end_session", session.db.last_message[ADMIN.id].message_id))
+        return telegram
+
+    telegram = asyncio.run(main())
+    report = handlers.broadcaster.last_report
+    assert (report.sent, report.failed, report.retries) == (2, 0, 0)
+    goodbyes = [chat_id for (chat_id, _), (text, _) in telegram.messages.items() if text.startswith("сессия завершена")]
+    assert sorted(goodbyes) == [ADMIN.id, 2]
@@ -0,0 +1,35 @@
+import pydantic
+import pytest
+
+import keyboards
+from keyboards import admin_menu_keyboard, menu_keyboard, settings_keyboard, user_menu_keyboard
+
+
+def sent(markup) -> dict:
+    return markup.model_dump(exclude_none=True)
+
+
+def test_markups_are_the_same_for_a_role_and_mode():
+    assert settings_keyboard(True) == settings_keyboard(True)
+    assert sent(settings_keyboard(True)) == sent(settings_keyboard.__wrapped__(True)) != sent(settings_keyboard(False))
+    assert sent(settings_keyboard(False)) == sent(settings_keyboard.__wrapped__(False))
+    assert user_menu_keyboard(False) == user_menu_keyboard(False)
+    assert sent(user_menu_keyboard(True)) == sent(user_menu_keyboard.__wrapped__(True)) != sent(user_menu_keyboard(False))
+    assert sent(user_menu_keyboard(False)) == sent(user_menu_keyboard.__wrapped__(False))
+    assert sent(admin_menu_keyboard()) == sent(admin_menu_keyboard.__wrapped__())
+    assert sent(menu_keyboard()) == sent(menu_keyboard.__wrapped__())
+
+
+def test_buttons_are_built_once():
+    first, second = admin_menu_keyboard(), admin_menu_keyboard()
+    assert first is not second
+    assert first.inline_keyboard[0][0] is second.inline_keyboard[0][0]
+
+
+def test_callers_can_not_change_the_markup_of_others():
+    markup = user_menu_keyboard(True)
+    markup.inline_keyboard.pop()
+    markup.inline_keyboard[0].append(keyboards.InlineKeyboardButton(text="extra", callback_data="extra"))
+    with pytest.raises(pydantic.ValidationError):
+        markup.inline_keyboard[1][0].text = "changed"
+    assert sent(user_menu_keyboard(True)) == sent(user_menu_keyboard.__wrapped__(True))
@@ -0,0 +1,61 @@
+import json
+from datetime import datetime
+
+from aiogram.types import Chat, Message
+
+from data_base import DataBase
+from handlers import shows_view
+from last_message import LastMessage, ViewKind, view_of
+from state_store import MemoryStateStore
+from views import RenderedView, Role, content_hash
+
+
+def message(text, message_id=7, chat_id=1) -> Message:
+    return Message(message_id=message_id, date=datetime.now(), chat=Chat(id=chat_id, type="private"), text=text)
+
+
+def test_view_hash_is_stable_and_depends_on_text():
+    kind, text_hash = view_of("🎧 song")
+    assert kind == ViewKind.MENU and (kind, text_hash) == view_of("🎧 song")
+    assert view_of("🎧 other song")[1] != text_hash
+    assert view_of("в очереди нет треков")[0] == ViewKind.QUEUE
+    assert view_of(None) == (ViewKind.OTHER, 0)
+
+
+def test_dump_and_load_keep_the_view():
+    last = LastMessage.from_message(message("🎧 song"), content_hash("🎧 song", Role.ADMIN, 0))
+    # the state store keeps json, tuples come back as lists
+    loaded = LastMessage.load(json.loads(json.dumps(last.dump())))
+    assert loaded.dump() == last.dump()
+    assert loaded.kind == ViewKind.MENU and loaded.shows(content_hash("🎧 song", Role.ADMIN, 0))
+    assert not loaded.shows(content_hash("🎧 song", Role.USER, 0))
+
+
+def test_state_of_older_versions_is_loaded():
+    text_only = LastMessage.load([1, 7, "🎧 song"])
+    assert (text_only.chat_id, text_only.message_id) == (1, 7)
+    assert (text_only.kind, text_only.content_hash) == view_of("🎧 song")
+    ids_only = LastMessage.load([1, 7])
+    assert (ids_only.chat_id, ids_only.message_id, ids_only.kind) == (1, 7, ViewKind.OTHER)
+    assert not ids_only.shows(view_of("🎧 song")[1])
+
+
+def test_restored_session_skips_the_view_already_shown():
+    store = MemoryStateStore()
+    db = DataBase(1, "owner", store)
+    db.set_token()
+    view = RenderedView("🎧 song", None, content_hash("🎧 song", Role.ADMIN, 0))
+    db.update_last_message(1, message(view.text), view.content_hash)
+    state = json.loads(json.dumps(db.dump_state()))
+
+    restored = DataBase(store=store)
+    restored.load_state(state, 1)
+    assert shows_view(restored, 1, message(view.text), view)
+    assert not shows_view(restored, 1, message(view.text, message_id=8), view)
+    assert not shows_view(restored, 1, message(view.text), view._replace(content_hash=view.content_hash + 1))
+
+    state["last_messages"] = [[1, 1, 7, view.text]]
+    restored.load_state(state, 2)
+    # hashes of older versions only cover the text
+    assert not shows_view(restored, 1, message(view.text), view)
+    assert restored.last_message[1].kind == ViewKind.MENU
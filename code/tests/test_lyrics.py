@@ -0,0 +1,44 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from lyrics import LyricsFinder, LyricsNotFound
+
+
+def finder_answering(monkeypatch, answer, delay=0.0) -> LyricsFinder:
+    finder = LyricsFinder()
+
+    def api_request(title, artist):
+        time.sleep(delay)
+        return answer
+
+    monkeypatch.setattr(finder, "_api_request", api_request)
+    return finder
+
+
+def test_song_text_is_cut_out_of_the_page(monkeypatch):
+    song = SimpleNamespace(lyrics="Song Lyrics\nla la la\nYou might also likeoh oh12Embed")
+    lyrics = asyncio.run(finder_answering(monkeypatch, song).find("artist", "song"))
+    assert (lyrics.artist, lyrics.name) == ("artist", "song")
+    assert lyrics.list_lyrics == ["la la la", "oh oh"]
+
+
+@pytest.mark.parametrize("song", [None, SimpleNamespace(lyrics=None)])
+def test_song_without_lyrics_is_not_found(monkeypatch, song):
+    with pytest.raises(LyricsNotFound):
+        asyncio.run(finder_answering(monkeypatch, song).find("artist", "song"))
+
+
+def test_slow_lookup_fails_without_being_not_found(monkeypatch):
+    finder = finder_answering(monkeypatch, SimpleNamespace(lyrics="la"), delay=0.2)
+    with pytest.raises(ValueError) as error:
+        asyncio.run(finder.find("artist", "song", timeout=0.05))
+    assert not isinstance(error.value, LyricsNotFound)
+
+
+def test_genius_requests_end_within_the_lookup_timeout():
+    api = LyricsFinder()._genius_api
+    # a lookup makes two requests, each tried retries + 1 times
+    assert 2 * (api.retries + 1) * api.timeout < LyricsFinder.find.__wrapped__.__defaults__[0]
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from lyrics import Lyrics, LyricsNotFound
+from lyrics_cache import LyricsCache
+
+
+class Loader:
+
+    def __init__(self, text="la la la", delay=0.05):
+        self.text = text
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self, artist, name):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.text is None:
+            raise LyricsNotFound("lyrics not found")
+        return Lyrics(name, artist, self.text)
+
+
+def test_concurrent_lookups_share_one_load(tmp_path):
+    cache, loader = LyricsCache(str(tmp_path)), Loader()
+
+    async def main():
+        return await asyncio.gather(*(cache.get("Artist", "Song (Remastered)", loader) for _ in range(5)),
+                                    cache.get("artist", "song", loader))
+
+    results = asyncio.run(main())
+    assert loader.calls == 1
+    assert {lyrics.lyrics for lyrics in results} == {"la la la"}
+    assert cache.stats.misses == 1 and cache.stats.coalesced == 5
+
+
+def test_second_tier_survives_restart(tmp_path):
+    loader = Loader()
+    asyncio.run(LyricsCache(str(tmp_path)).get("artist", "song", loader))
+
+    cache = LyricsCache(str(tmp_path))
+    assert asyncio.run(cache.get("artist", "song", loader)).lyrics == "la la la"
+    assert loader.calls == 1
+    assert cache.stats.disk_hits == 1
+    assert cache.stats.hit_rate == 1.0
+
+
+def test_missing_lyrics_are_remembered(tmp_path):
+    cache, loader = LyricsCache(str(tmp_path)), Loader(text=None)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            asyncio.run(cache.get("artist", "song", loader))
+    assert loader.calls == 1
+    assert cache.stats.negative_hits == 2
+
+
+def test_failing_waiter_does_not_fail_the_others(tmp_path):
+    cache, loader = LyricsCache(str(tmp_path)), Loader()
+
+    async def failing():
+        raise RuntimeError("message to edit not found")
+
+    async def main():
+        return await asyncio.gather(cache.get("artist", "song", loader, on_miss=failing),
+                                    cache.get("artist", "song", loader))
+
+    assert [lyrics.lyrics for lyrics in asyncio.run(main())] == ["la la la", "la la la"]
+
+
+def test_invalidate_drops_both_tiers(tmp_path):
+    cache, loader = LyricsCache(str(tmp_path)), Loader()
+
+    async def main():
+        await cache.get("artist", "song", loader)
+        await cache.invalidate("artist", "song")
+        await cache.get("artist", "song", loader)
+
+    asyncio.run(main())
+    assert loader.calls == 2
+
+
+def test_lookup_nobody_waits_for_is_cancelled(tmp_path):
+    cache, started, cancelled = LyricsCache(str(tmp_path)), asyncio.Event(), []
+
+    async def loader(artist, name):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(name)
+            raise
+
+    async def main():
+        waiter = asyncio.create_task(cache.get("artist", "song", loader))
+        await started.wait()
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert cancelled == ["song"]
+    assert cache._in_flight == {} and cache._waiting == {}
+
+
+def test_lookup_kept_while_someone_waits(tmp_path):
+    cache, loader = LyricsCache(str(tmp_path)), Loader(delay=0.1)
+
+    async def main():
+        first = asyncio.create_task(cache.get("artist", "song", loader))
+        second = asyncio.create_task(cache.get("artist", "song", loader))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()).lyrics == "la la la"
+
+
+def test_expired_rows_are_purged_every_few_writes(tmp_path):
+    cache, loader = LyricsCache(str(tmp_path), ttl=-1, purge_every=3), Loader(delay=0)
+
+    def rows():
+        return cache._db().execute("SELECT COUNT(*) FROM lyrics").fetchone()[0]
+
+    async def main(names):
+        for name in names:
+            await cache.get("artist", name, loader)
+
+    asyncio.run(main(["one", "two"]))
+    assert rows() == 2
+    asyncio.run(main(["three"]))
+    assert rows() == 0
+    plan = cache._db().execute("EXPLAIN QUERY PLAN DELETE FROM lyrics WHERE expires <= 0").fetchall()
+    assert "lyrics_expires" in str(plan)
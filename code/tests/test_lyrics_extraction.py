@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from benchmarks.lyrics_extraction import legacy_extract_lyrics
+from lyrics_find_engine import extract_lyrics
+
+PAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+
+
+def read_page(name) -> str:
+    with open(os.path.join(PAGES, name), "r", encoding="utf-8") as file:
+        return file.read()
+
+
+@pytest.mark.parametrize("name", sorted(os.listdir(PAGES)))
+def test_lyrics_are_extracted_as_before(name):
+    page = read_page(name)
+    lyrics = extract_lyrics(page)
+    assert lyrics == legacy_extract_lyrics(page)
+    assert "[Chorus]" in lyrics and "<" not in lyrics
+
+
+def test_scripts_and_ads_are_left_out():
+    lyrics = extract_lyrics(read_page("genius_song.html"))
+    assert "googletag" not in lyrics and "tooltip" not in lyrics and "sidebar ad" not in lyrics
+    assert "Salt upon the window & the rope\nNobody could save" in lyrics
+
+
+def test_page_without_lyrics():
+    assert extract_lyrics("<html><body><div class='lyrics-not'>no</div></body></html>") is None
+    assert extract_lyrics("") is None
@@ -0,0 +1,32 @@
+import asyncio
+
+from lyrics import Lyrics
+from lyrics_cache import lyrics_cache
+from lyrics_prefetch import LyricsPrefetcher
+
+
+def test_tracks_leaving_the_window_are_cancelled(monkeypatch):
+    monkeypatch.setattr(LyricsPrefetcher, "_LyricsPrefetcher__START_DELAY_SECONDS", 0)
+    started, finished = [], []
+
+    async def loader(artist, name):
+        started.append(name)
+        await asyncio.sleep(0.2)
+        finished.append(name)
+        return Lyrics(name, artist, "text")
+
+    async def main():
+        prefetcher = LyricsPrefetcher(loader, depth=2)
+        prefetcher.update([("prefetch artist", "first"), ("prefetch artist", "second")])
+        await asyncio.sleep(0.05)
+        # the first lookup is running, the second waits for the semaphore
+        prefetcher.update([("prefetch artist", "third")])
+        await asyncio.sleep(0.5)
+        return prefetcher
+
+    prefetcher = asyncio.run(main())
+    assert started == ["first", "third"]
+    assert finished == ["third"]
+    assert prefetcher.cancelled == 2 and prefetcher.prefetched == 1
+    assert lyrics_cache.contains("prefetch artist", "third")
+    assert not lyrics_cache.contains("prefetch artist", "first")
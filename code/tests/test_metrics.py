@@ -0,0 +1,30 @@
+import pytest
+
+from metrics import Metric, Registry
+
+
+def test_metric_must_render_its_samples():
+    class Untyped(Metric):
+        pass
+
+    with pytest.raises(TypeError):
+        Untyped("bot_untyped", "no samples")
+
+
+def test_metrics_are_rendered_in_the_prometheus_format():
+    registry = Registry()
+    counter = registry.counter("bot_errors_total", "errors", ("error",))
+    histogram = registry.histogram("bot_seconds", "time", buckets=(0.1, 1))
+    counter.inc(error='Bad"Request')
+    histogram.observe(0.05)
+    histogram.observe(5)
+    lines = registry.render().splitlines()
+    assert 'bot_errors_total{error="Bad\\"Request"} 1' in lines
+    assert 'bot_seconds_bucket{le="0.1"} 1' in lines and 'bot_seconds_bucket{le="+Inf"} 2' in lines
+    assert "bot_seconds_count 2" in lines and "bot_seconds_sum 5.05" in lines
+
+
+def test_labels_must_match():
+    counter = Registry().counter("bot_total", "calls", ("method",))
+    with pytest.raises(ValueError):
+        counter.inc(action="menu")
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from handlers import METRIC_ACTIONS, AddSongCallbackFactory, GetNextLyrics
+from middlewares import action_of
+
+USER = User(id=1, is_bot=False, first_name="user")
+
+
+def message(text) -> Update:
+    return Update(update_id=1, message=Message(message_id=1, date=datetime.now(), chat=Chat(id=1, type="private"),
+                                               from_user=USER, text=text))
+
+
+def callback(data) -> Update:
+    return Update(update_id=1, callback_query=CallbackQuery(id="1", from_user=USER, chat_instance="0", data=data))
+
+
+def test_known_actions_are_named():
+    assert action_of(callback("next_track"), METRIC_ACTIONS) == "next_track"
+    assert action_of(callback(AddSongCallbackFactory(uri="0" * 22).pack()), METRIC_ACTIONS) == "fabAddSong"
+    lyrics = GetNextLyrics(start_ind=16, step=16, action="increment").pack()
+    assert action_of(callback(lyrics), METRIC_ACTIONS) == "fabLyrics"
+    assert action_of(message("/start token"), METRIC_ACTIONS) == "/start"
+    assert action_of(message("/profile@StandInBot 5"), METRIC_ACTIONS) == "/profile"
+    assert action_of(message("some track"), METRIC_ACTIONS) == "message"
+
+
+def test_unknown_actions_share_one_label():
+    assert action_of(callback("forged~payload"), METRIC_ACTIONS) == "other"
+    assert action_of(callback("nope:1"), METRIC_ACTIONS) == "other"
+    assert action_of(message("/whatever"), METRIC_ACTIONS) == "other"
+    assert action_of(message("/" + "x" * 100), METRIC_ACTIONS) == "other"
@@ -0,0 +1,42 @@
+import asyncio
+
+from player_watcher import PlayerEvent, PlayerWatcher
+
+
+class FailingSpotify:
+
+    async def next_track(self):
+        raise ConnectionError("spotify is down")
+
+
+def test_discarded_waiter_lets_polling_back_off():
+    async def main():
+        watcher = PlayerWatcher(FailingSpotify())
+        # nothing changed for a while
+        watcher._interval = 8
+        backoff = watcher._next_interval(None)
+        track_changed = watcher.expect(PlayerEvent.TRACK_CHANGED)
+        assert watcher._next_interval(None) < backoff
+        try:
+            await watcher._spotify.next_track()
+        except ConnectionError:
+            pass
+        finally:
+            watcher.discard(track_changed)
+        assert track_changed.cancelled()
+        assert watcher._next_interval(None) == backoff
+
+    asyncio.run(main())
+
+
+def test_waiter_resolved_by_expected_event():
+    async def main():
+        watcher = PlayerWatcher(None)
+        track_changed = watcher.expect(PlayerEvent.TRACK_CHANGED)
+        watcher._emit([PlayerEvent.PLAYBACK_CHANGED])
+        assert not track_changed.done()
+        watcher._emit([PlayerEvent.PLAYBACK_CHANGED, PlayerEvent.TRACK_CHANGED])
+        assert await watcher.wait(track_changed, timeout=1) == PlayerEvent.TRACK_CHANGED
+        assert watcher._waiters == []
+
+    asyncio.run(main())
@@ -0,0 +1,20 @@
+import asyncio
+import math
+
+import pytest
+
+from profiler import LoopProfiler
+
+
+@pytest.mark.parametrize("seconds", [0, -1, math.nan, math.inf])
+def test_profile_rejects_bad_duration(seconds):
+    with pytest.raises(ValueError):
+        asyncio.run(LoopProfiler().profile(seconds))
+
+
+def test_profile_samples_the_loop():
+    profiler = LoopProfiler()
+    result = asyncio.run(profiler.profile(0.2))
+    assert result.samples > 0
+    assert not profiler.running
+    assert result.collapsed().startswith("[")
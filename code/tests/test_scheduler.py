@@ -0,0 +1,68 @@
+import asyncio
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+import metrics
+from scheduler import DelayedActions
+
+
+class Bot:
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.deleted = []
+
+    async def delete_message(self, chat_id, message_id):
+        if self.fail:
+            raise RuntimeError("message to delete not found")
+        self.deleted.append((chat_id, message_id))
+
+
+def delete_later(actions: DelayedActions, bot: Bot, scheduler: AsyncIOScheduler | None = None):
+    """
+    deletes message 2 in chat 1 a moment later
+    :return: messages deleted right after the call and after the delay
+    """
+    async def main():
+        if scheduler is not None:
+            scheduler.start()
+        try:
+            actions.delete_message_later(bot, 1, 2, 0.05)
+            before = list(bot.deleted)
+            await asyncio.sleep(0.2)
+            return before, list(bot.deleted)
+        finally:
+            if scheduler is not None:
+                scheduler.shutdown(wait=False)
+
+    return asyncio.run(main())
+
+
+def test_messages_are_deleted_by_the_scheduler():
+    actions, bot, scheduler = DelayedActions(), Bot(), AsyncIOScheduler()
+    actions.add_scheduler(scheduler)
+    jobs = metrics.job_seconds.samples()
+    assert delete_later(actions, bot, scheduler) == ([], [(1, 2)])
+    assert metrics.job_seconds.samples() != jobs
+
+
+def test_messages_are_deleted_on_the_loop_without_a_running_scheduler():
+    actions, bot = DelayedActions(), Bot()
+    actions.add_scheduler(AsyncIOScheduler())
+    assert delete_later(actions, bot) == ([], [(1, 2)])
+    assert delete_later(DelayedActions(), bot) == ([(1, 2)], [(1, 2), (1, 2)])
+
+
+def test_plain_functions_are_called_later_on_the_loop():
+    actions, calls = DelayedActions(), []
+
+    async def main():
+        actions.call_later(0.01, calls.append, "called")
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert calls == ["called"]
+
+
+def test_failed_deletion_is_ignored():
+    assert delete_later(DelayedActions(), Bot(fail=True)) == ([], [])
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+
+import pytest
+
+import spotify_errors
+from config_reader import config
+from data_base import DataBase
+from sessions import SessionRegistry
+from spotify import AsyncSpotify
+from state_store import MemoryStateStore
+
+
+@pytest.fixture
+def file_admins(monkeypatch):
+    monkeypatch.setattr(DataBase, "_load_admins", lambda self: {5: "boss"})
+
+
+def test_file_admins_administrate_sessions_they_join(file_admins):
+    db = DataBase(1, "owner")
+    assert db.admins == {5: "boss", 1: "owner"}
+    assert db.users == {1: "owner"}
+    assert DataBase().users == {5: "boss"}
+
+
+def saved_session(store) -> str:
+    db = DataBase(1, "owner", store)
+    db.add_user(2, "guest")
+    db.set_token()
+    return db.token
+
+
+def restore_with(monkeypatch, error):
+    async def authorize(self, url=None):
+        raise error
+
+    monkeypatch.setattr(AsyncSpotify, "authorize", authorize)
+    store = MemoryStateStore()
+    token = saved_session(store)
+    registry = SessionRegistry(store)
+
+    async def main():
+        session = await registry.load(token)
+        if session is not None:
+            await session.spotify.close()
+        return session
+
+    return asyncio.run(main())
+
+
+def test_session_without_active_device_is_restored(monkeypatch):
+    session = restore_with(monkeypatch, spotify_errors.ConnectionError("there is no active device"))
+    assert session is not None
+    assert set(session.db.users) == {1, 2}
+
+
+def test_session_without_spotify_token_is_not_restored(monkeypatch):
+    assert restore_with(monkeypatch, spotify_errors.AuthorizationError()) is None
+
+
+def test_unexpected_restore_error_is_logged(monkeypatch, caplog):
+    with caplog.at_level(logging.ERROR, logger="sessions"):
+        assert restore_with(monkeypatch, KeyError("access_token")) is None
+    assert "can't restore session" in caplog.text
+
+
+def test_only_the_leader_runs_periodic_updates(monkeypatch):
+    from handlers import leader_only
+
+    store = MemoryStateStore()
+    first, second = SessionRegistry(store), SessionRegistry(store)
+    calls = []
+
+    async def update(*args):
+        calls.append(args)
+
+    async def main():
+        assert await first.lead(10)
+        assert not await second.lead(10)
+        for registry in (first, second):
+            monkeypatch.setattr("handlers.sessions", registry)
+            await leader_only(update)(registry.worker_id)
+
+    asyncio.run(main())
+    assert calls == [(first.worker_id,)]
+    assert leader_only(update).__name__ == "update"
+
+
+class CountingStore(MemoryStateStore):
+
+    def __init__(self):
+        super().__init__()
+        self.lookups = 0
+
+    def user_session(self, user_id):
+        self.lookups += 1
+        return super().user_session(user_id)
+
+
+def test_lobby_users_are_not_looked_up_on_every_update():
+    store = CountingStore()
+    registry = SessionRegistry(store)
+
+    async def main():
+        for _ in range(10):
+            assert await registry.resolve(7) is registry.lobby
+        # a user joining here is seen at once
+        session = await registry.create(1, "owner")
+        registry.activate(session)
+        registry.join(7, "guest", session)
+        assert await registry.resolve(7) is session
+        await registry.end(session)
+
+    asyncio.run(main())
+    assert store.lookups == 1
+
+
+def test_token_of_single_session_setups_is_taken_over(monkeypatch, tmp_path):
+    legacy = tmp_path / "token.json"
+    legacy.write_text("{}")
+    monkeypatch.setattr(config, "token_file", type(config.token_file)(str(legacy)))
+    path = SessionRegistry._token_file(1)
+    assert path == str(tmp_path / "token_1.json")
+    assert not legacy.exists() and (tmp_path / "token_1.json").read_text() == "{}"
+    # other owners get a file of their own
+    assert SessionRegistry._token_file(2) == str(tmp_path / "token_2.json")
+    assert not (tmp_path / "token_2.json").exists()
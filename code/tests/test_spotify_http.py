@@ -0,0 +1,83 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+import asyncspotify
+import pytest
+from aiohttp import web
+
+import spotify_errors
+from config_reader import config
+from spotify_http import PooledHTTP
+
+
+def request_with(monkeypatch, answers, method="GET"):
+    """
+    sends one request to a server answering with the statuses in turn
+    :return: result or raised error and number of requests the server got
+    """
+    received = []
+
+    async def handler(request):
+        status, headers = answers[min(len(received), len(answers) - 1)]
+        received.append(request.method)
+        return web.json_response({"status": status}, status=status, headers=headers)
+
+    async def main():
+        app = web.Application()
+        app.router.add_route("*", "/v1/me/player", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "localhost", 0)
+        await site.start()
+        monkeypatch.setattr(config, "spotify_api_url", f"http://localhost:{runner.addresses[0][1]}")
+        client = SimpleNamespace(auth=SimpleNamespace(header={"Authorization": "Bearer stand-in"}))
+        http = PooledHTTP(client)
+        try:
+            return await http.request(asyncspotify.Route(method, "me/player"))
+        except Exception as error:
+            return error
+        finally:
+            await http.session.close()
+            await runner.cleanup()
+
+    return asyncio.run(main()), len(received)
+
+
+@pytest.fixture(autouse=True)
+def short_backoff(monkeypatch):
+    monkeypatch.setattr(PooledHTTP, "_backoff", lambda self, attempt: 0.001)
+
+
+def test_server_errors_of_safe_requests_are_retried(monkeypatch):
+    assert request_with(monkeypatch, [(503, {}), (502, {}), (200, {})]) == ({"status": 200}, 3)
+
+
+def test_server_errors_of_unsafe_requests_are_not_retried(monkeypatch):
+    result, received = request_with(monkeypatch, [(500, {}), (200, {})], method="POST")
+    assert isinstance(result, spotify_errors.ServiceUnavailable) and received == 1
+
+
+def test_retry_after_is_honored_within_the_budget(monkeypatch):
+    assert request_with(monkeypatch, [(429, {"Retry-After": "0.01"}), (200, {})]) == ({"status": 200}, 2)
+    result, received = request_with(monkeypatch, [(429, {"Retry-After": "60"})])
+    assert isinstance(result, spotify_errors.RateLimited) and result.retry_after == 60 and received == 1
+
+
+def test_retry_after_may_be_a_date(monkeypatch):
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=120), usegmt=True)
+    result, received = request_with(monkeypatch, [(429, {"Retry-After": later})])
+    assert isinstance(result, spotify_errors.RateLimited) and 100 < result.retry_after <= 120 and received == 1
+    assert PooledHTTP._retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+
+
+def test_invalid_retry_after_falls_back_to_backoff(monkeypatch):
+    for value in ("soon", "nan"):
+        assert request_with(monkeypatch, [(429, {"Retry-After": value}), (200, {})]) == ({"status": 200}, 2)
+    assert request_with(monkeypatch, [(429, {}), (200, {})]) == ({"status": 200}, 2)
+
+
+def test_attempts_are_limited(monkeypatch):
+    result, received = request_with(monkeypatch, [(503, {})])
+    assert isinstance(result, spotify_errors.ServiceUnavailable) and received == config.spotify_max_attempts
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+import spotify_errors
+from cache import TTLCache
+from spotify import AsyncSpotify
+
+
+@pytest.fixture(autouse=True)
+def search_cache(monkeypatch):
+    cache = TTLCache(ttl=10)
+    monkeypatch.setattr(AsyncSpotify, "_search_cache", cache)
+    return cache
+
+
+def client(results, calls) -> AsyncSpotify:
+    spotify = AsyncSpotify()
+
+    async def search(query):
+        calls.append((spotify, query))
+        await asyncio.sleep(0.01)
+        if isinstance(results, Exception):
+            raise results
+        return results
+
+    spotify._search = search
+    return spotify
+
+
+def test_query_is_normalized():
+    assert AsyncSpotify.normalize_query("  Daft   PUNK\tAround ") == "daft punk around"
+    assert AsyncSpotify.normalize_query("STRASSE") == AsyncSpotify.normalize_query("strasse")
+
+
+def test_equal_queries_of_sessions_share_one_search(search_cache):
+    calls = []
+
+    async def main():
+        first, second = client([["id", "artist", "name"]], calls), client([], calls)
+        results = await asyncio.gather(first.search("Daft Punk"), second.search("daft  punk"))
+        await asyncio.gather(first.close(), second.close())
+        return results
+
+    assert asyncio.run(main()) == [[["id", "artist", "name"]]] * 2
+    assert len(calls) == 1 and calls[0][1] == "daft punk"
+    assert search_cache.stats.coalesced == 1
+
+
+def test_failed_search_of_another_session_is_made_again(search_cache):
+    calls = []
+
+    async def main():
+        expired = client(spotify_errors.RateLimited(30), calls)
+        working = client([["id", "artist", "name"]], calls)
+        results = await asyncio.gather(expired.search("song"), working.search("song"), return_exceptions=True)
+        await asyncio.gather(expired.close(), working.close())
+        return results
+
+    failed, found = asyncio.run(main())
+    assert isinstance(failed, spotify_errors.RateLimited)
+    assert found == [["id", "artist", "name"]]
+    assert len(calls) == 2
+    assert search_cache.peek("song") == found
@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from spotify_stand_in import SpotifyStandIn
+
+
+def with_client(stand_in: SpotifyStandIn, scenario):
+    """
+    runs the scenario against the stand-in with an authorized test client
+    :param scenario: coroutine function (client, headers) -> result
+    """
+    async def main():
+        async with TestClient(TestServer(stand_in.app())) as client:
+            response = await client.post("/accounts/api/token", data={"grant_type": "authorization_code"})
+            token = (await response.json())["access_token"]
+            return await scenario(client, {"Authorization": f"Bearer {token}"})
+
+    return asyncio.run(main())
+
+
+def test_token_is_required():
+    async def scenario(client, headers):
+        refused = await client.post("/accounts/api/token", data={"grant_type": "password"})
+        anonymous = await client.get("/v1/me/player")
+        authorized = await client.get("/v1/me/player", headers=headers)
+        return refused.status, anonymous.status, authorized.status
+
+    assert with_client(SpotifyStandIn(tracks=10), scenario) == (400, 401, 200)
+
+
+def test_player_follows_the_queue():
+    async def scenario(client, headers):
+        player = await (await client.get("/v1/me/player", headers=headers)).json()
+        track = (await (await client.get("/v1/search", params={"q": "track 7", "limit": 1}, headers=headers)).json())
+        uri = track["tracks"]["items"][0]["uri"]
+        added = await client.post("/v1/me/player/queue", params={"uri": uri}, headers=headers)
+        queue = await (await client.get("/v1/me/player/queue", headers=headers)).json()
+        await client.post("/v1/me/player/next", headers=headers)
+        await client.put("/v1/me/player/pause", headers=headers)
+        playing = await (await client.get("/v1/me/player/currently-playing", headers=headers)).json()
+        await client.post("/v1/me/player/previous", headers=headers)
+        previous = await (await client.get("/v1/me/player/currently-playing", headers=headers)).json()
+        return player, uri, added.status, queue, playing, previous
+
+    player, uri, added, queue, playing, previous = with_client(SpotifyStandIn(tracks=10), scenario)
+    assert player["item"]["name"] == "Track 0 (Remix)" and player["device"]["id"] == "device0"
+    assert added == 204 and queue["queue"][0]["uri"] == uri and len(queue["queue"]) == 20
+    assert playing["item"]["uri"] == uri and not playing["is_playing"]
+    assert previous["item"]["name"] == "Track 0 (Remix)" and previous["is_playing"]
+
+
+def test_devices_and_volume():
+    async def scenario(client, headers):
+        missing = await client.put("/v1/me/player", json={"device_ids": ["nowhere"]}, headers=headers)
+        moved = await client.put("/v1/me/player", json={"device_ids": ["device1"]}, headers=headers)
+        volume = await client.put("/v1/me/player/volume", params={"volume_percent": 150}, headers=headers)
+        devices = await (await client.get("/v1/me/player/devices", headers=headers)).json()
+        return missing.status, moved.status, volume.status, devices["devices"]
+
+    missing, moved, volume, devices = with_client(SpotifyStandIn(tracks=10), scenario)
+    assert (missing, moved, volume) == (404, 204, 204)
+    assert [(device["id"], device["is_active"], device["volume_percent"]) for device in devices] == \
+           [("device0", False, 50), ("device1", True, 100)]
+
+
+def test_responses_are_delayed_by_the_latency():
+    async def scenario(client, headers):
+        start = time.perf_counter()
+        await client.get("/v1/me/player/devices", headers=headers)
+        return time.perf_counter() - start
+
+    assert 0.08 <= with_client(SpotifyStandIn(tracks=10, latency=0.1, jitter=0.02), scenario) < 0.5
+
+
+def test_server_errors_are_injected_at_the_error_rate():
+    stand_in = SpotifyStandIn(tracks=10, error_rate=0.3)
+
+    async def scenario(client, headers):
+        return [(await client.get("/v1/me/player", headers=headers)).status for _ in range(200)]
+
+    statuses = with_client(stand_in, scenario)
+    assert set(statuses) == {200, 500}
+    assert 30 < statuses.count(500) < 90
+    # the stats endpoint used by benchmarks counts requests by route
+    assert stand_in.requests["GET /v1/me/player"] == 200 and stand_in.status_codes[500] == statuses.count(500)
+
+
+def test_requests_over_the_rate_get_retry_after():
+    async def scenario(client, headers):
+        responses = [await client.get("/v1/me/player", headers=headers) for _ in range(4)]
+        stats = await (await client.get("/stats")).json()
+        return [(response.status, response.headers.get("Retry-After")) for response in responses], stats
+
+    answers, stats = with_client(SpotifyStandIn(tracks=10, rate=1, burst=2), scenario)
+    assert answers == [(200, None), (200, None), (429, "1"), (429, "1")]
+    assert stats["status_codes"] == {"200": 3, "429": 2}
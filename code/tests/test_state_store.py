@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from redis_stand_in import RedisStandIn
+from state_store import JournalStateStore, MemoryStateStore, StateConflict, StateStore, create_state_store
+
+
+@pytest.fixture
+def redis_url():
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(RedisStandIn().serve("127.0.0.1", 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield f"redis://127.0.0.1:{server.sockets[0].getsockname()[1]}/0"
+
+    async def shutdown():
+        server.close()
+        connections = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in connections:
+            task.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+
+    asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+@pytest.fixture(params=["memory", "file", "sqlite", "redis"])
+def store(request, tmp_path):
+    url = request.getfixturevalue("redis_url") if request.param == "redis" else ""
+    store = create_state_store(request.param, url, str(tmp_path))
+    yield store
+    store.close()
+
+
+def test_save_based_on_outdated_version_is_refused(store):
+    assert store.save("t", {"n": 1}, None) == 1
+    with pytest.raises(StateConflict):
+        store.save("t", {"n": 0}, None)
+    assert store.save("t", {"n": 2}, 1) == 2
+    with pytest.raises(StateConflict):
+        store.save("t", {"n": 3}, 1)
+    assert store.load("t") == ({"n": 2}, 2)
+    store.delete("t")
+    with pytest.raises(StateConflict):
+        store.save("t", {"n": 3}, 2)
+    assert store.load("t") is None
+
+
+def test_users_follow_their_sessions(store):
+    store.save("t", {}, None)
+    store.set_user_session(1, "t")
+    store.set_user_session(2, "t")
+    store.set_user_session(2, None)
+    assert store.user_session(1) == "t" and store.user_session(2) is None
+    assert store.tokens() == ["t"]
+    store.delete("t")
+    assert store.user_session(1) is None and store.tokens() == []
+
+
+def test_lease_is_held_by_one_owner_until_it_expires(store):
+    assert store.acquire_lease("updates", "a", 0.2)
+    assert not store.acquire_lease("updates", "b", 0.2)
+    # the holder extends its lease
+    assert store.acquire_lease("updates", "a", 0.2)
+    time.sleep(0.3)
+    assert store.acquire_lease("updates", "b", 10)
+    assert not store.acquire_lease("updates", "a", 10)
+
+
+def test_blocking_store_is_called_off_the_loop(tmp_path):
+    store = create_state_store("sqlite", "", str(tmp_path))
+
+    async def main():
+        loop_thread = threading.get_ident()
+        store.submit(store.save, "t", {"n": 1}, None)
+        # calls are executed in order, so the submitted save is done before the load
+        item = await store.call(store.load, "t")
+        thread = await store.call(threading.get_ident)
+        return item, thread != loop_thread
+
+    assert asyncio.run(main()) == (({"n": 1}, 1), True)
+    store.close()
+
+
+def test_memory_store_keeps_a_copy_of_the_state():
+    store = MemoryStateStore()
+    state = {"users": {"1": "a"}}
+    assert store.save("t", state, None) == 1
+    state["users"]["2"] = "b"
+    assert store.load("t") == ({"users": {"1": "a"}}, 1)
+    assert store.save("t", state, 1) == 2
+    assert store.version("t") == 2
+
+
+def test_memory_store_drops_users_of_deleted_session():
+    store = MemoryStateStore()
+    store.save("t", {}, None)
+    store.set_user_session(1, "t")
+    store.set_user_session(2, "other")
+    store.delete("t")
+    assert store.load("t") is None
+    assert store.user_session(1) is None
+    assert store.user_session(2) == "other"
+
+
+def test_journal_recovers_without_a_loop(tmp_path):
+    file_name = str(tmp_path / "state.json")
+    store = JournalStateStore(file_name)
+    store.save("t", {"n": 1}, None)
+    store.save("t", {"n": 2}, 1)
+    store.set_user_session(1, "t")
+    store.save("gone", {}, None)
+    store.delete("gone")
+    store.close()
+
+    recovered = JournalStateStore(file_name)
+    assert recovered.load("t") == ({"n": 2}, 2)
+    assert recovered.user_session(1) == "t"
+    assert recovered.load("gone") is None
+
+
+def test_journal_skips_torn_record(tmp_path):
+    file_name = str(tmp_path / "state.json")
+    store = JournalStateStore(file_name)
+    store.save("t", {"n": 1}, None)
+    store.close()
+    with open(file_name + ".journal", "a", encoding="utf-8") as file:
+        file.write('{"op": "save", "tok')
+
+    assert JournalStateStore(file_name).load("t") == ({"n": 1}, 1)
+
+
+def test_journal_compacts_into_snapshot(tmp_path):
+    file_name = str(tmp_path / "state.json")
+    store = JournalStateStore(file_name, compact_after=4)
+    for n in range(4):
+        store.save("t", {"n": n}, store.version("t"))
+    store.close()
+
+    assert not (tmp_path / "state.json.journal").exists()
+    assert JournalStateStore(file_name).load("t") == ({"n": 3}, 4)
+
+
+def test_journal_flushes_changes_made_during_a_write(tmp_path):
+    file_name = str(tmp_path / "state.json")
+    store = JournalStateStore(file_name, flush_interval=0.01)
+    started, release = threading.Event(), threading.Event()
+    write = store._write
+
+    def slow_write(records):
+        started.set()
+        release.wait(5)
+        write(records)
+
+    store._write = slow_write
+
+    async def main():
+        store.save("a", {"n": 1}, None)
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        # the first write is in progress, this change must not wait for another save to be flushed
+        store.save("b", {"n": 2}, None)
+        release.set()
+        await asyncio.wait_for(store._flush_task, 5)
+
+    asyncio.run(main())
+    assert store._pending == {}
+    # nothing is left for close() to write, so recovery proves the background flush wrote both
+    recovered = JournalStateStore(file_name)
+    assert recovered.load("a") == ({"n": 1}, 1)
+    assert recovered.load("b") == ({"n": 2}, 1)
+
+
+def test_journal_keeps_changes_of_a_failed_flush(tmp_path):
+    store = JournalStateStore(str(tmp_path / "state.json"), flush_interval=0.01)
+    write, calls = store._write, []
+
+    def failing_write(records):
+        calls.append(records)
+        if len(calls) == 1:
+            raise OSError("disk full")
+        write(records)
+
+    store._write = failing_write
+
+    async def main():
+        store.save("a", {"n": 1}, None)
+        await asyncio.wait_for(store._flush_task, 5)
+
+    asyncio.run(main())
+    assert len(calls) == 2 and calls[1] == calls[0]
+    assert JournalStateStore(str(tmp_path / "state.json")).load("a") == ({"n": 1}, 1)
+
+
+def test_store_must_implement_every_operation():
+    class PartialStore(StateStore):
+        def load(self, token):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialStore()
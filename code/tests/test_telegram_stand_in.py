@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from telegram_stand_in import TelegramStandIn
+from token_bucket import TokenBucket
+
+
+def test_rate_limit_refuses_with_time_to_wait():
+    limit = TokenBucket(rate=1, capacity=2)
+    assert limit.take() == 0 and limit.take() == 0
+    assert 0.9 < limit.take() <= 1
+    limit.give_back()
+    assert limit.take() == 0
+
+
+def test_chat_over_its_limit_gets_retry_after():
+    async def main():
+        telegram = TelegramStandIn(global_rate=None)
+        bot = Bot("42:stand-in", session=telegram)
+        for _ in range(TelegramStandIn.PER_CHAT_BURST):
+            await bot.send_message(chat_id=1, text="hi")
+        # other chats are not affected
+        await bot.send_message(chat_id=2, text="hi")
+        with pytest.raises(TelegramRetryAfter) as error:
+            await bot.send_message(chat_id=1, text="hi")
+        assert error.value.retry_after == 1
+        return telegram
+
+    telegram = asyncio.run(main())
+    assert telegram.rate_limited["sendMessage"] == 1
+
+
+def test_edits_fail_like_telegram():
+    async def main():
+        bot = Bot("42:stand-in", session=TelegramStandIn(global_rate=None, per_chat_rate=None))
+        message = await bot.send_message(chat_id=1, text="menu")
+        with pytest.raises(TelegramBadRequest, match="not modified"):
+            await bot.edit_message_text(chat_id=1, message_id=message.message_id, text="menu")
+        await bot.delete_message(chat_id=1, message_id=message.message_id)
+        with pytest.raises(TelegramBadRequest, match="not found"):
+            await bot.edit_message_text(chat_id=1, message_id=message.message_id, text="queue")
+
+    asyncio.run(main())
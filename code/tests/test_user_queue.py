@@ -0,0 +1,47 @@
+from user_queue import UserQueue
+
+
+def test_same_song_may_be_queued_by_several_users():
+    queue = UserQueue([(1, "a"), (2, "a"), (1, "b")])
+    assert queue.count("a") == 2 and queue.owner("a") == 1 and queue.owner("a", 1) == 2
+    assert queue.remove(2, "a") and not queue.remove(2, "a")
+    assert list(queue) == [(1, "a"), (1, "b")]
+
+
+def test_removed_entries_are_compacted():
+    queue = UserQueue((1, str(song)) for song in range(100))
+    for song in range(90):
+        queue.remove(1, str(song))
+    assert len(queue) == 10 and len(queue._order) <= 2 * len(queue) + 32
+    assert [song for _, song in queue] == [str(song) for song in range(90, 100)]
+
+
+def test_trim_drops_songs_queued_before():
+    queue = UserQueue([(1, "a"), (2, "b"), (1, "c")])
+    assert queue.trim_to("b") and list(queue) == [(2, "b"), (1, "c")]
+    assert not queue.trim_to("x") and not queue
+
+
+def test_reconcile_drops_songs_played_before_matched_ones():
+    queue = UserQueue([(1, "a"), (2, "b"), (1, "c")])
+    assert queue.reconcile(["b", "x", "c"]) == ([2, None, 1], 1)
+    assert list(queue) == [(2, "b"), (1, "c")]
+    # the same spotify queue is answered from the last reconciliation
+    assert queue.reconcile(["b", "x", "c"]) == ([2, None, 1], 0)
+
+
+def test_reconcile_keeps_songs_beyond_the_reported_queue():
+    queue = UserQueue([(1, "a"), (2, "b")])
+    assert queue.reconcile(["a"]) == ([1], 0)
+    assert list(queue) == [(1, "a"), (2, "b")]
+    # other tracks after the last match mean the rest was played or removed
+    assert queue.reconcile(["a", "x"]) == ([1, None], 1)
+    assert list(queue) == [(1, "a")]
+
+
+def test_reconcile_matches_copies_in_play_order():
+    queue = UserQueue([(1, "a"), (2, "a")])
+    assert queue.reconcile(["a", "a"]) == ([1, 2], 0)
+    assert queue.reconcile(["a"]) == ([1], 0)
+    queue.append(3, "b")
+    assert queue.reconcile([]) == ([], 3) and not queue
@@ -0,0 +1,37 @@
+from last_message import ViewKind, view_of
+from views import MenuModel, QueueModel, Role, ViewCache, content_hash, render_menu_text, render_queue_text
+
+MENU = MenuModel(("artist", "guest"), "song (remastered)", 40, 3)
+
+
+def test_equal_models_render_to_equal_text():
+    assert render_menu_text(MENU) == render_menu_text(MenuModel(*MENU))
+    assert render_menu_text(MENU) != render_menu_text(MENU._replace(volume=41))
+    # the volume isn't shown while the player is paused
+    assert "%" not in render_menu_text(MENU._replace(volume=None))
+    assert view_of(render_menu_text(MENU))[0] == ViewKind.MENU
+
+
+def test_queue_shows_who_queued_tracks():
+    text = render_queue_text(QueueModel((("song (remastered)", "user"), ("other", None))))
+    assert "song  - поставил(а) @user" in text and "other\n" in text
+    assert view_of(text)[0] == view_of(render_queue_text(QueueModel(())))[0] == ViewKind.QUEUE
+
+
+def test_cache_shares_renderings_of_equal_models():
+    cache = ViewCache(max_size=2)
+    builds = []
+
+    def markup():
+        builds.append(1)
+        return None
+
+    admin = cache.render(ViewKind.MENU, Role.ADMIN, 0, MENU, markup)
+    assert cache.render(ViewKind.MENU, Role.ADMIN, 0, MenuModel(*MENU), markup) is admin
+    user = cache.render(ViewKind.MENU, Role.USER, 0, MENU, markup)
+    # the same text with another keyboard is another view
+    assert user.text == admin.text and user.content_hash != admin.content_hash
+    assert admin.content_hash == content_hash(admin.text, Role.ADMIN, 0)
+    assert (cache.hits, cache.misses, len(builds)) == (1, 2, 2)
+    cache.render(ViewKind.QUEUE, Role.USER, 0, QueueModel(()), markup)
+    assert len(cache) == 2
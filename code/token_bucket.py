@@ -0,0 +1,54 @@
+"""
+token bucket used on both sides of rate limits: the bot paces its own calls with acquire() in broadcast.py,
+the api stand-ins refuse requests over the limit with the time to wait from take(), the way telegram and spotify do
+"""
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    refilled with rate tokens per second up to capacity
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self._tokens >= self._capacity
+
+    def take(self) -> float:
+        """
+        :return: 0 if a token was taken, otherwise seconds until there is one
+        """
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    def give_back(self):
+        """
+        returns the token of a request which was refused by another limit
+        """
+        self._tokens = min(self._capacity, self._tokens + 1)
+
+    async def acquire(self):
+        """
+        waits until a token is taken
+        """
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
@@ -0,0 +1,146 @@
+from collections import deque
+
+
+class UserQueue:
+    """
+    tracks queued by users in play order, as (user_id, song_id) entries,
+    the same song may be queued several times, even by different users
+    """
+
+    def __init__(self, entries=()):
+        # entries get increasing sequence numbers, so order of sequence numbers is the play order
+        self._entries: dict[int, tuple[int, str]] = {}
+        self._order: deque[int] = deque()
+        self._by_song: dict[str, deque[int]] = {}
+        self._next_seq = 0
+        # last reconciled spotify queue and owners of its tracks, valid while the queue is not modified
+        self._reconciled: tuple[tuple[str, ...], list] | None = None
+        for user_id, song_id in entries:
+            self.append(user_id, song_id)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __bool__(self):
+        return len(self._entries) > 0
+
+    def __iter__(self):
+        for seq in list(self._order):
+            entry = self._entries.get(seq)
+            if entry is not None:
+                yield entry
+
+    def __contains__(self, song_id):
+        return song_id in self._by_song
+
+    def __repr__(self):
+        return f"UserQueue({list(self)})"
+
+    def append(self, user_id, song_id):
+        seq = self._next_seq
+        self._next_seq += 1
+        self._entries[seq] = (user_id, song_id)
+        self._order.append(seq)
+        self._by_song.setdefault(song_id, deque()).append(seq)
+        self._reconciled = None
+
+    def _unlink(self, seq):
+        self._reconciled = None
+        user_id, song_id = self._entries.pop(seq)
+        seqs = self._by_song[song_id]
+        if seqs[0] == seq:
+            seqs.popleft()
+        else:
+            seqs.remove(seq)
+        if not seqs:
+            del self._by_song[song_id]
+
+    def remove(self, user_id, song_id) -> bool:
+        """
+        removes the earliest entry of the song queued by the user
+        """
+        for seq in self._by_song.get(song_id, ()):
+            if self._entries[seq][0] == user_id:
+                self._unlink(seq)
+                # seq stays in the order as a tombstone, skipped by iteration and dropped on compaction
+                if len(self._order) > 2 * len(self._entries) + 32:
+                    self._order = deque(seq for seq in self._order if seq in self._entries)
+                return True
+        return False
+
+    def owner(self, song_id, occurrence=0):
+        """
+        :return: user who queued the occurrence-th copy of the song or None
+        """
+        seqs = self._by_song.get(song_id)
+        if seqs is None or occurrence >= len(seqs):
+            return None
+        return self._entries[seqs[occurrence]][0]
+
+    def count(self, song_id) -> int:
+        return len(self._by_song.get(song_id, ()))
+
+    def trim_to(self, song_id) -> bool:
+        """
+        drops entries queued before the first copy of the song, everything if there is no such song
+        :return: True if the song is in the queue
+        """
+        seqs = self._by_song.get(song_id)
+        if seqs is None:
+            self.clear()
+            return False
+        first = seqs[0]
+        while self._order and self._order[0] < first:
+            seq = self._order.popleft()
+            if seq in self._entries:
+                self._unlink(seq)
+        return True
+
+    def reconcile(self, song_ids) -> tuple[list, int]:
+        """
+        aligns the queue with upcoming tracks reported by spotify, tracks queued through the bot are matched
+        in play order and entries left behind the matched ones are considered played and dropped,
+        entries after the last matched one are kept while they may be beyond the end of the reported queue
+        :param song_ids: ids of the spotify queue in play order
+        :return: owner of every reported track or None for tracks not queued through the bot, number of dropped entries
+        """
+        song_ids = tuple(song_ids)
+        if self._reconciled is not None and self._reconciled[0] == song_ids:
+            return list(self._reconciled[1]), 0
+        owners = []
+        matched = []
+        last_seq = -1
+        for song_id in song_ids:
+            owner = None
+            for seq in self._by_song.get(song_id, ()):
+                if seq > last_seq:
+                    owner = self._entries[seq][0]
+                    matched.append(seq)
+                    last_seq = seq
+                    break
+            owners.append(owner)
+        # entries after the last match are gone too if spotify reports other tracks after it
+        tail_visible = not song_ids or owners[-1] is None
+        matched = set(matched)
+        kept = deque()
+        dropped = 0
+        # only the region up to the last match is walked unless the whole tail is gone
+        while self._order and (tail_visible or self._order[0] <= last_seq):
+            seq = self._order.popleft()
+            if seq not in self._entries:
+                continue
+            if seq in matched:
+                kept.append(seq)
+            else:
+                self._unlink(seq)
+                dropped += 1
+        kept.extend(self._order)
+        self._order = kept
+        self._reconciled = (song_ids, owners)
+        return list(owners), dropped
+
+    def clear(self):
+        self._reconciled = None
+        self._entries.clear()
+        self._order.clear()
+        self._by_song.clear()
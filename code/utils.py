@@ -1,16 +1,38 @@
+import os
 import random
 import json
+import tempfile
+import threading
 from string import ascii_letters, digits
 
+_admins_lock = threading.Lock()
+
 
 def generate_token(length) -> str:
     token = ''.join([random.choice(ascii_letters + digits) for _ in range(length)])
     return token
 
 
+def atomic_write(file_name, text: str):
+    """
+    replaces the file with the text, readers see either the old or the new content even if writing is interrupted
+    """
+    directory = os.path.dirname(os.path.abspath(file_name))
+    descriptor, temp_name = tempfile.mkstemp(dir=directory, prefix=os.path.basename(file_name), suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, 'w', encoding="utf-8") as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_name, file_name)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+
 def update_admins(user_id, user_name):
-    with open("../data/admins.json", 'r', encoding="utf-8") as file:
-        before = json.load(file)
-    before[str(user_id)] = user_name
-    with open('../data/admins.json', 'w', encoding="utf-8") as file:
-        file.write(json.dumps(before, indent=4, ensure_ascii=False))
+    with _admins_lock:
+        with open("../data/admins.json", 'r', encoding="utf-8") as file:
+            before = json.load(file)
+        before[str(user_id)] = user_name
+        atomic_write('../data/admins.json', json.dumps(before, indent=4, ensure_ascii=False))
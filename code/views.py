@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from enum import Enum
+from hashlib import blake2b
+from typing import Callable, NamedTuple
+
+from aiogram.types import InlineKeyboardMarkup
+
+from last_message import ViewKind
+
+
+class Role(Enum):
+    ADMIN = "admin"
+    USER = "user"
+
+
+class MenuModel(NamedTuple):
+    artists: tuple[str, ...] | None
+    name: str | None
+    # None while the player is paused, the volume isn't shown then
+    volume: int | None
+    users: int
+
+
+class QueueModel(NamedTuple):
+    # name of every track and name of the user who queued it or None
+    tracks: tuple[tuple[str, str | None], ...]
+
+
+class RenderedView(NamedTuple):
+    text: str
+    markup: InlineKeyboardMarkup | None
+    content_hash: int
+
+
+_ARTIST_EMOJIS = '🥺🤫😐🙄😮😄😆🥹🙂😌😙😎😏🤩😋🥶🥵🤭🤔😈'
+_VOLUME_EMOJIS = "🔇🔈🔉🔊"
+
+
+def _stable_hash(text: str) -> int:
+    return int.from_bytes(blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def artist_emoji(artist: str) -> str:
+    # the same artist always gets the same emoji, so that an unchanged menu renders to the same text
+    return _ARTIST_EMOJIS[_stable_hash(artist) % len(_ARTIST_EMOJIS)]
+
+
+def volume_emoji(volume: int) -> str:
+    if volume == 0:
+        return _VOLUME_EMOJIS[0]
+    elif 0 < volume <= 33:
+        return _VOLUME_EMOJIS[1]
+    elif 33 < volume <= 66:
+        return _VOLUME_EMOJIS[2]
+    return _VOLUME_EMOJIS[3]
+
+
+def render_menu_text(model: MenuModel) -> str:
+    if model.name is None:
+        return f'🔥 людей в сессии: {model.users}'
+    volume = f"{volume_emoji(model.volume)}: {model.volume}%\n\n" if model.volume is not None else ""
+    return (f"🎧: {model.name}\n\n{''.join(artist_emoji(artist) for artist in model.artists)}️: "
+            f"{', '.join(model.artists)}\n\n" + volume + f"🔥 людей в сессии: {model.users}")
+
+
+def render_queue_text(model: QueueModel) -> str:
+    if not model.tracks:
+        return "в очереди нет треков"
+    lines = []
+    for name, author in model.tracks:
+        name = name[:name.find('(')] if '(' in name else name
+        lines.append(name + ('' if author is None else ' - поставил(а) @' + author))
+    return "треки в очереди:\n\n" + '\n\n'.join(lines) + '\n\n'
+
+
+RENDERERS = {
+    ViewKind.MENU: render_menu_text,
+    ViewKind.QUEUE: render_queue_text,
+}
+
+
+def content_hash(text: str, role: Role | None = None, mode: int | None = None) -> int:
+    """
+    hash of the text together with the keyboard variant it is shown with
+    """
+    return _stable_hash(text if role is None else f"{role.value}:{mode}:{text}")
+
+
+class ViewCache:
+    """
+    rendered text and markup of views, keyed by view kind, role, session mode and render model,
+    equal models of all sessions share one rendering
+    """
+
+    __MAX_SIZE = 1024
+
+    def __init__(self, max_size=__MAX_SIZE):
+        self._max_size = max_size
+        self._data: OrderedDict[tuple, RenderedView] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def render(self, kind: ViewKind, role: Role, mode: int, model: tuple,
+               markup_factory: Callable[[], InlineKeyboardMarkup | None]) -> RenderedView:
+        key = (kind, role, mode, model)
+        view = self._data.get(key)
+        if view is not None:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return view
+        self.misses += 1
+        text = RENDERERS[kind](model)
+        view = RenderedView(text, markup_factory(), content_hash(text, role, mode))
+        self._data[key] = view
+        if len(self._data) > self._max_size:
+            self._data.popitem(last=False)
+        return view
+
+
+view_cache = ViewCache()